@@ -0,0 +1,300 @@
+from algojudge import config, utils
+from algojudge.sandbox import SandboxResult
+from pathlib import Path
+from shutil import rmtree
+from threading import Event, Lock
+
+import atexit
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import uuid
+import zlib
+
+
+class ArtifactCache:
+    """An on-disk cache of compilation results, shared by every judge process.
+
+    Entries are keyed by a hash of everything that affects the compilation and
+    hold the compiled files along with the compiler's result and output, so
+    compile errors can be replayed as well. Entries are written to a temporary
+    directory and renamed into place, so concurrent writers never see each
+    other's partial entries. Once the cache grows beyond `max_size` bytes, the
+    least recently used entries are evicted."""
+
+    def __init__(self, root, max_size):
+        self.root = Path(root)
+        self.max_size = max_size
+
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_time = 0.0
+
+        (self.root / 'tmp').mkdir(parents=True, exist_ok=True)
+
+    def key(self, language, args, source):
+        h = hashlib.sha256()
+
+        # Upgrading the compiler should invalidate its artifacts, so its
+        # identity is part of the key.
+        try:
+            st = os.stat(args[0])
+            compiler = [st.st_size, st.st_mtime_ns]
+        except OSError:
+            compiler = None
+
+        h.update(json.dumps([language, args, compiler, config.SANDBOX_COMPILE_CONFIG.get_opts()]).encode())
+        h.update(b'\0')
+        h.update(source.encode('utf-8', errors='replace'))
+
+        return h.hexdigest()
+
+    def load(self, key, box):
+        """Restores the entry into the box's home and output files. Returns the
+        compiler's result, or `None` if the entry isn't cached."""
+        path = self._entry_path(key)
+
+        try:
+            with open(path / 'meta.json') as f:
+                meta = json.load(f)
+
+            for entry in os.scandir(path / 'files'):
+                utils.copy(entry.path, box.home_path / entry.name)
+            utils.copy(path / 'stdout', box.stdout_path)
+            utils.copy(path / 'stderr', box.stderr_path)
+
+            # Mark the entry as recently used.
+            os.utime(path)
+        except OSError:
+            # The entry doesn't exist, or was evicted while we were reading it.
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+            self.saved_time += meta['compile-time']
+
+        return SandboxResult(**meta['result'])
+
+    def store(self, key, box, result, compile_time, exclude=()):
+        """Stores everything in the box's home (except for `exclude`) along with
+        the compiler's result and output."""
+        tmp_path = self.root / 'tmp' / uuid.uuid4().hex
+        path = self._entry_path(key)
+
+        try:
+            (tmp_path / 'files').mkdir(parents=True)
+
+            size = 0
+            for entry in os.scandir(box.home_path):
+                if entry.name in exclude or not entry.is_file(follow_symlinks=False):
+                    continue
+                utils.copy(entry.path, tmp_path / 'files' / entry.name)
+                size += entry.stat().st_size
+
+            for name, src in (('stdout', box.stdout_path), ('stderr', box.stderr_path)):
+                utils.copy(src, tmp_path / name)
+                size += os.stat(src).st_size
+
+            with open(tmp_path / 'meta.json', 'w') as f:
+                json.dump({'result': result.to_json(), 'compile-time': compile_time, 'size': size}, f)
+
+            path.parent.mkdir(exist_ok=True)
+            os.rename(tmp_path, path)
+        except OSError:
+            # Most likely another worker has stored the same entry first.
+            rmtree(tmp_path, ignore_errors=True)
+            return
+
+        self._evict()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'saved-time': self.saved_time}
+
+    def _entry_path(self, key):
+        return self.root / key[:2] / key
+
+    def _evict(self):
+        with open(self.root / '.lock', 'w') as lock:
+            # Someone else is already evicting, so leave it to them.
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+
+            entries = []
+            total = 0
+            for path in self.root.glob('??/*'):
+                try:
+                    with open(path / 'meta.json') as f:
+                        size = json.load(f)['size']
+                    entries.append((path.stat().st_mtime, size, path))
+                except (OSError, ValueError, KeyError):
+                    continue
+                total += size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_size:
+                    break
+
+                # Move the entry out of the way first, so that it disappears
+                # all at once for readers.
+                tmp_path = self.root / 'tmp' / uuid.uuid4().hex
+                try:
+                    os.rename(path, tmp_path)
+                except OSError:
+                    continue
+                rmtree(tmp_path, ignore_errors=True)
+                total -= size
+
+
+class TestDataCache:
+    """Extracts the test data of each problem once, so that boxes can be given a
+    hardlink to it rather than a copy of their own.
+
+    Files are kept per version of the problem and verified against the CRC in
+    the archive when extracted. They are read-only, which is safe since every
+    box that links to a file is run as an unprivileged user."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+        # The files being extracted by this process, so that a file that's
+        # needed by more than one thread (e.g. one that's being prefetched) is
+        # only extracted once.
+        self.lock = Lock()
+        self.extracting = {}
+
+    def path(self, problem, name):
+        """Returns the path to a file of the problem's archive, extracting it if
+        it hasn't been already."""
+        info = problem.open_archive().getinfo(name)
+        path = self._version_path(problem) / name
+
+        while not self._exists(path, info):
+            with self.lock:
+                done = self.extracting.get(path)
+                if done is None:
+                    done = self.extracting[path] = Event()
+                    break
+
+            # Check again once the other extraction is over, since it may
+            # have failed.
+            done.wait()
+        else:
+            return path
+
+        try:
+            # It may have been extracted just before we took over.
+            if not self._exists(path, info):
+                self._extract(problem, info, path)
+        finally:
+            with self.lock:
+                del self.extracting[path]
+            done.set()
+
+        return path
+
+    def _exists(self, path, info):
+        try:
+            return os.stat(path).st_size == info.file_size
+        except FileNotFoundError:
+            return False
+
+    def _extract(self, problem, info, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.parent / f'.{path.name}.{uuid.uuid4().hex}'
+
+        try:
+            crc = 0
+            with problem.open_archive().open(info) as src, open(tmp_path, 'wb') as dst:
+                while chunk := src.read(1 << 20):
+                    crc = zlib.crc32(chunk, crc)
+                    dst.write(chunk)
+
+            if crc != info.CRC:
+                raise OSError(errno.EIO, f'Bad CRC for {info.filename!r} in the archive of {problem.code!r}')
+
+            os.chmod(tmp_path, 0o444)
+            os.rename(tmp_path, path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def link(self, problem, name, dst):
+        """Links a file of the problem's archive to `dst`, copying it instead if
+        the cache is on a different filesystem."""
+        src = self.path(problem, name)
+
+        try:
+            os.link(src, dst)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            utils.copy(src, dst)
+
+    def codes(self):
+        """Returns the codes of the problems that have files in the cache."""
+        try:
+            return [entry.name for entry in os.scandir(self.root) if entry.is_dir()]
+        except FileNotFoundError:
+            return []
+
+    def purge(self, code, keep=None):
+        """Removes the cached files of every version of the problem except for
+        `keep`."""
+        try:
+            entries = list(os.scandir(self.root / code))
+        except FileNotFoundError:
+            return
+
+        for entry in entries:
+            if entry.name != keep:
+                rmtree(entry.path, ignore_errors=True)
+
+    def _version_path(self, problem):
+        return self.root / problem.code / problem.version
+
+
+_artifact_cache = None
+_artifact_cache_lock = Lock()
+
+def get_artifact_cache():
+    """Returns the process-wide artifact cache, or `None` if it is disabled."""
+    global _artifact_cache
+
+    if config.ARTIFACT_CACHE_ROOT is None:
+        return None
+
+    with _artifact_cache_lock:
+        if _artifact_cache is None:
+            _artifact_cache = ArtifactCache(config.ARTIFACT_CACHE_ROOT, config.ARTIFACT_CACHE_MAX_SIZE)
+            atexit.register(_log_stats, _artifact_cache)
+        return _artifact_cache
+
+_testdata_cache = None
+_testdata_cache_lock = Lock()
+
+def get_testdata_cache():
+    """Returns the process-wide test data cache, or `None` if it is disabled."""
+    global _testdata_cache
+
+    if config.TESTDATA_CACHE_ROOT is None:
+        return None
+
+    with _testdata_cache_lock:
+        if _testdata_cache is None or _testdata_cache.root != Path(config.TESTDATA_CACHE_ROOT):
+            _testdata_cache = TestDataCache(config.TESTDATA_CACHE_ROOT)
+        return _testdata_cache
+
+def _log_stats(cache):
+    stats = cache.stats()
+    logging.info(f'Artifact cache: {stats["hits"]} hits, {stats["misses"]} misses, '
+                 f'{stats["saved-time"]:.1f}s of compilation saved.')
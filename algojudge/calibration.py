@@ -0,0 +1,193 @@
+from algojudge import config
+from algojudge.problem import Problem
+from algojudge.sandbox import SandboxError
+from algojudge.verdict import Status
+from io import BytesIO
+from threading import Lock
+from zipfile import ZipFile
+
+import argparse
+import json
+import logging
+import os
+import socket
+import statistics
+import sys
+import time
+import uuid
+
+
+# How many times the trivial program of each language is run by default.
+CALIBRATION_RUNS = 50
+
+
+class CalibrationError(Exception):
+    pass
+
+
+def calibrate(runner_cls, runs=CALIBRATION_RUNS):
+    """Runs the trivial program of the runner's language `runs` times, the way a
+    submission's cases are run, and returns the distribution of its cpu and
+    real time (in nanoseconds), which is the time the language takes to
+    start. The raw time is only measured with `config.STARTUP_TIME_OFFSET`
+    disabled."""
+    from algojudge.runners import CompileError
+
+    data = BytesIO()
+    with ZipFile(data, 'w') as archive:
+        archive.writestr('empty.in', '')
+        archive.writestr('empty.out', '')
+
+    problem = Problem('calibration', 10000, 262144, archive=ZipFile(data), stamp='calibration',
+                      data={'archive': None, 'cases': [{'in': 'empty.in', 'out': 'empty.out'}]})
+
+    cpu_times, real_times = [], []
+    with runner_cls(problem, runner_cls.trivial_source.encode()) as runner:
+        try:
+            runner.prepare()
+        except CompileError as e:
+            raise CalibrationError(f'The trivial program of {runner_cls.code} failed to compile: {e}')
+
+        for _ in range(runs):
+            verdict = runner.run(problem.cases[0])
+            if verdict.status != Status.AC:
+                raise CalibrationError(f'The trivial program of {runner_cls.code} got {verdict.status.name}: '
+                                       f'{verdict.message}')
+            cpu_times.append(verdict.cpu_time)
+            real_times.append(verdict.real_time)
+
+    return {'runs': runs, 'cpu-time': _distribution(cpu_times), 'real-time': _distribution(real_times)}
+
+def _distribution(values):
+    values = sorted(values)
+    return {
+        'min': values[0],
+        'p50': values[len(values) // 2],
+        'p90': values[min(len(values) - 1, int(0.9 * len(values)))],
+        'p99': values[min(len(values) - 1, int(0.99 * len(values)))],
+        'max': values[-1],
+        'mean': round(statistics.fmean(values))
+    }
+
+
+_calibration = None
+_calibration_key = None
+_calibration_lock = Lock()
+
+def get_calibration():
+    """Returns what `python -m algojudge.calibration` stored for this host, as a
+    mapping of languages to their distributions (see `calibrate()`). It's
+    empty if the host hasn't been calibrated."""
+    global _calibration, _calibration_key
+
+    if config.CALIBRATION_PATH is None:
+        return {}
+    try:
+        st = os.stat(config.CALIBRATION_PATH)
+        key = (config.CALIBRATION_PATH, st.st_ino, st.st_mtime_ns)
+    except OSError:
+        return {}
+
+    with _calibration_lock:
+        # Reloaded whenever the host is calibrated again.
+        if key != _calibration_key:
+            try:
+                with open(config.CALIBRATION_PATH) as f:
+                    _calibration = json.load(f)['languages']
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f'Failed to load the calibration from {config.CALIBRATION_PATH}: {e}')
+                _calibration = {}
+            _calibration_key = key
+        return _calibration
+
+def get_startup_time(language):
+    """Returns the typical cpu time (in nanoseconds) that programs of the
+    language take to start on this host, or `None` if it wasn't calibrated."""
+    startup = get_calibration().get(language)
+    return None if startup is None else startup['cpu-time']['p50']
+
+def save(results):
+    """Stores the distributions of the languages in `results`, keeping those of
+    the other languages."""
+    data = {'languages': {}}
+    try:
+        with open(config.CALIBRATION_PATH) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    data['host'] = socket.gethostname()
+    data['time'] = time.time()
+    data.setdefault('languages', {}).update(results)
+
+    # Written to a temporary file first, so that judges never read half of it.
+    tmp_path = f'{config.CALIBRATION_PATH}.{uuid.uuid4().hex}'
+    os.makedirs(os.path.dirname(os.path.abspath(config.CALIBRATION_PATH)), exist_ok=True)
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.write('\n')
+        os.rename(tmp_path, config.CALIBRATION_PATH)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def main():
+    from algojudge.comparators import load_comparators
+    from algojudge.runners import load_runners, RUNNERS
+
+    load_comparators()
+    load_runners()
+
+    parser = argparse.ArgumentParser(description='Measures how long the programs of each language take to start '
+                                                 'on this host.')
+    parser.add_argument('languages', nargs='*', metavar='language',
+                        help=f'the languages to calibrate (default: all of {", ".join(RUNNERS)})')
+    parser.add_argument('--runs', type=int, default=CALIBRATION_RUNS,
+                        help='runs of the trivial program of each language (default: %(default)s)')
+    args = parser.parse_args()
+
+    if config.CALIBRATION_PATH is None:
+        parser.error('CALIBRATION_PATH is not set')
+    unknown = set(args.languages) - set(RUNNERS)
+    if unknown:
+        parser.error(f'unknown languages: {", ".join(sorted(unknown))}')
+    if args.runs < 1:
+        parser.error('--runs must be positive')
+
+    # What's measured is the raw time of the programs, extracted straight
+    # from the archive.
+    config.STARTUP_TIME_OFFSET = False
+    config.TESTDATA_CACHE_ROOT = None
+
+    results = {}
+    failed = False
+    for code in args.languages or RUNNERS:
+        try:
+            results[code] = calibrate(RUNNERS[code], args.runs)
+        except (OSError, CalibrationError, SandboxError) as e:
+            print(f'{code}: failed: {str(e).strip()}')
+            failed = True
+            continue
+
+        cpu_time, real_time = results[code]['cpu-time'], results[code]['real-time']
+        print(f'{code}: starts in {cpu_time["p50"] / 1e6:.1f} ms of cpu time '
+              f'(p90 {cpu_time["p90"] / 1e6:.1f} ms, p99 {cpu_time["p99"] / 1e6:.1f} ms), '
+              f'{real_time["p50"] / 1e6:.1f} ms of real time')
+
+    if results:
+        save(results)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    if os.geteuid() != 0:
+        print('You must have root permissions to calibrate the judge!')
+        raise SystemExit(1)
+
+    main()
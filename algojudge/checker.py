@@ -0,0 +1,408 @@
+from algojudge import config, utils
+from algojudge.cache import get_testdata_cache
+from algojudge.problem import problems
+from algojudge.sandbox import SandboxConfig, SandboxError, get_pool
+from algojudge.verdict import Status
+from pathlib import Path
+from shutil import copy2, copyfileobj, rmtree
+from threading import Lock
+from typing import NamedTuple
+
+import atexit
+import errno
+import os
+import select
+import time
+import uuid
+
+
+class CheckerError(Exception):
+    pass
+
+
+class CheckResult(NamedTuple):
+    status: Status
+    # The fraction of the case's points that were scored, for partial results.
+    points: float
+    message: str
+
+
+class ArchiveProgram:
+    """A program shipped in a problem's archive, given in the problem's config
+    as a mapping with its `file` and, optionally, its `language` (guessed from
+    the file's extension otherwise).
+
+    The program is compiled once per version of the problem, by the runner of
+    its language, which must compile to a single file. Like a checker, it
+    tells how the contestant did by exiting with 0 for AC and 1 for WA, along
+    with an optional message, or with 2 for partial points, with the fraction
+    of the points scored before the message. Anything else means the program
+    itself failed."""
+
+    # The name of the compiled program, next to the others of the problem.
+    name: str
+
+    def __init__(self, problem, args):
+        from algojudge.runners import RUNNERS
+
+        self.problem = problem
+
+        self.file = args['file']
+        self.language = args.get('language')
+        if self.language is None:
+            extension = os.path.splitext(self.file)[1]
+            self.language = next((code for code, runner in RUNNERS.items() if runner.source_ext == extension),
+                                 None)
+        if self.language not in RUNNERS:
+            raise CheckerError(f'Unknown language of {self.name} {self.file!r} of {problem.code!r}')
+
+        # Other judges on the host, and submissions to other versions of the
+        # problem, may have programs of their own under the same root, so each
+        # program gets a directory that only it ever removes.
+        self.path = Path(config.CHECKER_ROOT) / problem.code / f'{problem.version}.{self.name}.{uuid.uuid4().hex}'
+        self.filename = None
+        self.args = None
+        self.binds = ()
+
+        self.lock = Lock()
+
+    def prepare(self):
+        """Compiles the program, unless that was already done."""
+        with self.lock:
+            if self.args is None:
+                self._compile()
+
+    def close(self):
+        """Removes the compiled program, once its version of the problem is
+        released."""
+        rmtree(self.path, ignore_errors=True)
+
+    def _compile(self):
+        from algojudge.runners import CompileError, RUNNERS
+        from algojudge.runners.base import CompiledRunner
+
+        runner_cls = RUNNERS[self.language]
+        if not issubclass(runner_cls, CompiledRunner):
+            raise CheckerError(f'The {self.name} of {self.problem.code!r} is in {self.language}, which does not '
+                               f'compile to a single file')
+        try:
+            source = self.problem.open_archive().read(self.file)
+        except KeyError:
+            raise CheckerError(f'The {self.name} {self.file!r} of {self.problem.code!r} is not in its archive')
+
+        # The program is compiled even if another judge already did, since its
+        # name and arguments may depend on the compilation, which is likely in
+        # the artifact cache anyway.
+        with runner_cls(self.problem, source) as runner:
+            try:
+                runner.prepare()
+            except CompileError as e:
+                raise CheckerError(f'The {self.name} of {self.problem.code!r} failed to compile: {e}')
+            filename = runner.compiled_filename
+            args = runner.get_execute_args()
+            binds = runner.get_binds()
+
+            try:
+                self.path.mkdir(parents=True, exist_ok=True)
+                # Unlike the boxes' files, the program belongs to us rather than
+                # the sandbox's user, who mustn't be able to change it.
+                copy2(runner.get_executable_path(), self.path / filename)
+            except OSError:
+                rmtree(self.path, ignore_errors=True)
+                raise
+
+        self.filename, self.args, self.binds = filename, args, binds
+
+    def _link(self, box, name, src):
+        # Links a file into the box's home as `name`, since a box can only see
+        # its own files.
+        dst = box.home_path / name
+        if src == dst:
+            return
+
+        dst.unlink(missing_ok=True)
+        try:
+            os.link(src, dst)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            utils.copy(src, dst)
+
+    def _data_path(self, name, box, dst):
+        # Returns the path to a file of the archive, extracting it to `dst` in
+        # the box if the test data cache is disabled.
+        testdata_cache = get_testdata_cache()
+        if testdata_cache is not None:
+            return testdata_cache.path(self.problem, name)
+
+        with self.problem.open_archive().open(name) as src, open(dst, 'wb') as f:
+            copyfileobj(src, f)
+        return dst
+
+    def _parse(self, code, output):
+        message = output.decode('utf-8', errors='replace').strip()
+        if code == 0:
+            return CheckResult(Status.AC, None, message)
+        if code == 1:
+            return CheckResult(Status.WA, None, message)
+
+        points, message = (message.split(None, 1) + ['', ''])[:2]
+        try:
+            points = float(points)
+        except ValueError:
+            points = -1
+        if not 0 <= points <= 1:
+            raise CheckerError(f'The {self.name} of {self.problem.code!r} gave invalid points: {output!r}')
+        return CheckResult(Status.PA, points, message)
+
+
+class Checker(ArchiveProgram):
+    """A checker program, for problems whose output can't be compared against a
+    single expected output. It's given with a `checker` such as
+    `{name: program, file: checker.cpp}` in the problem's config.
+
+    The checker runs in the 'checker' backend (see `config.EXECUTION_BACKENDS`)
+    as
+
+        checker input output answer
+
+    where `output` is the contestant's output and `answer` the expected one,
+    both files in its working directory, and prints its message.
+
+    A checker with `persistent: true` is run without arguments instead, and
+    kept running for as long as the problem doesn't change. It's sent a case
+    per line (the same three files separated by spaces) and answers each with a
+    line holding what it would otherwise have exited with, followed by what it
+    would have printed. One process is started for each case that is checked
+    concurrently."""
+
+    name = 'checker'
+
+    def __init__(self, problem):
+        super().__init__(problem, problem.comparator_args)
+        self.persistent = problem.comparator_args.get('persistent', False)
+
+        self.idle = []
+        self.closed = False
+
+    def check(self, case, box):
+        """Checks the output that the program left in `box` for the case."""
+        self.prepare()
+
+        if not self.persistent:
+            with get_pool('checker').box() as checker_box:
+                self._link(checker_box, self.filename, self.path / self.filename)
+                self._link_case(checker_box, case, box)
+                conf = SandboxConfig(
+                    cpu_time_limit=config.CHECKER_CONFIG.cpu_time_limit,
+                    real_time_limit=config.CHECKER_CONFIG.real_time_limit,
+                    memory_limit=config.CHECKER_CONFIG.memory_limit,
+                    max_fsize=config.CHECKER_CONFIG.max_fsize,
+                    max_pids=config.CHECKER_CONFIG.max_pids,
+                    binds=self.binds
+                )
+                result = checker_box.run([*self.args, 'input', 'output', 'answer'], conf)
+
+                if result.is_tle():
+                    raise CheckerError(f'The checker of {self.problem.code!r} took too long')
+                if result.exitcode not in (0, 1, 2):
+                    raise CheckerError(f'The checker of {self.problem.code!r} failed: {checker_box.stderr()!r}')
+                return self._parse(result.exitcode, checker_box.stdout())
+
+        process = self._checkout()
+        try:
+            self._link_case(process.box, case, box)
+            code, _, output = process.check().partition(b' ')
+        except BaseException:
+            process.close()
+            raise
+
+        self._checkin(process)
+        if code not in (b'0', b'1', b'2'):
+            raise CheckerError(f'The checker of {self.problem.code!r} failed: {code + b" " + output!r}')
+        return self._parse(int(code), output)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            processes, self.idle = self.idle, []
+
+        for process in processes:
+            process.close()
+        super().close()
+
+    def _link_case(self, checker_box, case, box):
+        # The program's output is only writable by the sandbox's user, who the
+        # checker may run as too, so it's made readable now that the program
+        # is done with it.
+        os.chmod(box.stdout_path, 0o644)
+        self._link(checker_box, 'input', box.stdin_path)
+        self._link(checker_box, 'output', box.stdout_path)
+        self._link(checker_box, 'answer',
+                   self._data_path(case.outfile, checker_box, checker_box.home_path / 'answer'))
+
+    def _checkout(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+
+        return _CheckerProcess(self)
+
+    def _checkin(self, process):
+        with self.lock:
+            if not self.closed:
+                self.idle.append(process)
+                return
+
+        process.close()
+
+
+class Interactor(ArchiveProgram):
+    """The program that a contestant's program talks to on an interactive
+    problem, given with an `interactor` such as `interactor.cpp` or
+    `{file: interactor.cpp}` in the problem's config.
+
+    The interactor runs in the 'interactor' backend as
+
+        interactor INPUT ANSWER
+
+    with its stdin and stdout connected to the stdout and stdin of the
+    contestant's program, and prints its message to stderr."""
+
+    name = 'interactor'
+
+    def __init__(self, problem):
+        super().__init__(problem, problem.interactor)
+
+    def start(self, case, box, conf, stdin_fd, stdout_fd):
+        """Starts the interactor in `box` for the case."""
+        self.prepare()
+
+        self._link(box, self.filename, self.path / self.filename)
+        for name, dst in ((case.infile, 'input'), (case.outfile, 'answer')):
+            self._link(box, dst, self._data_path(name, box, box.home_path / dst))
+
+        return box.start([*self.args, 'input', 'answer'], conf, stdout_fd=stdout_fd, stdin_fd=stdin_fd)
+
+    def verdict(self, result, box):
+        """Returns the verdict of the interactor that ended with `result`."""
+        if result.is_tle():
+            raise CheckerError(f'The interactor of {self.problem.code!r} took too long')
+        if result.exitcode not in (0, 1, 2):
+            raise CheckerError(f'The interactor of {self.problem.code!r} failed: {box.stderr()!r}')
+        return self._parse(result.exitcode, box.stderr())
+
+
+class _CheckerProcess:
+    # A persistent checker, in a box of its own for as long as it runs.
+
+    def __init__(self, checker):
+        self.box = get_pool('checker').checkout()
+
+        stdin_fd, stdin = os.pipe()
+        stdout, stdout_fd = os.pipe()
+        try:
+            checker._link(self.box, checker.filename, checker.path / checker.filename)
+
+            # Checking many cases takes far longer than any one of them, so only
+            # the memory and file size are limited for the process as a whole.
+            conf = SandboxConfig(memory_limit=config.CHECKER_CONFIG.memory_limit,
+                                 max_fsize=config.CHECKER_CONFIG.max_fsize, binds=checker.binds)
+            self.proc = self.box.start(checker.args, conf, stdout_fd=stdout_fd, stdin_fd=stdin_fd)
+        except BaseException:
+            for fd in (stdin, stdout):
+                os.close(fd)
+            get_pool('checker').checkin(self.box)
+            raise
+        finally:
+            os.close(stdin_fd)
+            os.close(stdout_fd)
+
+        self.stdin = open(stdin, 'wb')
+        # The replies are read without buffering, so that a poll of the pipe
+        # tells whether there's more to read.
+        self.stdout = open(stdout, 'rb', buffering=0)
+        self.buffer = b''
+
+    def check(self):
+        # The case's files are linked into the box under the same names every
+        # time.
+        try:
+            self.stdin.write(b'input output answer\n')
+            self.stdin.flush()
+        except BrokenPipeError:
+            raise CheckerError('Persistent checker exited early')
+
+        # The time limit of a case is that of a run of the checker, and covers
+        # the whole of its reply.
+        deadline = time.monotonic() + config.CHECKER_CONFIG.real_time_limit / 1000
+        poll = select.poll()
+        poll.register(self.stdout, select.POLLIN)
+
+        while b'\n' not in self.buffer:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or not poll.poll(timeout * 1000):
+                raise CheckerError('Persistent checker took too long')
+
+            data = self.stdout.read(65536)
+            if not data:
+                raise CheckerError('Persistent checker exited early')
+            self.buffer += data
+
+        line, _, self.buffer = self.buffer.partition(b'\n')
+        return line
+
+    def close(self):
+        self.proc.abort()
+        try:
+            self.proc.wait()
+        except SandboxError:
+            pass
+
+        self.stdin.close()
+        self.stdout.close()
+        get_pool('checker').checkin(self.box)
+
+
+_programs = {}
+_programs_lock = Lock()
+
+def get_checker(problem):
+    """Returns the checker of the problem, which is shared by every submission to
+    the same version of the problem, and closed once the registry releases that
+    version."""
+    return _get_program(Checker, problem)
+
+def get_interactor(problem):
+    """Returns the interactor of the problem, like `get_checker()`."""
+    return _get_program(Interactor, problem)
+
+def _get_program(cls, problem):
+    # Submissions to different versions of a problem may be judged at once, so
+    # each version has a program of its own.
+    key = (cls, problem.code, problem.version)
+    with _programs_lock:
+        program = _programs.get(key)
+        # A problem that was evicted and loaded again is a new version as far
+        # as the registry is concerned.
+        if program is not None and program.problem._entry is problem._entry:
+            return program
+        program = _programs[key] = cls(problem)
+
+    problems.on_release(problem, lambda: _close_program(key, program))
+    return program
+
+def _close_program(key, program):
+    with _programs_lock:
+        if _programs.get(key) is program:
+            del _programs[key]
+    program.close()
+
+@atexit.register
+def _close_programs():
+    with _programs_lock:
+        programs = list(_programs.values())
+        _programs.clear()
+
+    for program in programs:
+        program.close()
@@ -5,6 +5,10 @@ import os
 
 COMPARATORS = {}
 
+# Comparators that can check the output while it's being produced. They return
+# the offset of the first mismatch in the output, or -1 if there is none.
+STREAMING_COMPARATORS = {}
+
 def load_comparators():
     for module in os.listdir(os.path.dirname(__file__)):
         if module.endswith('.py') and module != '__init__.py':
@@ -14,3 +18,8 @@ def comparator(name):
     def wrapper(func):
         COMPARATORS[name] = func
     return wrapper
+
+def streaming_comparator(name):
+    def wrapper(func):
+        STREAMING_COMPARATORS[name] = func
+    return wrapper
@@ -1,47 +1,279 @@
-cdef class BufferedReader:
-    cdef fobj
-    cdef bytes buf
-    cdef int ip, iend
+# cython: language_level=3
+cimport cython
+from cpython.mem cimport PyMem_Free, PyMem_Realloc
+from libc.math cimport fabs
+from libc.stdlib cimport strtod
+from libc.string cimport memcmp, memcpy
+
+import io
+import mmap
+import os
+import stat
+
+DEF BUFFER_SIZE = 65536
+DEF BLOCK_SIZE = 4096
+DEF MAX_NUMBER_LENGTH = 128
+
+
+# Reads a stream in large blocks. Regular files are mapped into memory as a
+# whole; anything else is read into a buffer that is reused for every block.
+@cython.final
+cdef class Reader:
+    cdef object fobj
+    cdef object storage
+    cdef const unsigned char[:] view
+    cdef const unsigned char *buf
+    cdef Py_ssize_t ip, iend
+    cdef long long base
+    cdef bint mapped, has_readinto
 
     def __init__(self, fobj):
         self.fobj = fobj
         self.ip = self.iend = 0
+        self.base = 0
+        self.mapped = False
+
+        try:
+            fd = fobj.fileno()
+            st = os.fstat(fd)
+            pos = fobj.tell()
+        except (AttributeError, OSError, ValueError):
+            pass
+        else:
+            if stat.S_ISREG(st.st_mode):
+                self.mapped = True
+                if st.st_size > pos:
+                    self.storage = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+                    self.view = self.storage
+                    self.buf = &self.view[0]
+                    # Offsets are relative to where the stream was positioned.
+                    self.ip = pos
+                    self.iend = st.st_size
+                    self.base = -pos
+                return
+
+        self.storage = bytearray(BUFFER_SIZE)
+        self.view = self.storage
+        self.buf = &self.view[0]
+        self.has_readinto = hasattr(fobj, 'readinto')
+
+    # Reads the next block, returning 0 at EOF.
+    cdef int refill(self) except -1:
+        if self.mapped:
+            return 0
+
+        if self.has_readinto:
+            n = self.fobj.readinto(self.storage) or 0
+        else:
+            data = self.fobj.read(BUFFER_SIZE)
+            n = len(data)
+            self.storage[:n] = data
 
-    cdef int getchar(self):
+        if n == 0:
+            return 0
+
+        self.base += self.iend
+        self.ip = 0
+        self.iend = n
+        return 1
+
+    # Returns the number of bytes that can be read without refilling, which is
+    # only 0 at EOF.
+    cdef inline Py_ssize_t avail(self) except -1:
         if self.ip == self.iend:
-            self.buf = self.fobj.read(65536)
-            if not self.buf:
-                return -1
-            self.iend = len(self.buf)
-            self.ip = 0
+            self.refill()
+        return self.iend - self.ip
+
+    cdef inline int getchar(self) except -2:
+        if self.ip == self.iend and not self.refill():
+            return -1
         cdef int ch = self.buf[self.ip]
         self.ip += 1
         return ch
 
-cdef int isspace(c):
+    # Returns the offset of the next byte in the stream.
+    cdef inline long long tell(self):
+        return self.base + self.ip
+
+
+# Splits a stream into whitespace-separated tokens. A token points directly into
+# the reader's buffer, unless it straddles a refill, in which case it's copied
+# into a scratch buffer.
+@cython.final
+cdef class Tokenizer:
+    cdef Reader reader
+    cdef const unsigned char *ptr
+    cdef Py_ssize_t length
+    cdef long long offset
+    cdef unsigned char *scratch
+    cdef Py_ssize_t capacity
+
+    def __cinit__(self, Reader reader):
+        self.reader = reader
+        self.scratch = NULL
+        self.capacity = 0
+
+    def __dealloc__(self):
+        PyMem_Free(self.scratch)
+
+    # Reads the next token, returning 0 at EOF.
+    cdef int next(self) except -1:
+        cdef Reader r = self.reader
+        cdef Py_ssize_t i
+
+        while True:
+            while r.ip < r.iend and istokenspace(r.buf[r.ip]):
+                r.ip += 1
+            if r.ip < r.iend:
+                break
+            if not r.refill():
+                return 0
+
+        self.offset = r.tell()
+
+        i = r.ip
+        while i < r.iend and not istokenspace(r.buf[i]):
+            i += 1
+        if i < r.iend or r.mapped:
+            self.ptr = r.buf + r.ip
+            self.length = i - r.ip
+            r.ip = i
+            return 1
+
+        # The token may continue past the end of the buffer, so it has to be
+        # copied out before the buffer is refilled.
+        self.length = 0
+        while True:
+            self.append(r.buf + r.ip, i - r.ip)
+            r.ip = i
+            if i < r.iend or not r.refill():
+                break
+            i = r.ip
+            while i < r.iend and not istokenspace(r.buf[i]):
+                i += 1
+
+        self.ptr = self.scratch
+        return 1
+
+    cdef int append(self, const unsigned char *data, Py_ssize_t n) except -1:
+        cdef unsigned char *scratch
+        if self.length + n > self.capacity:
+            scratch = <unsigned char *>PyMem_Realloc(self.scratch, max(2 * self.capacity, self.length + n))
+            if scratch == NULL:
+                raise MemoryError()
+            self.scratch = scratch
+            self.capacity = max(2 * self.capacity, self.length + n)
+        memcpy(self.scratch + self.length, data, n)
+        self.length += n
+        return 0
+
+    cdef inline bint equals(self, Tokenizer other):
+        return self.length == other.length and memcmp(self.ptr, other.ptr, self.length) == 0
+
+    # Parses the token as a decimal number. Returns 0 if it isn't one.
+    cdef int parse_number(self, double *value):
+        cdef char number[MAX_NUMBER_LENGTH]
+        cdef char *end
+        cdef Py_ssize_t i
+        cdef unsigned char c
+
+        # Rule out anything `strtod` would accept that isn't written as a plain
+        # number, such as `nan` and hexadecimal floats.
+        if self.length == 0 or self.length >= MAX_NUMBER_LENGTH:
+            return 0
+        for i in range(self.length):
+            c = self.ptr[i]
+            if not (48 <= c <= 57 or c == 43 or c == 45 or c == 46 or c == 69 or c == 101):
+                return 0
+
+        memcpy(number, self.ptr, self.length)
+        number[self.length] = 0
+        value[0] = strtod(number, &end)
+        return end == number + self.length
+
+
+cdef inline int isspace(int c):
     return c == 9 or c == 32
 
+cdef inline int istokenspace(int c):
+    return c == 32 or 9 <= c <= 13
+
+# Returns the length of the common prefix of two blocks of memory.
+cdef Py_ssize_t common_prefix(const unsigned char *a, const unsigned char *b, Py_ssize_t n) nogil:
+    cdef Py_ssize_t i = 0, step
+    while i < n:
+        step = min(n - i, BLOCK_SIZE)
+        if memcmp(a + i, b + i, step) != 0:
+            break
+        i += step
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+# Skips over the part where both streams are identical. Returns 0 if either
+# stream has ended or the next bytes differ.
+cdef int skip_common(Reader ra, Reader rb) except -1:
+    cdef Py_ssize_t n = min(ra.avail(), rb.avail())
+    if n == 0:
+        return 0
+    cdef Py_ssize_t i = common_prefix(ra.buf + ra.ip, rb.buf + rb.ip, n)
+    ra.ip += i
+    rb.ip += i
+    return i == n
+
+# Like `skip_common`, but for tokenizers, which must be between tokens. Only
+# whole tokens are skipped, so that the token the identical part ends in is
+# still compared in full. Returns 0 if nothing could be skipped.
+cdef int skip_common_tokens(Tokenizer ta, Tokenizer tb) except -1:
+    cdef Reader ra = ta.reader
+    cdef Reader rb = tb.reader
+    cdef Py_ssize_t n = min(ra.avail(), rb.avail())
+    if n == 0:
+        return 0
+    cdef Py_ssize_t i = common_prefix(ra.buf + ra.ip, rb.buf + rb.ip, n)
+    while i > 0 and not istokenspace(ra.buf[ra.ip + i - 1]):
+        i -= 1
+    ra.ip += i
+    rb.ip += i
+    return i > 0
+
+
 def compare_identical(fa, fb):
-    cdef BufferedReader ra = BufferedReader(fa)
-    cdef BufferedReader rb = BufferedReader(fb)
+    return mismatch_identical(fa, fb) < 0
 
-    while True:
-        a = ra.getchar()
-        b = rb.getchar()
-        if a != b:
-            return False
-        if a == -1:
-            return True
+# Returns the offset in `fa` of the first byte that differs from `fb`, or -1 if
+# the streams are identical. Stops reading as soon as a difference is found.
+def mismatch_identical(fa, fb):
+    cdef Reader ra = Reader(fa)
+    cdef Reader rb = Reader(fb)
+
+    while skip_common(ra, rb):
+        pass
+
+    # Either the streams differ here, or at least one of them has ended.
+    if ra.avail() == 0 and rb.avail() == 0:
+        return -1
+    return ra.tell()
 
 # Checks whether two streams are "eye-identical". In other words, whether they
 # are indistinguishable in an editor which does not show trailing whitespace.
 # Non-UNIX newlines such as `\r\n` or `\r` are not supported.
 def compare_standard(fa, fb):
-    cdef BufferedReader ra = BufferedReader(fa)
-    cdef BufferedReader rb = BufferedReader(fb)
+    return mismatch_standard(fa, fb) < 0
+
+# Like `mismatch_identical`, but for `compare_standard`.
+def mismatch_standard(fa, fb):
+    cdef Reader ra = Reader(fa)
+    cdef Reader rb = Reader(fb)
     cdef int a, b, sa, sb
 
     while True:
+        # Outputs are usually identical for the most part, so skip ahead to the
+        # next difference. Any spaces skipped were skipped in both streams, so
+        # they don't affect the comparison below.
+        while skip_common(ra, rb):
+            pass
+
         a = ra.getchar()
         b = rb.getchar()
 
@@ -60,17 +292,76 @@ def compare_standard(fa, fb):
         if a == -1:
             while isspace(b) or b == 10:
                 b = rb.getchar()
-            return b == -1
+            return -1 if b == -1 else ra.tell()
         if b == -1:
             while isspace(a) or a == 10:
                 a = ra.getchar()
-            return a == -1
+            return -1 if a == -1 else ra.tell() - 1
 
         # After skipping the spaces, the next pair of bytes must be
         # identical. Also, the number of spaces skipped must be the same for
         # both streams. The only exception to this rule is if both bytes are
         # newlines, which is OK because trailing whitespace doesn't matter.
         if a != b or (sa != sb and a != 10):
-            return False
+            # If the runs of spaces differ, the difference starts within them.
+            return ra.tell() - 1 - sa + min(sa, sb)
+
+def compare_tokens(fa, fb):
+    return mismatch_tokens(fa, fb) < 0
+
+# Compares two streams as sequences of whitespace-separated tokens, so that the
+# amount and kind of whitespace doesn't matter. Returns the offset in `fa` of
+# the first token that differs, or -1 if there is none.
+def mismatch_tokens(fa, fb):
+    cdef Tokenizer ta = Tokenizer(Reader(fa))
+    cdef Tokenizer tb = Tokenizer(Reader(fb))
+    cdef int ha, hb
+
+    while True:
+        while skip_common_tokens(ta, tb):
+            pass
+
+        ha = ta.next()
+        hb = tb.next()
+
+        if not ha or not hb:
+            if ha == hb:
+                return -1
+            return ta.offset if ha else ta.reader.tell()
+
+        if not ta.equals(tb):
+            return ta.offset
+
+def compare_float(fa, fb, double abs_tol, double rel_tol):
+    return mismatch_float(fa, fb, abs_tol, rel_tol) < 0
+
+# Like `mismatch_tokens`, but numbers in `fa` only have to be within either an
+# absolute or a relative error of the ones in `fb`. Tokens are only parsed if
+# they differ, so exact answers are checked as quickly as with `tokens`.
+def mismatch_float(fa, fb, double abs_tol, double rel_tol):
+    cdef Tokenizer ta = Tokenizer(Reader(fa))
+    cdef Tokenizer tb = Tokenizer(Reader(fb))
+    cdef int ha, hb
+    cdef double x, y, error
+
+    while True:
+        while skip_common_tokens(ta, tb):
+            pass
+
+        ha = ta.next()
+        hb = tb.next()
+
+        if not ha or not hb:
+            if ha == hb:
+                return -1
+            return ta.offset if ha else ta.reader.tell()
+
+        if ta.equals(tb):
+            continue
+
+        if not (ta.parse_number(&x) and tb.parse_number(&y)):
+            return ta.offset
 
-    return True
+        error = fabs(x - y)
+        if not (error <= abs_tol or error <= rel_tol * fabs(y)):
+            return ta.offset
@@ -0,0 +1,14 @@
+from algojudge.comparators import comparator, streaming_comparator
+from algojudge.comparators._compare import compare_float, mismatch_float
+
+
+# Numbers are accepted if they're within either the absolute or the relative
+# error of the expected answer.
+@comparator(name='float')
+def compare(fa, fb, abs=1e-6, rel=1e-6):
+    return compare_float(fa, fb, float(abs), float(rel))
+
+
+@streaming_comparator(name='float')
+def mismatch(fa, fb, abs=1e-6, rel=1e-6):
+    return mismatch_float(fa, fb, float(abs), float(rel))
@@ -1,7 +1,12 @@
-from algojudge.comparators import comparator
-from algojudge.comparators._compare import compare_identical
+from algojudge.comparators import comparator, streaming_comparator
+from algojudge.comparators._compare import compare_identical, mismatch_identical
 
 
 @comparator(name='identical')
 def compare(fa, fb):
     return compare_identical(fa, fb)
+
+
+@streaming_comparator(name='identical')
+def mismatch(fa, fb):
+    return mismatch_identical(fa, fb)
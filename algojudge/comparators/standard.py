@@ -1,7 +1,12 @@
-from algojudge.comparators import comparator
-from algojudge.comparators._compare import compare_standard
+from algojudge.comparators import comparator, streaming_comparator
+from algojudge.comparators._compare import compare_standard, mismatch_standard
 
 
 @comparator(name='standard')
 def compare(fa, fb):
     return compare_standard(fa, fb)
+
+
+@streaming_comparator(name='standard')
+def mismatch(fa, fb):
+    return mismatch_standard(fa, fb)
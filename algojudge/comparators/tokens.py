@@ -0,0 +1,12 @@
+from algojudge.comparators import comparator, streaming_comparator
+from algojudge.comparators._compare import compare_tokens, mismatch_tokens
+
+
+@comparator(name='tokens')
+def compare(fa, fb):
+    return compare_tokens(fa, fb)
+
+
+@streaming_comparator(name='tokens')
+def mismatch(fa, fb):
+    return mismatch_tokens(fa, fb)
@@ -1,5 +1,7 @@
 from algojudge.sandbox import SandboxConfig
 
+import os
+
 
 # A tuple (host, port) specifying the address which the site is hosted on.
 SERVER_ADDRESS = ('127.0.0.1', 1337)
@@ -8,12 +10,108 @@ SERVER_ADDRESS = ('127.0.0.1', 1337)
 # Generate a random key with `secrets.token_urlsafe()`.
 JUDGE_ACCESS_TOKEN = '*******************************************'
 
+# The number of submissions judged at once. Each of them runs up to
+# `CASE_WORKERS` cases in parallel.
+JUDGE_WORKERS = 1
+
+# The number of submissions that may wait to be judged. Any more are turned away
+# with a `busy` response.
+SUBMISSION_QUEUE_SIZE = 64
+
+# Whether a submission may be paused between its cases to let a submission of a
+# higher priority class be judged first. Clients give the priority class of a
+# submission as one of 'live' (the default), 'contest', 'rejudge' and
+# 'background'.
+PREEMPTION = True
+
+# How long to wait (in seconds) for more events before sending a frame over a
+# connection of version 2 of the protocol, so that events produced close
+# together are sent in one frame.
+PROTOCOL_FRAME_DELAY = 0.005
+
+# A tuple (host, port) of the coordinator of a cluster of judges, which this
+# judge registers with as one of its nodes. The site then connects to the
+# coordinator, at its `SERVER_ADDRESS`, instead of to the judges. Set to `None`
+# for a judge on its own.
+COORDINATOR_ADDRESS = None
+
+# How often (in seconds) the nodes of a cluster report their capacity to the
+# coordinator, and how long the coordinator waits for a report before it gives
+# up on a node.
+HEARTBEAT_INTERVAL = 1
+HEARTBEAT_TIMEOUT = 5
+
+# The number of nodes the coordinator tries a submission on, when nodes fail
+# or are busy, before giving up on it.
+DISPATCH_ATTEMPTS = 3
+
+# A tuple (host, port) to serve metrics on over HTTP, in the Prometheus text
+# format. Set to `None` to only send them in response to `stats` requests.
+METRICS_ADDRESS = None
+
+# The file to write traces of judgings to, one per line, in the Chrome trace
+# event format (open a line of it in Perfetto or chrome://tracing). Set to
+# `None` to disable tracing.
+TRACE_PATH = None
+
+# The fraction of submissions to trace. Tracing is cheap enough to keep a small
+# fraction of submissions traced in production.
+TRACE_SAMPLE_RATE = 0.01
+
+# The size of the trace file (in bytes) before it's rotated, and the number of
+# rotated files to keep.
+TRACE_MAX_SIZE = 64 << 20  # 64 MiB
+TRACE_BACKUP_COUNT = 4
+
 # The root folder where the sandbox files reside.
 BOX_ROOT = '/var/local/lib/algojudge/sandbox'
 
 # The root folder where all problem data are held.
 PROBLEM_DATA_ROOT = '/var/local/lib/algojudge/testdata'
 
+# The number of problems whose config and archive index are kept in memory.
+PROBLEM_CACHE_SIZE = 64
+
+# Problems to load into memory when the judge starts, e.g. those of a contest
+# that is about to begin.
+PRELOAD_PROBLEMS = []
+
+# The folder where compiled artifacts are cached, shared by all judge processes
+# on this host. Set to `None` to disable the cache.
+ARTIFACT_CACHE_ROOT = '/var/local/lib/algojudge/cache/artifacts'
+
+# The maximum size of the artifact cache (in bytes) before the least recently
+# used artifacts are evicted.
+ARTIFACT_CACHE_MAX_SIZE = 1 << 30  # 1 GiB
+
+# The folder where test data is extracted to, so that it can be linked into the
+# boxes. It should be on the same filesystem as `BOX_ROOT`, otherwise the files
+# are copied instead. Set to `None` to extract the data for every run.
+TESTDATA_CACHE_ROOT = '/var/local/lib/algojudge/cache/testdata'
+
+# The folder where the checkers and interactors of problems are compiled to,
+# once for every version of a problem that the judge uses. A program is removed
+# once the judge is done with its version.
+CHECKER_ROOT = '/var/local/lib/algojudge/cache/checkers'
+
+# The folder where the startup accelerators of languages (e.g. the class data
+# archive of the JVM) are built to by `python -m algojudge.warmup`. Programs of
+# languages without any start cold. Set to `None` to always start cold.
+WARMUP_ROOT = '/var/local/lib/algojudge/warmup'
+
+# The file where `python -m algojudge.calibration` stores how long programs of
+# each language take to start on this host. Set to `None` to disable it.
+CALIBRATION_PATH = '/var/local/lib/algojudge/calibration.json'
+
+# Whether the calibrated startup time of a language is added to the time limit
+# of its programs and taken off their cpu time, so that a time limit means the
+# same in every language. Verdicts report the startup time either way.
+STARTUP_TIME_OFFSET = False
+
+# Multipliers of the time limit of the programs of each language, for languages
+# that are slower overall (e.g. `{'python3': 3}`).
+TIME_LIMIT_MULTIPLIERS = {}
+
 # The default Sandbox configuration for judging submissions in the compilation step.
 SANDBOX_COMPILE_CONFIG = SandboxConfig(
     cpu_time_limit=5000,   # 5 seconds
@@ -23,6 +121,70 @@ SANDBOX_COMPILE_CONFIG = SandboxConfig(
     max_pids=1024
 )
 
+# The limits of checker programs, for checking a single case, and of
+# interactors (whose real time limit is added to the contestant's).
+CHECKER_CONFIG = SandboxConfig(
+    cpu_time_limit=10000,   # 10 seconds
+    real_time_limit=20000,  # 20 seconds
+    memory_limit=1048576,   # 1 GiB
+    max_fsize=1024          # 1 MiB
+)
+
+# How to talk to the sandbox: 'supervisor' sends requests to long-lived
+# `sandbox --serve` processes, while 'command' spawns a new `sandbox` process
+# for every request. The supervisor falls back to 'command' if it can't start.
+# Programs whose output is streamed (see `STREAMING_OUTPUT`) are started by the
+# supervisor too, which is handed their pipes over a Unix socket.
+SANDBOX_DRIVER = 'supervisor'
+
+# Boxes are kept initialized between runs in a pool. The pool never shrinks
+# below `SANDBOX_POOL_MIN_SIZE` boxes, never grows beyond `SANDBOX_POOL_MAX_SIZE`
+# (`None` means unbounded), and deletes any extra boxes that have been idle for
+# `SANDBOX_POOL_IDLE_TIMEOUT` seconds. Compilations, interactors and sandboxed
+# checkers have pools of their own, of at most `SANDBOX_POOL_MAX_SIZE` boxes
+# each.
+SANDBOX_POOL_MIN_SIZE = os.cpu_count() or 1
+SANDBOX_POOL_MAX_SIZE = None
+SANDBOX_POOL_IDLE_TIMEOUT = 60
+
+# The backend that runs each kind of process: 'sandbox' isolates the process
+# completely, while 'trusted' runs it as a plain subprocess with rlimits, which
+# is much cheaper but only fit for programs we trust (e.g. checkers written by
+# the problem setters). Submissions and their compilers must stay sandboxed.
+EXECUTION_BACKENDS = {
+    'submission': 'sandbox',
+    'compile': 'sandbox',
+    'checker': 'trusted',
+    'interactor': 'sandbox',
+}
+
+# The number of test cases of a single submission that may run in parallel.
+# Each case runs in a box (and cgroup) of its own.
+CASE_WORKERS = os.cpu_count() or 1
+
+# Whether `case-verdict` events are sent in case order. If disabled, verdicts
+# are sent as soon as their case finishes.
+ORDERED_VERDICTS = True
+
+# The order cases are run in: 'default' runs them in the order of the problem's
+# config, while 'fail-first' runs the cases that have failed most often first,
+# so that the rest of their batch can be skipped sooner.
+CASE_ORDER = 'default'
+
+# The input and expected output of upcoming cases are extracted into the test
+# data cache by `PREFETCH_WORKERS` threads (0 disables it), which also get
+# boxes ready, while the submission compiles and while earlier cases run. At
+# most `PREFETCH_CASES` cases, holding at most `PREFETCH_MAX_BYTES` of data
+# between them, are fetched ahead.
+PREFETCH_WORKERS = 2
+PREFETCH_CASES = 8
+PREFETCH_MAX_BYTES = 256 << 20  # 256 MiB
+
+# Whether to check the output of a program while it's running, stopping it at
+# the first mismatch. Only used with comparators that support it; the others
+# check the output file once the program has terminated.
+STREAMING_OUTPUT = True
+
 # Load local config from `local_config.py`
 try:
     from algojudge.local_config import *
@@ -0,0 +1,299 @@
+from algojudge import config, metrics
+from algojudge.server import authenticate, parse_address, read_data, send_data, Session
+
+import argparse
+import asyncio
+import logging
+
+
+class Node:
+    """A judge registered with the coordinator, as of its last heartbeat."""
+
+    def __init__(self, address, workers, languages):
+        self.address = address
+        self.workers = max(workers, 1)
+        self.languages = set(languages)
+
+        self.free_workers = self.workers
+        self.queued = 0
+        self.problems = set()
+
+        # The submissions the coordinator sent to the node that aren't done
+        # yet, which the node may not have reported yet.
+        self.inflight = 0
+        # Whether judging a submission on the node failed since its last
+        # heartbeat, in which case it's passed over.
+        self.failed = False
+        # Set once the node is dropped, which fails the submissions that are
+        # being judged on it, even if their connections are still open.
+        self.gone = asyncio.Event()
+
+    def update(self, heartbeat):
+        self.free_workers = heartbeat['free-workers']
+        self.queued = heartbeat['queued']
+        self.problems = set(heartbeat['problems'])
+        self.failed = False
+
+    def load(self):
+        """The share of the node's workers that are taken, which is more than 1
+        once submissions wait in its queue."""
+        return max(self.inflight, self.workers - self.free_workers + self.queued) / self.workers
+
+    def stats(self):
+        return {
+            'address': list(self.address),
+            'workers': self.workers,
+            'free-workers': self.free_workers,
+            'queued': self.queued,
+            'inflight': self.inflight,
+            'failed': self.failed,
+            'problems': len(self.problems)
+        }
+
+
+class Dispatch:
+    """A submission being dispatched to the nodes. Like a job of a judge, its
+    events for the client are put on `events`, followed by `None`."""
+
+    def __init__(self, message):
+        self.message = message
+        self.id = message.get('id')
+        self.problem_code = message['problem-code']
+        self.language = message['language']
+        self.events = asyncio.Queue()
+        self.task = None
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+
+
+class Coordinator:
+    """Stands in for a single judge in front of a cluster of them. The site
+    talks to the coordinator over the same protocol as to a judge, and each
+    submission is passed on to the least loaded node that judges its language,
+    preferring nodes that already have the problem's data at hand. The events
+    of the submission are relayed back to the site as the node sends them.
+
+    Nodes register with the coordinator and report their capacity in
+    heartbeats, and are dropped when they stop. If a node fails while judging
+    a submission, the submission is judged again on another node, without
+    sending the site any of the events it already got."""
+
+    def __init__(self, address):
+        self.address = address
+
+        self.server = None
+        self.metrics_server = None
+        self.nodes = {}
+        self.tasks = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, *self.address, reuse_address=True)
+
+        if config.METRICS_ADDRESS is not None:
+            self.metrics_server = await metrics.start_http_server(config.METRICS_ADDRESS)
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def handle(self, reader, writer):
+        logging.debug(f'Connected to {writer.get_extra_info("peername")}')
+
+        try:
+            data = await read_data(reader)
+            if data is None:
+                logging.debug('Failed to read data :(')
+                return
+
+            match data['header']:
+                case 'hello':
+                    await Session(self, reader, writer).run(data)
+                case 'register':
+                    await self.do_register(data, reader, writer)
+                case 'submit':
+                    await self.do_submit(data, writer)
+                case 'stats':
+                    await self.do_stats(data, writer)
+        except ConnectionError:
+            logging.debug('Connection lost')
+        finally:
+            writer.close()
+
+    async def do_register(self, data, reader, writer):
+        if not authenticate(data):
+            return
+
+        address = (data['host'] or writer.get_extra_info('peername')[0], data['port'])
+        # A node that registers again replaces what's left of its last
+        # registration.
+        node = self.nodes[address] = Node(address, data['workers'], data['languages'])
+        metrics.NODES.set(len(self.nodes))
+        logging.info(f'Node {address} registered with {node.workers} workers')
+
+        try:
+            while (heartbeat := await asyncio.wait_for(read_data(reader), config.HEARTBEAT_TIMEOUT)) is not None:
+                if heartbeat.get('header') == 'heartbeat':
+                    node.update(heartbeat)
+        except asyncio.TimeoutError:
+            logging.warning(f'Node {address} stopped sending heartbeats')
+        finally:
+            node.gone.set()
+            if self.nodes.get(address) is node:
+                del self.nodes[address]
+                metrics.NODES.set(len(self.nodes))
+                logging.info(f'Node {address} left')
+
+    async def do_submit(self, data, writer):
+        if not authenticate(data):
+            return
+
+        job = self.make_job(data)
+        self.submit(job)
+        try:
+            while (event := await job.events.get()) is not None:
+                await send_data(writer, event)
+        finally:
+            job.cancel()
+
+    async def do_stats(self, data, writer):
+        if not authenticate(data):
+            return
+
+        await send_data(writer, self.stats())
+
+    def stats(self):
+        return {
+            'header': 'stats',
+            'nodes': [node.stats() for node in self.nodes.values()],
+            'metrics': metrics.render()
+        }
+
+    def make_job(self, data):
+        return Dispatch(data)
+
+    def submit(self, job):
+        job.task = asyncio.create_task(self.dispatch(job))
+        self.tasks.add(job.task)
+        job.task.add_done_callback(self.tasks.discard)
+        # The client is told it's over even if the dispatch is cancelled
+        # before it starts.
+        job.task.add_done_callback(lambda _: job.events.put_nowait(None))
+
+    def pick(self, job, exclude=()):
+        """Returns the node to judge the job on, or `None` if no node can. Nodes
+        with a free worker go first, and then those that have the problem at
+        hand, and then the least loaded."""
+        nodes = [node for node in self.nodes.values()
+                 if not node.failed and node not in exclude and job.language in node.languages]
+        if not nodes:
+            return None
+
+        return min(nodes, key=lambda node: (node.load() >= 1, job.problem_code not in node.problems, node.load()))
+
+    async def dispatch(self, job):
+        # The events that were relayed, by their header and case, so that
+        # those of a submission that's judged again aren't sent twice.
+        relayed = set()
+        tried = set()
+
+        for _ in range(config.DISPATCH_ATTEMPTS):
+            node = self.pick(job, tried)
+            if node is None:
+                break
+            tried.add(node)
+
+            node.inflight += 1
+            try:
+                judged = await self.forward(node, job, relayed)
+            except (OSError, ValueError) as e:
+                logging.warning(f'Node {node.address} failed while judging submission {job.id}: {e}')
+                metrics.DISPATCHES.labels('failed').inc()
+                node.failed = True
+                continue
+            finally:
+                node.inflight -= 1
+
+            if judged:
+                metrics.DISPATCHES.labels('judged').inc()
+                node.problems.add(job.problem_code)
+                return
+            metrics.DISPATCHES.labels('busy').inc()
+
+        if not relayed:
+            job.events.put_nowait({'header': 'busy'})
+        else:
+            job.events.put_nowait({'header': 'internal-error', 'error': 'Every judge node tried has failed.'})
+            job.events.put_nowait({'header': 'judging-end'})
+
+    async def forward(self, node, job, relayed):
+        """Judges the job on the node, relaying the events that weren't relayed
+        already. Returns `False` if the node is too busy to take the job, and
+        raises an `OSError` if the node fails (or is dropped) before it's
+        done."""
+        reader, writer = await asyncio.open_connection(*node.address)
+        try:
+            await send_data(writer, {**job.message, 'header': 'submit', 'access-token': config.JUDGE_ACCESS_TOKEN})
+
+            while (event := await self.read_event(node, reader)) is not None:
+                if event['header'] == 'busy':
+                    return False
+
+                key = (event['header'], event.get('case-num'))
+                if key not in relayed:
+                    relayed.add(key)
+                    job.events.put_nowait(event)
+
+                if event['header'] == 'judging-end':
+                    return True
+        finally:
+            writer.close()
+
+        raise ConnectionError('The connection was closed before judging ended')
+
+    async def read_event(self, node, reader):
+        # A node that hangs, or is cut off without the connection being closed,
+        # would never send the next event, but it stops sending heartbeats too.
+        read = asyncio.ensure_future(read_data(reader))
+        gone = asyncio.ensure_future(node.gone.wait())
+        try:
+            done, _ = await asyncio.wait((read, gone), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            read.cancel()
+            gone.cancel()
+
+        if read not in done:
+            raise ConnectionError('The node was dropped before judging ended')
+        return read.result()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='[%(asctime)s] %(name)s %(levelname)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+    parser = argparse.ArgumentParser(description='Dispatches submissions to the judges of a cluster.')
+    parser.add_argument('--address', type=parse_address, default=config.SERVER_ADDRESS, metavar='HOST:PORT',
+                        help='the address to listen on, for the site and the judges (default: SERVER_ADDRESS)')
+    args = parser.parse_args()
+
+    coordinator = Coordinator(args.address)
+    asyncio.run(coordinator.serve_forever())
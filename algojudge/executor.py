@@ -0,0 +1,260 @@
+from algojudge import tracing
+from algojudge.cache import get_testdata_cache
+from algojudge.sandbox import get_pool
+from algojudge.verdict import Status, Verdict
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from itertools import accumulate
+from threading import Lock
+
+import logging
+
+
+class BatchTracker:
+    """Keeps track of which batches of a submission have failed, so that the
+    remaining cases of those batches and of the batches depending on them can
+    be skipped. A batch with partially accepted cases scores the smallest
+    fraction of points of any of them."""
+
+    def __init__(self, problem):
+        self.batches = {batch.num: batch for batch in problem.batches}
+        self.lock = Lock()
+        self.failed = set()
+        self.fractions = {}
+
+    def fail(self, case):
+        if case.batch is not None:
+            with self.lock:
+                self.failed.add(case.batch)
+
+    def score(self, case, fraction):
+        if case.batch is not None:
+            with self.lock:
+                self.fractions[case.batch] = min(fraction, self.fractions.get(case.batch, 1))
+
+    def should_skip(self, case):
+        if case.batch is None:
+            return False
+        with self.lock:
+            return case.batch in self.failed or not self.failed.isdisjoint(self.batches[case.batch].dependencies)
+
+    def points(self):
+        """Returns the points scored so far and the total points available."""
+        with self.lock:
+            scored = sum(batch.points * self.fractions.get(batch.num, 1) for batch in self.batches.values()
+                         if not self.failed & (batch.dependencies | {batch.num}))
+        return scored, sum(batch.points for batch in self.batches.values())
+
+
+class CasePrefetcher:
+    """Gets the cases of a submission ready ahead of time on a small pool of
+    threads: the boxes that they'll run in are initialized, and their input
+    and expected output extracted into the test data cache, while the
+    submission compiles and while the cases before them run.
+
+    Only `max_cases` cases, holding at most `max_bytes` of data between them,
+    are fetched ahead of the next case to run, so that a submission that
+    stops early doesn't extract all of a problem's data for nothing. Files are
+    extracted a chunk at a time, so huge ones don't take up memory either.
+    Nothing is extracted if the test data cache is disabled."""
+
+    def __init__(self, problem, workers, max_cases, max_bytes):
+        self.problem = problem
+        self.max_cases = max(1, max_cases)
+        self.max_bytes = max_bytes
+        self.cache = get_testdata_cache()
+
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='prefetch') if workers > 0 else None
+        # The work that was handed to the pool and may not be done, with the
+        # index of the case that's fetched, if any.
+        self.futures = {}
+        self.cases = []
+        # The running total of the size of the cases' data.
+        self.offsets = [0]
+        self.next = 0
+
+    def __enter__(self):
+        return self
+
+    def start(self, cases, boxes):
+        """Starts getting `boxes` boxes and the first cases ready. Returns an
+        iterator over the cases, which prefetches further ahead as it goes."""
+        self.cases = list(cases)
+        if self.pool is None:
+            return iter(self.cases)
+
+        self._submit(get_pool('submission').fill, min(boxes, len(self.cases)))
+        if self.cache is not None:
+            archive = self.problem.open_archive()
+            sizes = (archive.getinfo(case.infile).file_size + archive.getinfo(case.outfile).file_size
+                     for case in self.cases)
+            self.offsets = [0, *accumulate(sizes)]
+            self._advance(0)
+        return self._iterate()
+
+    def pause(self):
+        """Drops the work that hasn't started yet and waits for the rest, so
+        that nothing is fetched while the submission is preempted. Cases that
+        weren't fetched are fetched again as the submission goes on."""
+        futures, self.futures = self.futures, {}
+        for future in futures:
+            future.cancel()
+        wait(futures)
+
+        cancelled = [num for future, num in futures.items() if future.cancelled() and num is not None]
+        if cancelled:
+            self.next = min(cancelled)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _iterate(self):
+        for num, case in enumerate(self.cases):
+            # The case is about to run, so fetch the ones after it meanwhile.
+            if self.cache is not None:
+                self._advance(num + 1)
+            yield case
+
+    def _advance(self, start):
+        # Fetches the cases from `start` on that fit in the window.
+        self.next = max(self.next, start)
+        while self.next < len(self.cases) and self.next - start < self.max_cases:
+            if self.next > start and self.offsets[self.next + 1] - self.offsets[start] > self.max_bytes:
+                return
+            self._submit(self._fetch, self.cases[self.next], num=self.next)
+            self.next += 1
+
+    def _fetch(self, case):
+        with tracing.span('prefetch', num=case.num):
+            for name in (case.infile, case.outfile):
+                try:
+                    self.cache.path(self.problem, name)
+                except Exception:
+                    # The case will run into the same error, and report it.
+                    logging.debug(f'Failed to prefetch {name!r} of {self.problem.code!r}', exc_info=True)
+                    return
+
+    def _submit(self, fn, *args, num=None):
+        self.futures = {future: num for future, num in self.futures.items() if not future.done()}
+        # Like the cases, in a copy of the context to show up in the trace.
+        self.futures[self.pool.submit(copy_context().run, fn, *args)] = num
+
+
+class CaseExecutor:
+    """Runs the cases of a submission in parallel on a pool of worker threads.
+
+    Every case still gets a sandbox (and cgroup) of its own, so the per-case
+    `cpu_time`/`memory` accounting is not affected by its neighbours."""
+
+    def __init__(self, runner, workers=1, ordered=True, tracker=None):
+        self.runner = runner
+        self.workers = max(1, workers)
+        self.ordered = ordered
+        self.tracker = tracker
+
+        # The cases that were handed to the pool and whose verdicts haven't been
+        # yielded yet, by their future.
+        self.inflight = {}
+        self.paused = False
+
+    def run(self, cases):
+        if self.workers == 1:
+            for case in cases:
+                yield self.run_case(case)
+            return
+
+        pool = ThreadPoolExecutor(self.workers, thread_name_prefix='case')
+        try:
+            if self.ordered:
+                yield from self._run_ordered(pool, cases)
+            else:
+                yield from self._run_unordered(pool, cases)
+        finally:
+            # If the consumer stops early (e.g. an error occured), don't bother
+            # running the cases that haven't been started yet.
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def pause(self):
+        """Stops the cases in flight that haven't started yet, and waits for the
+        others to finish, so that none of the submission's cases run while it's
+        preempted. May only be called while `run()` is suspended, and the cases
+        that were stopped are run again once it's resumed."""
+        for future in self.inflight:
+            future.cancel()
+        wait(self.inflight)
+        self.paused = True
+
+    def run_case(self, case):
+        # Whether a case can be skipped is decided as late as possible, so that
+        # cases which are queued when their batch fails are skipped too.
+        if self.tracker is not None and self.tracker.should_skip(case):
+            return Verdict(case, Status.SK)
+
+        with tracing.span('case', num=case.num):
+            verdict = self.runner.run(case)
+
+        if self.tracker is not None:
+            if verdict.status == Status.PA:
+                self.tracker.score(case, verdict.points)
+            elif verdict.status != Status.AC:
+                self.tracker.fail(case)
+        return verdict
+
+    def _submit(self, pool, case):
+        # The worker threads run each case in a copy of the submitter's context,
+        # so that its cases end up in the submission's trace.
+        future = pool.submit(copy_context().run, self.run_case, case)
+        self.inflight[future] = case
+        return future
+
+    def _result(self, future):
+        del self.inflight[future]
+        return future.result()
+
+    def _resume(self, pool, pending):
+        # Submits the cases that `pause()` stopped again, in the same order.
+        self.paused = False
+        return [self._submit(pool, self.inflight.pop(future)) if future.cancelled() else future
+                for future in pending]
+
+    def _run_ordered(self, pool, cases):
+        # Keep a few more cases in flight than there are workers so that a
+        # slow case at the head of the queue doesn't leave the others idle.
+        window = self.workers * 2
+        pending = deque()
+
+        for case in cases:
+            pending.append(self._submit(pool, case))
+            if len(pending) >= window:
+                yield self._result(pending.popleft())
+                if self.paused:
+                    pending = deque(self._resume(pool, pending))
+
+        while pending:
+            yield self._result(pending.popleft())
+            if self.paused:
+                pending = deque(self._resume(pool, pending))
+
+    def _run_unordered(self, pool, cases):
+        cases = iter(cases)
+        pending = set()
+
+        while True:
+            for case in cases:
+                pending.add(self._submit(pool, case))
+                if len(pending) >= self.workers:
+                    break
+
+            if not pending:
+                return
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield self._result(future)
+            if self.paused:
+                pending = set(self._resume(pool, pending))
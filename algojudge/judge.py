@@ -1,5 +1,9 @@
+from algojudge import config, metrics, tracing
+from algojudge.checker import get_checker, get_interactor
+from algojudge.executor import BatchTracker, CaseExecutor, CasePrefetcher
 from algojudge.runners import CompileError, RUNNERS
-from algojudge.problem import Problem
+from algojudge.problem import problems
+from algojudge.verdict import Status
 from typing import NamedTuple
 
 import logging
@@ -16,22 +20,84 @@ class Submission(NamedTuple):
 
 
 class Judge:
-    def judge(self, submission):
+    def judge(self, submission, should_pause=None):
+        """Returns a generator of the events of judging the submission. If
+        `should_pause` is given, it's asked after every case, and when it's true
+        the submission stops running cases and yields a `paused` event, to be
+        resumed later."""
+        judging = self._judge(submission, should_pause)
+
+        trace = tracing.start(f'submission {submission.id}', id=submission.id,
+                              problem=submission.problem_code, language=submission.language)
+        if trace is not None:
+            judging = trace.wrap(judging)
+
+        return judging
+
+    def _judge(self, submission, should_pause):
+        with tracing.span('judge'):
+            yield from self._judge_cases(submission, should_pause)
+
+    def _judge_cases(self, submission, should_pause):
+        language = submission.language
         try:
-            problem = Problem(submission.problem_code, submission.time_limit, submission.memory_limit)
+            with problems.use(submission.problem_code, submission.time_limit, submission.memory_limit) as problem, \
+                 CasePrefetcher(problem, config.PREFETCH_WORKERS, config.PREFETCH_CASES,
+                                config.PREFETCH_MAX_BYTES) as prefetcher:
+                cases = problem.fail_first() if config.CASE_ORDER == 'fail-first' else problem.cases
+                # The cases are got ready while the submission compiles.
+                cases = prefetcher.start(cases, config.CASE_WORKERS)
+
+                with tracing.span('prepare'):
+                    # The problem's own programs are compiled before the
+                    # submission checks out its compile box, so that a worker
+                    # never holds one box while waiting for another.
+                    if problem.comparator == 'program':
+                        get_checker(problem).prepare()
+                    if problem.interactor is not None:
+                        get_interactor(problem).prepare()
+
+                with RUNNERS[submission.language](problem, submission.source) as runner:
+                    with tracing.span('prepare'):
+                        runner.prepare()
+
+                    tracker = BatchTracker(problem)
+                    executor = CaseExecutor(runner, config.CASE_WORKERS, config.ORDERED_VERDICTS, tracker)
+
+                    # The verdict of the submission as a whole is that of the
+                    # first case (in the order they're reported) to fail.
+                    result = Status.AC
+
+                    yield 'case-begin', {}
+                    for verdict in executor.run(cases):
+                        if verdict.status == Status.SK:
+                            yield 'case-skipped', {'case-num': verdict.case.num, 'batch': verdict.case.batch}
+                            continue
+
+                        metrics.CASE_VERDICTS.labels(language, verdict.status.name).inc()
+                        if verdict.status != Status.AC:
+                            problem.record_failure(verdict.case)
+                            if result == Status.AC:
+                                result = verdict.status
+                        yield 'case-verdict', verdict.to_json()
 
-            with RUNNERS[submission.language](problem, submission.source) as runner:
-                runner.prepare()
+                        if should_pause is not None and should_pause():
+                            # Nothing of the submission runs while it's paused,
+                            # so that it doesn't slow down the one it makes way
+                            # for.
+                            executor.pause()
+                            prefetcher.pause()
+                            yield 'paused', {}
 
-                yield 'case-begin', {}
-                for case in problem.cases:
-                    verdict = runner.run(case)
-                    yield 'case-verdict', verdict.to_json()
-                yield 'case-end', {}
+                    points, total_points = tracker.points()
+                    metrics.SUBMISSIONS.labels(language, result.name).inc()
+                    yield 'case-end', {'points': points, 'total-points': total_points}
         except CompileError as e:
+            metrics.SUBMISSIONS.labels(language, Status.CE.name).inc()
             yield 'compile-error', {'error': str(e)}
         except Exception:
             self._report_internal_error(submission)
+            metrics.SUBMISSIONS.labels(language, Status.IE.name).inc()
             yield 'internal-error', {'error': traceback.format_exc()}
 
     def _report_internal_error(self, submission):
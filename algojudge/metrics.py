@@ -0,0 +1,253 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+import asyncio
+import logging
+import math
+
+
+# Every metric in the order it was defined, which is the order they're rendered.
+REGISTRY = []
+
+# Upper bounds (in seconds) of the histogram buckets, from a fast sandbox run to
+# a slow compilation.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """A family of values of the same metric, one for each combination of label
+    values. Metrics without labels have a single value and can be used
+    directly. Updating a value takes a lock, so metrics may be updated from any
+    thread and cost a microsecond or so."""
+
+    type: str
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+
+        self.lock = Lock()
+        self.children = {}
+        registry.append(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f'{self.name} takes the labels {self.label_names}')
+            with self.lock:
+                child = self.children.setdefault(values, self.make_child())
+        return child
+
+    def make_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self.lock:
+            children = sorted(self.children.items())
+        for values, child in children:
+            lines += child.render(self.name, dict(zip(self.label_names, values)))
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def make_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def make_child(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def make_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class _CounterValue:
+    def __init__(self):
+        self.lock = Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name, labels):
+        return [f'{name}{_format_labels(labels)} {_format_value(self.value)}']
+
+
+class _GaugeValue(_CounterValue):
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.lock = Lock()
+        self.buckets = buckets
+        # The last count is of the values above every bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Observes how long the block takes, in seconds."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+    def render(self, name, labels):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels({**labels, "le": bound})} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+        lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return lines
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    def escape(value):
+        if isinstance(value, float):
+            return _format_value(value)
+        return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(registry=REGISTRY):
+    """Returns every metric in the Prometheus text format."""
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+async def start_http_server(address):
+    """Serves the metrics over HTTP at `address`, for Prometheus to scrape. Any
+    path is answered with the metrics. Returns the `asyncio.Server`."""
+    return await asyncio.start_server(_handle_http, *address, reuse_address=True)
+
+async def _handle_http(reader, writer):
+    try:
+        # Nothing in the request matters, but it has to be read in full.
+        while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+
+        body = render().encode('utf-8')
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                     b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                     b'Connection: close\r\n'
+                     b'\r\n' + body)
+        await writer.drain()
+    except ConnectionError:
+        logging.debug('Metrics connection lost')
+    finally:
+        writer.close()
+
+
+SUBMISSIONS = Counter(
+    'algojudge_submissions_total',
+    'Submissions judged, by language and verdict (the first failed case, or CE or IE).',
+    ('language', 'verdict')
+)
+CASE_VERDICTS = Counter(
+    'algojudge_case_verdicts_total',
+    'Test cases judged, by language and verdict.',
+    ('language', 'verdict')
+)
+COMPILE_TIME = Histogram(
+    'algojudge_compile_seconds',
+    'Time spent compiling submissions, excluding those found in the artifact cache.',
+    ('language',)
+)
+SANDBOX_TIME = Histogram(
+    'algojudge_sandbox_seconds',
+    'Time spent on each sandbox operation: init, reset, run or delete.',
+    ('operation',)
+)
+INPUT_TIME = Histogram(
+    'algojudge_input_seconds',
+    'Time spent putting the input of a test case into its box.'
+)
+COMPARE_TIME = Histogram(
+    'algojudge_compare_seconds',
+    'Time spent comparing output after the program has terminated, by comparator.',
+    ('comparator',)
+)
+QUEUE_DEPTH = Gauge(
+    'algojudge_queue_depth',
+    'Submissions waiting to be judged.'
+)
+ACTIVE_BOXES = Gauge(
+    'algojudge_active_boxes',
+    'Sandbox boxes checked out of the pool.'
+)
+NODES = Gauge(
+    'algojudge_nodes',
+    'Judge nodes registered with the coordinator.'
+)
+DISPATCHES = Counter(
+    'algojudge_dispatches_total',
+    'Submissions sent to a node by the coordinator, by outcome: judged, busy or failed.',
+    ('outcome',)
+)
@@ -1,8 +1,16 @@
-from algojudge import config
+from algojudge import config, tracing
+from algojudge.cache import get_testdata_cache
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
+from threading import Lock
 from typing import NamedTuple
 from zipfile import ZipFile
 
+import ast
+import hashlib
+import logging
+import os
 import yaml
 
 
@@ -12,28 +20,311 @@ class TestCase(NamedTuple):
     outfile: str
     time_limit: int
     memory_limit: int
+    batch: int = None
+
+
+class Batch(NamedTuple):
+    num: int
+    points: int
+    dependencies: frozenset  # Every batch this one depends on, transitively.
+    cases: tuple
 
 
 class Problem:
-    def __init__(self, code, time_limit, memory_limit):
+    """A problem as seen by a submission. Problems handed out by the registry
+    are shared between submissions, so they must not be modified."""
+
+    def __init__(self, code, time_limit, memory_limit, data=None, archive=None, stamp=None, failures=None):
         self.code = code
         self.time_limit = time_limit
         self.memory_limit = memory_limit
 
         self.problem_path = Path(config.PROBLEM_DATA_ROOT) / self.code
 
-        with open(self.problem_path / 'config.yml') as f:
-            data = yaml.safe_load(f)
-            self.archive_name = data['archive']
-            self.comparator = data.get('checker', 'standard')
-            self.cases = self._parse_cases(data)
+        if data is None:
+            with open(self.problem_path / 'config.yml') as f:
+                data = yaml.safe_load(f)
+
+        self.archive_name = data['archive']
+        self.comparator, self.comparator_args = _parse_checker(data.get('checker', 'standard'))
+        if self.comparator == 'program' and 'file' not in self.comparator_args:
+            raise ValueError(f'The checker program of {self.code!r} is missing its file')
+
+        # Interactive problems have a program that talks to the contestant's.
+        self.interactor = data.get('interactor')
+        if isinstance(self.interactor, str):
+            self.interactor = {'file': self.interactor}
+        if self.interactor is not None and 'file' not in self.interactor:
+            raise ValueError(f'The interactor of {self.code!r} is missing its file')
+        self.cases, self.batches = self._parse_cases(data)
+
+        # Identifies this version of the problem's data, e.g. for caching.
+        if stamp is None:
+            stamp = _stamp(self.problem_path, self.archive_name)
+        self.version = _version(stamp)
+
+        self._archive = archive
+        self._owns_archive = archive is None
+        # The registry's entry of the problem, if it came from the registry.
+        self._entry = None
+
+        # How often each case has failed, shared with the instances of the
+        # problem that have other limits. Unlike the rest of the problem, this
+        # is updated by the submissions using it.
+        self._failures = Counter() if failures is None else failures
 
     def open_archive(self):
-        return ZipFile(self.problem_path / self.archive_name, 'r')
+        # The archive is shared by every user of the problem, which is fine
+        # since it is only ever read from.
+        if self._archive is None:
+            self._archive = ZipFile(self.problem_path / self.archive_name, 'r')
+        return self._archive
+
+    def close(self):
+        """Closes the archive, if the problem opened it itself rather than being
+        given it (e.g. by the registry)."""
+        if self._owns_archive and self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def record_failure(self, case):
+        with _failures_lock:
+            self._failures[case.num] += 1
+
+    def fail_first(self):
+        """Returns the cases ordered so that the ones that have failed most often
+        come first, which lets wrong submissions be rejected early."""
+        with _failures_lock:
+            return sorted(self.cases, key=lambda case: -self._failures[case.num])
 
     def _parse_cases(self, data):
+        # Each entry is either a case or a batch of cases, which only scores its
+        # points if all of its cases and the batches it depends on pass.
         cases = []
-        for index, case in enumerate(data['cases']):
-            cases.append(TestCase(index + 1, case['in'], case['out'],
-                                  self.time_limit, self.memory_limit))
-        return cases
+        batches = []
+        for entry in data['cases']:
+            if 'batch' not in entry:
+                cases.append(self._make_case(len(cases) + 1, entry))
+                continue
+
+            num = len(batches) + 1
+            dependencies = set()
+            for dependency in entry.get('depends', []):
+                if not 1 <= dependency < num:
+                    raise ValueError(f'Batch {num} of {self.code!r} depends on batch {dependency}, '
+                                     f'which is not an earlier batch')
+                dependencies.add(dependency)
+                dependencies |= batches[dependency - 1].dependencies
+
+            batch_cases = [self._make_case(len(cases) + i + 1, case, num) for i, case in enumerate(entry['batch'])]
+            cases += batch_cases
+            batches.append(Batch(num, entry.get('points', 0), frozenset(dependencies), tuple(batch_cases)))
+
+        return tuple(cases), tuple(batches)
+
+    def _make_case(self, num, case, batch=None):
+        return TestCase(num, case['in'], case['out'], self.time_limit, self.memory_limit, batch)
+
+
+class _Entry:
+    def __init__(self, stamp, data, archive):
+        self.stamp = stamp
+        self.data = data
+        self.archive = archive
+        self.problems = {}
+        self.failures = Counter()
+
+        # The number of users of the entry's problems. Once the entry leaves
+        # the registry, its archive is closed as soon as it has no users.
+        self.users = 0
+        self.dropped = False
+        self.closed = False
+        # What to call once the entry is closed (see `on_release()`).
+        self.callbacks = []
+
+
+class ProblemRegistry:
+    """Caches problems across submissions, so that `config.yml` is parsed and
+    the archive's index is read only once. A problem is reloaded as soon as
+    its config or archive changes on disk.
+
+    The archive of a problem that is reloaded or evicted is closed once none
+    of its users (see `use()`) need it anymore, which releases that version
+    of the problem (see `on_release()`)."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.entries = OrderedDict()
+
+    def get(self, code, time_limit, memory_limit):
+        """Returns the problem, whose archive is only guaranteed to stay open
+        for as long as it's cached. Use `use()` to judge a submission."""
+        return self._get(code, time_limit, memory_limit, acquire=False)
+
+    @contextmanager
+    def use(self, code, time_limit, memory_limit):
+        """Returns the problem for the duration of the block, keeping its archive
+        open even if the problem changes or is evicted meanwhile."""
+        with tracing.span('load-problem'):
+            problem = self._get(code, time_limit, memory_limit, acquire=True)
+        try:
+            yield problem
+        finally:
+            self.release(problem)
+
+    def release(self, problem):
+        entry = problem._entry
+        if entry is not None:
+            with self.lock:
+                entry.users -= 1
+                callbacks = self._close_unused(entry)
+            _call(callbacks)
+
+    def on_release(self, problem, callback):
+        """Calls `callback` once the version of the problem has left the
+        registry and no submission uses it anymore, e.g. to close what was made
+        for that version, or right away if that has already happened. Problems
+        that didn't come from the registry are never released."""
+        entry = problem._entry
+        if entry is None:
+            return
+
+        with self.lock:
+            if not entry.closed:
+                entry.callbacks.append(callback)
+                return
+        callback()
+
+    def _get(self, code, time_limit, memory_limit, acquire):
+        problem_path = Path(config.PROBLEM_DATA_ROOT) / code
+        key = str(problem_path)
+
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry is None or entry.stamp != _stamp(problem_path, entry.data['archive']):
+                entry = self._load(key, problem_path)
+
+                # Whatever was cached for the old version is of no use anymore.
+                testdata_cache = get_testdata_cache()
+                if testdata_cache is not None:
+                    testdata_cache.purge(code, keep=_version(entry.stamp))
+
+            with self.lock:
+                # Another thread may have evicted the entry since, and closed
+                # its archive if nobody was using it, in which case it's loaded
+                # again.
+                if entry.closed:
+                    continue
+                if self.entries.get(key) is entry:
+                    self.entries.move_to_end(key)
+                if acquire:
+                    entry.users += 1
+
+                problem = entry.problems.get((time_limit, memory_limit))
+                if problem is None:
+                    problem = Problem(code, time_limit, memory_limit, entry.data, entry.archive, entry.stamp,
+                                      entry.failures)
+                    problem._entry = entry
+                    entry.problems[time_limit, memory_limit] = problem
+
+            return problem
+
+    def codes(self):
+        """Returns the codes of the problems that are cached."""
+        with self.lock:
+            return [Path(key).name for key in self.entries]
+
+    def preload(self, codes):
+        for code in codes:
+            problem_path = Path(config.PROBLEM_DATA_ROOT) / code
+            self._load(str(problem_path), problem_path)
+
+    def _load(self, key, problem_path):
+        # Files are stat'ed before they're read, so that a change made while
+        # we're reading them is picked up next time.
+        config_stamp = _stat(problem_path / 'config.yml')
+        with open(problem_path / 'config.yml') as f:
+            data = yaml.safe_load(f)
+
+        archive_stamp = _stat(problem_path / data['archive'])
+        archive = ZipFile(problem_path / data['archive'], 'r')
+
+        entry = _Entry((config_stamp, archive_stamp), data, archive)
+        callbacks = []
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                callbacks += self._drop(old)
+
+            self.entries[key] = entry
+            # The new entry is kept even if the cache is smaller than that, so
+            # that it can be used at least once.
+            while len(self.entries) > max(config.PROBLEM_CACHE_SIZE, 1):
+                _, old = self.entries.popitem(last=False)
+                callbacks += self._drop(old)
+
+        _call(callbacks)
+        return entry
+
+    def _drop(self, entry):
+        entry.dropped = True
+        return self._close_unused(entry)
+
+    def _close_unused(self, entry):
+        # Returns the callbacks of the entry if it's closed, to be called once
+        # the lock is released.
+        if entry.dropped and not entry.users and not entry.closed:
+            entry.archive.close()
+            entry.closed = True
+            callbacks, entry.callbacks = entry.callbacks, []
+            return callbacks
+        return []
+
+
+_failures_lock = Lock()
+
+def _call(callbacks):
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception:
+            logging.exception('Failed to release a problem')
+
+def _parse_checker(checker):
+    """Parses the `checker` key of a problem's config, which is either the name
+    of a comparator, a call such as `float(abs=1e-6)`, or a mapping with the
+    name under `name` and the arguments alongside it. Returns the name and a
+    dict of arguments."""
+    if isinstance(checker, dict):
+        args = dict(checker)
+        return args.pop('name'), args
+
+    try:
+        node = ast.parse(checker.strip(), mode='eval').body
+        if isinstance(node, ast.Name):
+            return node.id, {}
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.args \
+                and all(kw.arg for kw in node.keywords):
+            return node.func.id, {kw.arg: ast.literal_eval(kw.value) for kw in node.keywords}
+    except (SyntaxError, ValueError):
+        pass
+
+    raise ValueError(f'Invalid checker: {checker!r}')
+
+def _stamp(problem_path, archive_name):
+    return (_stat(problem_path / 'config.yml'), _stat(problem_path / archive_name))
+
+def _version(stamp):
+    return hashlib.sha256(repr(stamp).encode()).hexdigest()[:16]
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+problems = ProblemRegistry()
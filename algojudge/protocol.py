@@ -0,0 +1,217 @@
+from io import BytesIO
+
+import asyncio
+import json
+import struct
+import zlib
+
+
+# Version 1 sends one JSON document per frame, and handles a single request per
+# connection. A client opts into version 2 by sending a `hello` first, after
+# which the connection carries any number of requests tagged by `id`, and each
+# frame carries a batch of messages in the negotiated encoding.
+VERSION = 2
+
+ENCODINGS = ('json', 'binary')
+COMPRESSIONS = (None, 'zlib')
+
+# Frames of version 2 start with a byte of flags.
+FLAG_COMPRESSED = 1
+
+# Frames smaller than this aren't worth compressing.
+COMPRESSION_THRESHOLD = 256
+
+# Strings that are sent often enough to be encoded as a single byte by the
+# binary encoding. Only ever append to this list, since both sides must agree
+# on it.
+STRINGS = (
+    # Headers
+    'hello', 'submit', 'cancel', 'stats', 'queued', 'busy', 'judging-begin',
+    'judging-end', 'case-begin', 'case-verdict', 'case-skipped', 'case-end',
+    'compile-error', 'internal-error',
+    # Keys
+    'header', 'id', 'case-num', 'batch', 'input', 'output', 'status', 'message',
+    'cpu-time', 'real-time', 'memory', 'points', 'total-points', 'position',
+    'error', 'queue',
+    # Statuses
+    'AC', 'WA', 'TLE', 'MLE', 'NZE', 'RE', 'CE', 'IE', 'Q', 'J', 'SK',
+    # More keys
+    'metrics',
+    # More statuses
+    'PA',
+    # More keys
+    'startup-time',
+)
+STRING_INDEX = {string: index for index, string in enumerate(STRINGS)}
+
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STR = 5
+TAG_LIST = 6
+TAG_DICT = 7
+TAG_INTERNED = 8
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Codec:
+    """Encodes and decodes the frames of a version 2 connection. Each frame
+    holds a list of messages."""
+
+    def __init__(self, encoding='json', compression=None):
+        if encoding not in ENCODINGS:
+            raise ProtocolError(f'Unknown encoding: {encoding!r}')
+        if compression not in COMPRESSIONS:
+            raise ProtocolError(f'Unknown compression: {compression!r}')
+
+        self.encoding = encoding
+        self.compression = compression
+
+    def encode(self, messages):
+        """Returns the frame for the messages, including its length prefix."""
+        if self.encoding == 'binary':
+            body = encode_binary(messages)
+        else:
+            body = json.dumps(messages, separators=(',', ':')).encode('utf-8')
+
+        flags = 0
+        if self.compression == 'zlib' and len(body) >= COMPRESSION_THRESHOLD:
+            flags |= FLAG_COMPRESSED
+            body = zlib.compress(body)
+
+        return pack_frame(bytes([flags]) + body)
+
+    def decode(self, frame):
+        if not frame:
+            raise ProtocolError('Empty frame')
+
+        flags, body = frame[0], frame[1:]
+        try:
+            if flags & FLAG_COMPRESSED:
+                body = zlib.decompress(body)
+            if self.encoding == 'binary':
+                messages = decode_binary(body)
+            else:
+                messages = json.loads(body)
+        except (ValueError, TypeError, zlib.error, struct.error, IndexError) as e:
+            raise ProtocolError(f'Malformed frame: {e}') from e
+
+        if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+            raise ProtocolError('A frame must hold a list of messages')
+        return messages
+
+
+def pack_frame(body):
+    return struct.pack('!I', len(body)) + body
+
+async def read_frame(reader):
+    """Reads the body of the next frame, or returns `None` at EOF."""
+    try:
+        packed_length = await reader.readexactly(4)
+        return await reader.readexactly(struct.unpack('!I', packed_length)[0])
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def encode_binary(obj):
+    out = bytearray()
+    _encode(obj, out)
+    return bytes(out)
+
+def decode_binary(data):
+    stream = BytesIO(data)
+    obj = _decode(stream)
+    if stream.read(1):
+        raise ValueError('Trailing data')
+    return obj
+
+def _encode(obj, out):
+    if obj is None:
+        out.append(TAG_NONE)
+    elif obj is False:
+        out.append(TAG_FALSE)
+    elif obj is True:
+        out.append(TAG_TRUE)
+    elif isinstance(obj, int):
+        out.append(TAG_INT)
+        # Zigzag encoding keeps small negative numbers short.
+        _encode_varint(obj << 1 if obj >= 0 else (~obj << 1) | 1, out)
+    elif isinstance(obj, float):
+        out.append(TAG_FLOAT)
+        out += struct.pack('!d', obj)
+    elif isinstance(obj, str):
+        index = STRING_INDEX.get(obj)
+        if index is not None:
+            out.append(TAG_INTERNED)
+            out.append(index)
+        else:
+            data = obj.encode('utf-8')
+            out.append(TAG_STR)
+            _encode_varint(len(data), out)
+            out += data
+    elif isinstance(obj, (list, tuple)):
+        out.append(TAG_LIST)
+        _encode_varint(len(obj), out)
+        for item in obj:
+            _encode(item, out)
+    elif isinstance(obj, dict):
+        out.append(TAG_DICT)
+        _encode_varint(len(obj), out)
+        for key, value in obj.items():
+            _encode(key, out)
+            _encode(value, out)
+    else:
+        raise TypeError(f'Cannot encode {type(obj).__name__}')
+
+def _decode(stream):
+    tag = stream.read(1)[0]
+
+    if tag == TAG_NONE:
+        return None
+    if tag == TAG_FALSE:
+        return False
+    if tag == TAG_TRUE:
+        return True
+    if tag == TAG_INT:
+        value = _decode_varint(stream)
+        return value >> 1 if not value & 1 else ~(value >> 1)
+    if tag == TAG_FLOAT:
+        return struct.unpack('!d', stream.read(8))[0]
+    if tag == TAG_STR:
+        length = _decode_varint(stream)
+        data = stream.read(length)
+        if len(data) != length:
+            raise ValueError('Truncated string')
+        return data.decode('utf-8')
+    if tag == TAG_INTERNED:
+        return STRINGS[stream.read(1)[0]]
+    if tag == TAG_LIST:
+        return [_decode(stream) for _ in range(_decode_varint(stream))]
+    if tag == TAG_DICT:
+        obj = {}
+        for _ in range(_decode_varint(stream)):
+            key = _decode(stream)
+            obj[key] = _decode(stream)
+        return obj
+
+    raise ValueError(f'Unknown tag {tag}')
+
+def _encode_varint(value, out):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _decode_varint(stream):
+    value = shift = 0
+    while True:
+        byte = stream.read(1)[0]
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value
+        shift += 7
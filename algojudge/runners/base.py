@@ -1,11 +1,18 @@
-from algojudge import config, utils
-from algojudge.comparators import COMPARATORS
-from algojudge.sandbox import Sandbox, SandboxConfig
+from algojudge import calibration, config, metrics, tracing, utils, warmup
+from algojudge.cache import get_artifact_cache, get_testdata_cache
+from algojudge.checker import CheckerError, get_checker, get_interactor
+from algojudge.comparators import COMPARATORS, STREAMING_COMPARATORS
+from algojudge.sandbox import SandboxConfig, get_pool
 from algojudge.verdict import Status, Verdict
 from abc import ABCMeta, abstractmethod
+from pathlib import Path
+from shutil import rmtree
 
+import logging
 import os
-import uuid
+import signal
+import tempfile
+import time
 
 
 class CompileError(Exception):
@@ -22,6 +29,15 @@ class Runner(metaclass=ABCMeta):
     source_ext: str
     max_fsize: int = 262144
     max_pids: int = 1
+    # A program that does nothing, whose runs tell how long the language takes
+    # to start (see `algojudge.calibration`).
+    trivial_source: str = ''
+
+    # The binary of the language's toolchain, if startup accelerators can be
+    # built for it (see `algojudge.warmup`), and the arguments of a program
+    # that it's timed with to tell whether they help.
+    warmup_binary: str = None
+    warmup_probe: tuple = ()
 
     _registry = {}
 
@@ -29,6 +45,8 @@ class Runner(metaclass=ABCMeta):
         self.problem = problem
         # Convert all line endings in source to `\n` and enforce UTF-8 encoding.
         self.source = utils.normalize_lines(source).decode('utf-8', errors='replace')
+        # Looked up once, so that every case of the submission starts the same.
+        self.warmup_path = warmup.get_path(type(self))
 
     def __enter__(self):
         self.problem_archive = self.problem.open_archive()
@@ -43,67 +61,231 @@ class Runner(metaclass=ABCMeta):
         pass
 
     def run(self, case):
-        # The sandbox is given a randomly-generated uuid name; the chance that
-        # a duplicate occurs is so incredibly low that we should be fine leaving
-        # it alone... probably.
-        with Sandbox(f'box-{uuid.uuid4().hex}') as self.box:
-            self.copy_executable()
-
-            # Copy the case input from the archive into the sandbox directory.
-            old_name = self.problem_archive.extract(case.infile, self.box.root_path)
-            os.rename(old_name, self.box.stdin_path)
-
-            config = SandboxConfig(
-                cpu_time_limit=case.time_limit,
+        # Cases may be run in parallel, so the box is kept local to this call
+        # rather than stored on the runner.
+        with get_pool('submission').box() as box:
+            with tracing.span('copy-executable'):
+                self.copy_executable(box)
+
+            with tracing.span('input'), metrics.INPUT_TIME.time():
+                testdata_cache = get_testdata_cache()
+                if testdata_cache is not None:
+                    # Link the case input into the sandbox directory, so that
+                    # it's only extracted once for all submissions.
+                    testdata_cache.link(self.problem, case.infile, box.stdin_path)
+                else:
+                    # Copy the case input from the archive into the sandbox
+                    # directory.
+                    old_name = self.problem_archive.extract(case.infile, box.root_path)
+                    os.rename(old_name, box.stdin_path)
+
+            # Languages that are slow (or slow to start) can be given more time,
+            # and the startup can be taken off what the program is charged for.
+            startup_time = calibration.get_startup_time(self.code)
+            startup_offset = startup_time if config.STARTUP_TIME_OFFSET and startup_time is not None else 0
+            time_limit = (int(case.time_limit * config.TIME_LIMIT_MULTIPLIERS.get(self.code, 1))
+                          + startup_offset // 10**6)
+
+            conf = SandboxConfig(
+                cpu_time_limit=time_limit,
                 # Real-time isn't really an accurate representation of execution
                 # time, rather a security measure just to make sure that the
                 # program can't sleep() forever.
-                real_time_limit=case.time_limit*2,
+                real_time_limit=time_limit*2,
                 memory_limit=case.memory_limit,
                 max_fsize=self.max_fsize,
-                max_pids=self.max_pids
+                max_pids=self.max_pids,
+                binds=self.get_binds()
             )
 
-            result = self.box.run(self.get_execute_args(), config)
+            # When streaming, this includes the comparison, which runs alongside
+            # the program, and likewise for the interactor.
+            checked = offset = exceeded = None
+            with tracing.span('run'), metrics.SANDBOX_TIME.labels('run').time():
+                if self.problem.interactor is not None:
+                    result, checked = self.run_interactive(box, case, conf)
+                elif config.STREAMING_OUTPUT and self.problem.comparator in STREAMING_COMPARATORS:
+                    result, offset, exceeded = self.run_streaming(box, case, conf)
+                else:
+                    result = box.run(self.get_execute_args(), conf)
 
             verdict = Verdict(
                 case=case,
                 status=Status.J,
                 message='',
-                cpu_time=result.cpu_time_ns,
+                cpu_time=max(0, result.cpu_time_ns - startup_offset),
                 real_time=result.real_time_ns,
-                memory=result.memory_kb
+                memory=result.memory_kb,
+                startup_time=startup_time
             )
 
-            if result.is_tle():
+            if exceeded:
+                # Same as exceeding the maximum file size when writing to a file.
+                verdict.status = Status.RE
+                verdict.message = f'signal {signal.SIGXFSZ}'
+            elif result.killed and offset is not None:
+                verdict.status = Status.WA
+                verdict.message = f'wrong output at byte {offset}'
+            elif result.is_tle():
                 verdict.status = Status.TLE
                 verdict.cpu_time = verdict.wall_time = None
             elif result.is_mle():
                 verdict.status = Status.MLE
                 verdict.memory = None
+            elif checked is not None and checked.status == Status.WA:
+                # The program may well have crashed because the interactor gave
+                # up on it, so this comes first.
+                verdict.status, verdict.message = checked.status, checked.message
             elif result.is_re():
                 verdict.status = Status.RE
                 verdict.message = f'signal {result.signal}'
             elif result.is_nze():
                 verdict.status = Status.NZE
                 verdict.message = f'exitcode {result.exitcode}'
+            elif checked is not None:
+                verdict.status, verdict.points, verdict.message = checked
+            elif offset is not None:
+                if offset < 0:
+                    verdict.status = Status.AC
+                else:
+                    verdict.status = Status.WA
+                    verdict.message = f'wrong output at byte {offset}'
+            elif self.problem.comparator == 'program':
+                with tracing.span('compare', comparator=self.problem.comparator), \
+                     metrics.COMPARE_TIME.labels(self.problem.comparator).time():
+                    verdict.status, verdict.points, verdict.message = get_checker(self.problem).check(case, box)
             else:
                 compare = COMPARATORS[self.problem.comparator]
-                with open(self.box.stdout_path, 'rb') as fa, self.problem_archive.open(case.outfile, 'r') as fb:
-                    verdict.status = (Status.WA, Status.AC)[compare(fa, fb)]
+                with tracing.span('compare', comparator=self.problem.comparator), \
+                     metrics.COMPARE_TIME.labels(self.problem.comparator).time(), \
+                     open(box.stdout_path, 'rb') as fa, self.open_output(case) as fb:
+                    verdict.status = (Status.WA, Status.AC)[compare(fa, fb, **self.problem.comparator_args)]
 
             return verdict
 
-    def copy_executable(self):
+    def run_streaming(self, box, case, conf):
+        """Runs the program with its output going through a pipe, checking it as
+        it's produced so that the program can be stopped at the first mismatch.
+        Returns the result, the offset of the first mismatch (or -1), and
+        whether the program exceeded the maximum output size."""
+        read_fd, write_fd = os.pipe()
+        with open(read_fd, 'rb') as fa:
+            try:
+                proc = box.start(self.get_execute_args(), conf, stdout_fd=write_fd)
+            finally:
+                os.close(write_fd)
+
+            output = utils.LimitedReader(fa, self.max_fsize << 10)
+            mismatch = STREAMING_COMPARATORS[self.problem.comparator]
+
+            try:
+                with tracing.span('compare', comparator=self.problem.comparator), \
+                     self.open_output(case) as fb:
+                    offset = mismatch(output, fb, **self.problem.comparator_args)
+            except BaseException:
+                proc.abort()
+                proc.wait()
+                raise
+
+            # If the output has ended, the program has most likely terminated
+            # already and should be judged as usual.
+            if (offset >= 0 and not output.eof) or output.exceeded:
+                proc.abort()
+
+            # Keep the pipe open until the program is gone, so that it's stopped
+            # by us rather than by a SIGPIPE.
+            return proc.wait(), offset, output.exceeded
+
+    def run_interactive(self, box, case, conf):
+        """Runs the program with its stdin and stdout connected to the problem's
+        interactor, which runs in a box of its own, by a pair of pipes. Returns
+        the program's result and the interactor's verdict, which is `None` if
+        the interactor failed because the program did."""
+        interactor = get_interactor(self.problem)
+        interactor.prepare()
+        interactor_conf = SandboxConfig(
+            cpu_time_limit=config.CHECKER_CONFIG.cpu_time_limit,
+            real_time_limit=conf.real_time_limit + config.CHECKER_CONFIG.real_time_limit,
+            memory_limit=config.CHECKER_CONFIG.memory_limit,
+            max_fsize=config.CHECKER_CONFIG.max_fsize,
+            binds=interactor.binds
+        )
+
+        with get_pool('interactor').box() as interactor_box:
+            # Each side only holds on to its own ends, so that it sees EOF as
+            # soon as the other side terminates.
+            program_stdin, interactor_stdout = os.pipe()
+            interactor_stdin, program_stdout = os.pipe()
+            # With the supervisor driver, both programs are started by supervisors
+            # that are already running, which are handed the pipes along with
+            # the request. They're still two supervisors, since one serves a
+            # single program at a time until it exits, and the two have to run
+            # side by side; the second is kept idle for the next case.
+            try:
+                interactor_proc = interactor.start(case, interactor_box, interactor_conf,
+                                                   interactor_stdin, interactor_stdout)
+                try:
+                    proc = box.start(self.get_execute_args(), conf, stdout_fd=program_stdout,
+                                     stdin_fd=program_stdin)
+                except BaseException:
+                    interactor_proc.abort()
+                    interactor_proc.wait()
+                    raise
+            finally:
+                for fd in (program_stdin, interactor_stdout, interactor_stdin, program_stdout):
+                    os.close(fd)
+
+            interactor_result = interactor_proc.wait()
+            # Once the interactor has rejected the program, there's no point in
+            # letting it run any longer.
+            if interactor_result.exitcode != 0:
+                proc.abort()
+            result = proc.wait()
+
+            try:
+                checked = interactor.verdict(interactor_result, interactor_box)
+            except CheckerError:
+                if not (result.is_tle() or result.is_mle() or result.is_re() or result.is_nze()):
+                    raise
+                checked = None
+
+        return result, checked
+
+    @classmethod
+    def build_warmup(cls, path):
+        """Builds the startup accelerators of the language into `path`."""
+        raise NotImplementedError
+
+    @classmethod
+    def get_warmup_args(cls, path):
+        """Returns how to start the toolchain's binary with the accelerators in
+        `path`, or without any if it's `None`."""
+        return [cls.warmup_binary]
+
+    def get_binds(self):
+        # The accelerators must be visible in the box of the program.
+        return () if self.warmup_path is None else (str(self.warmup_path),)
+
+    def open_output(self, case):
+        # The expected output comes from the test data cache if it's enabled,
+        # where it was most likely prefetched (see `CasePrefetcher`) and can be
+        # mapped into memory, rather than being decompressed while comparing.
+        testdata_cache = get_testdata_cache()
+        if testdata_cache is not None:
+            return open(testdata_cache.path(self.problem, case.outfile), 'rb')
+        return self.problem_archive.open(case.outfile, 'r')
+
+    def copy_executable(self, box):
         # Copy the source code into the sandbox directory.
-        with open(self.box.home_path / self.get_source_filename(), 'w') as f:
+        with open(box.home_path / self.get_source_filename(), 'w') as f:
             f.write(self.source)
 
     def get_source_filename(self):
         return 'main' + self.source_ext
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.problem_archive.close()
+        # The archive belongs to the problem, which may outlive the runner.
+        pass
 
     @abstractmethod
     def get_execute_args(self):
@@ -116,34 +298,68 @@ class CompiledRunner(Runner, register=False):
     def __init__(self, problem, source):
         super().__init__(problem, source)
 
-    def __enter__(self):
-        super().__enter__()
-
-        self.compile_box = Sandbox(f'cbox-{uuid.uuid4().hex}')
-        self.compile_box.__enter__()
-
-        return self
+        self.compile_box = None
+        # Where the compiled program is kept once it's compiled.
+        self.compiled_filename = None
+        self.executable_dir = None
 
     def prepare(self):
+        # The compile box is only held while compiling, rather than for as long
+        # as the cases run, so that a submission that is paused (see
+        # `JudgeServer.judge()`) doesn't keep it from the others.
+        with get_pool('compile').box() as self.compile_box:
+            self.compile()
+
+            self.compiled_filename = self.get_compiled_filename()
+            self.executable_dir = Path(tempfile.mkdtemp(prefix='algojudge-'))
+            utils.copy(self.compile_box.home_path / self.compiled_filename, self.get_executable_path())
+        self.compile_box = None
+
+    def compile(self):
         # Copy the source code into the sandbox directory to be compiled.
         with open(self.compile_box.home_path / self.get_source_filename(), 'w') as f:
             f.write(self.source)
 
-        # We must run the compilation step separately in case the compiler
-        # decides to bug out on us or cause a compiler bomb.
-        self.compiled_result = self.compile_box.run(self.get_compile_args(), config.SANDBOX_COMPILE_CONFIG)
+        # The same source is often compiled more than once (e.g. rejudges and
+        # resubmissions), so try to reuse an earlier compilation first.
+        cache = get_artifact_cache()
+        if cache is not None:
+            key = cache.key(self.code, self.get_compile_args(), self.source)
+            with tracing.span('cache-load'):
+                self.compiled_result = cache.load(key, self.compile_box)
+        else:
+            self.compiled_result = None
+
+        if self.compiled_result is None:
+            start = time.perf_counter()
 
-        print(self.compile_box.stdout(), self.compile_box.stderr(), self.compiled_result.exitcode)
+            # We must run the compilation step separately in case the compiler
+            # decides to bug out on us or cause a compiler bomb.
+            with tracing.span('compile'):
+                self.compiled_result = self.compile_box.run(self.get_compile_args(), config.SANDBOX_COMPILE_CONFIG)
+            compile_time = time.perf_counter() - start
+            metrics.COMPILE_TIME.labels(self.code).observe(compile_time)
+
+            # A compilation that timed out might succeed on a less busy judge,
+            # so don't remember it.
+            if cache is not None and not self.compiled_result.is_tle():
+                cache.store(key, self.compile_box, self.compiled_result,
+                            compile_time, exclude={self.get_source_filename()})
+
+        logging.debug(f'Compiled {self.code} with exitcode {self.compiled_result.exitcode}: '
+                      f'{self.compile_box.stderr()!r}')
 
         if self.compiled_result.is_tle():
             raise CompileError('compilation took too long :(')
         if self.compilation_failed():
             raise CompileError(self.get_compile_output())
 
-    def copy_executable(self):
+    def copy_executable(self, box):
         # Copy the binary into the sandbox directory.
-        utils.copy(self.compile_box.home_path / self.get_compiled_filename(),
-                   self.box.home_path / self.get_compiled_filename())
+        utils.copy(self.get_executable_path(), box.home_path / self.compiled_filename)
+
+    def get_executable_path(self):
+        return self.executable_dir / self.compiled_filename
 
     def compilation_failed(self):
         return self.compiled_result.exitcode != 0
@@ -156,7 +372,8 @@ class CompiledRunner(Runner, register=False):
 
     def __exit__(self, exc_type, exc_value, traceback):
         super().__exit__(exc_type, exc_value, traceback)
-        self.compile_box.__exit__(exc_type, exc_value, traceback)
+        if self.executable_dir is not None:
+            rmtree(self.executable_dir, ignore_errors=True)
 
     @abstractmethod
     def get_compile_args(self):
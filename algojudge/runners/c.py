@@ -5,6 +5,7 @@ class CRunner(CompiledRunner):
     code = 'c'
     source_ext = '.c'
     compiled_ext = ''
+    trivial_source = 'int main(void) { return 0; }\n'
 
     def get_compile_args(self):
         return [
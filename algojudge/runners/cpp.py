@@ -5,6 +5,7 @@ class CPPRunner(CompiledRunner):
     code = 'cpp'
     source_ext = '.cpp'
     compiled_ext = ''
+    trivial_source = 'int main() { return 0; }\n'
 
     def get_compile_args(self):
         return [
@@ -1,4 +1,9 @@
 from algojudge.runners.base import CompiledRunner, CompileError
+from pathlib import Path
+from subprocess import DEVNULL
+from tempfile import TemporaryDirectory
+
+import subprocess
 
 """
 TODO LIST:
@@ -9,17 +14,90 @@ TODO LIST:
  - add problems to the list
 """
 
+JDK_PATH = Path('/usr/lib/jvm/java-19-openjdk-amd64')
+
+# A program that loads the classes that programs use the most, whose list is
+# dumped into the class data archive.
+WARMUP_SOURCE = '''
+import java.io.*;
+import java.math.*;
+import java.util.*;
+import java.util.stream.*;
+
+public class Warmup {
+    public static void main(String[] args) throws IOException {
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in));
+        StringTokenizer st = new StringTokenizer("3 1 2");
+        Scanner sc = new Scanner("1 2.5 x");
+        PrintWriter out = new PrintWriter(new BufferedWriter(new OutputStreamWriter(System.out)));
+
+        List<Integer> list = new ArrayList<>();
+        while (st.hasMoreTokens())
+            list.add(Integer.parseInt(st.nextToken()));
+        Collections.sort(list);
+        Map<String, Long> map = new HashMap<>(Map.of("a", 1L));
+        TreeMap<Integer, Integer> tree = new TreeMap<>();
+        PriorityQueue<long[]> queue = new PriorityQueue<>((a, b) -> Long.compare(a[0], b[0]));
+        ArrayDeque<Integer> deque = new ArrayDeque<>(list);
+        tree.put(sc.nextInt(), deque.size());
+        queue.add(new long[] { map.get("a") });
+
+        out.println(list.stream().map(String::valueOf).collect(Collectors.joining(" ")));
+        out.printf("%.2f %s %s%n", sc.nextDouble(), BigInteger.TWO.pow(100), new BigDecimal("1.5"));
+        out.println(Arrays.toString(new int[] { queue.poll().length, tree.firstKey() }) + sc.next());
+        out.flush();
+    }
+}
+'''
+
+
 class JavaRunner(CompiledRunner):
     code = 'java'
     source_ext = '.java'
     compiled_ext = '.class'
     max_pids = 32
+    trivial_source = 'public class Main { public static void main(String[] args) {} }\n'
+    warmup_binary = str(JDK_PATH / 'bin/java')
+    warmup_probe = ('-version',)
+
+    # Programs are judged one thread at a time: the serial collector spares
+    # the threads (and memory) of a concurrent one, and nothing ever reads the
+    # performance counters that the JVM keeps in a file otherwise.
+    WARMUP_FLAGS = ('-XX:+UseSerialGC', '-XX:-UsePerfData', '-Xshare:auto')
+
+    @classmethod
+    def build_warmup(cls, path):
+        # An archive of the classes that the JVM loads at startup comes with
+        # the JDK, but programs load many more (collections, I/O, streams...).
+        with TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            (tmp / 'Warmup.java').write_text(WARMUP_SOURCE)
+            subprocess.run([str(JDK_PATH / 'bin/javac'), 'Warmup.java'], cwd=tmp, check=True)
+            subprocess.run([cls.warmup_binary, f'-XX:DumpLoadedClassList={tmp / "classes.lst"}', 'Warmup'],
+                           cwd=tmp, stdin=DEVNULL, stdout=DEVNULL, check=True)
+
+            # Only the JDK's classes can be archived without pinning down the
+            # class path, and the dump only accepts it if its directories are
+            # empty.
+            with open(tmp / 'classes.lst') as src, open(path / 'classes.lst', 'w') as dst:
+                dst.writelines(line for line in src if 'Warmup' not in line)
+            (tmp / 'empty').mkdir()
+            subprocess.run([cls.warmup_binary, '-Xshare:dump',
+                            f'-XX:SharedClassListFile={path / "classes.lst"}',
+                            f'-XX:SharedArchiveFile={path / "classes.jsa"}'],
+                           cwd=tmp / 'empty', stdout=DEVNULL, check=True)
+
+    @classmethod
+    def get_warmup_args(cls, path):
+        if path is None:
+            return [cls.warmup_binary]
+        return [cls.warmup_binary, *cls.WARMUP_FLAGS, f'-XX:SharedArchiveFile={path / "classes.jsa"}']
 
     def get_compile_args(self):
-        return ['/usr/lib/jvm/java-19-openjdk-amd64/bin/javac', self.get_source_filename()]
+        return [str(JDK_PATH / 'bin/javac'), self.get_source_filename()]
 
     def get_execute_args(self):
-        return ['/usr/lib/jvm/java-19-openjdk-amd64/bin/java', self.get_compiled_filename()[:-6]]
+        return [*self.get_warmup_args(self.warmup_path), self.compiled_filename[:-6]]
 
     def get_source_filename(self):
         return 'Main' + self.source_ext
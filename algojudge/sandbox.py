@@ -1,11 +1,28 @@
-from algojudge import config
+from algojudge import config, metrics, tracing
+from abc import ABCMeta, abstractmethod
+from collections import deque
+from contextlib import contextmanager, ExitStack
 from pathlib import Path
 from shutil import rmtree
-from subprocess import Popen, PIPE
+from subprocess import DEVNULL, Popen, PIPE
+from threading import Condition, Lock
+
+import atexit
+import logging
+import math
+import os
+import resource
+import select
+import signal
+import socket
+import struct
+import time
+import uuid
 
 
 class SandboxResult:
-    def __init__(self, cpu_time_ns, real_time_ns, memory_kb, timeout, oom_kill, exitcode, signal):
+    def __init__(self, cpu_time_ns, real_time_ns, memory_kb, timeout, oom_kill, exitcode, signal,
+                 killed=0):
         self.cpu_time_ns = cpu_time_ns
         self.real_time_ns = real_time_ns
         self.memory_kb = memory_kb
@@ -13,6 +30,8 @@ class SandboxResult:
         self.oom_kill = bool(oom_kill)
         self.exitcode = None if exitcode == -1 else exitcode
         self.signal = None if signal == -1 else signal
+        # Whether the program was stopped early with `SandboxProcess.abort()`.
+        self.killed = bool(killed)
 
     def is_mle(self):
         return self.oom_kill
@@ -26,6 +45,18 @@ class SandboxResult:
     def is_re(self):
         return self.signal is not None
 
+    def to_json(self):
+        return {
+            'cpu_time_ns': self.cpu_time_ns,
+            'real_time_ns': self.real_time_ns,
+            'memory_kb': self.memory_kb,
+            'timeout': int(self.timeout),
+            'oom_kill': int(self.oom_kill),
+            'exitcode': -1 if self.exitcode is None else self.exitcode,
+            'signal': -1 if self.signal is None else self.signal,
+            'killed': int(self.killed)
+        }
+
 
 class SandboxError(Exception):
     def __init__(self, message):
@@ -37,12 +68,15 @@ class SandboxError(Exception):
 
 class SandboxConfig:
     def __init__(self, cpu_time_limit=None, real_time_limit=None,
-                 memory_limit=None, max_fsize=262144, max_pids=1):
+                 memory_limit=None, max_fsize=262144, max_pids=1, binds=()):
         self.cpu_time_limit = cpu_time_limit
         self.real_time_limit = real_time_limit
         self.memory_limit = memory_limit
         self.max_fsize = max_fsize
         self.max_pids = max_pids
+        # Host directories to make visible, read-only and at the same path, in
+        # the box.
+        self.binds = tuple(binds)
 
     def get_opts(self):
         args = []
@@ -57,12 +91,348 @@ class SandboxConfig:
             args += [f'--max-fsize={self.max_fsize}']
         if self.max_pids is not None:
             args += [f'--max-pids={self.max_pids}']
+        args += [f'--bind={path}' for path in self.binds]
 
         return args
 
 
-class Sandbox:
-    """A simple Python interface to the sandbox written in C."""
+class SandboxProcess:
+    """A program that was started in a box with `Sandbox.start()`."""
+
+    def __init__(self, proc):
+        self.proc = proc
+
+    def abort(self):
+        """Stops the program early. It is still reported as usual, with
+        `SandboxResult.killed` set if it hadn't already terminated."""
+        if self.proc.returncode is None:
+            self.proc.send_signal(signal.SIGTERM)
+
+    def wait(self):
+        stdout, stderr = self.proc.communicate()
+
+        if self.proc.returncode != 0:
+            raise SandboxError(stderr.decode())
+
+        result = {}
+        for line in stdout.rstrip().decode().split('\n'):
+            key, value = line.split(': ')
+            result[key] = int(value)
+
+        return SandboxResult(**result)
+
+
+class SandboxDriver(metaclass=ABCMeta):
+    """The means by which `Sandbox` talks to the sandbox binary."""
+
+    @abstractmethod
+    def init(self, box):
+        pass
+
+    @abstractmethod
+    def run(self, box, command, conf):
+        pass
+
+    def start(self, box, command, conf, stdout_fd=None, stdin_fd=None):
+        # Drivers that can't hand over file descriptors or stop a program that
+        # is running spawn a separate process for it.
+        return _command_driver.start(box, command, conf, stdout_fd, stdin_fd)
+
+    @abstractmethod
+    def delete(self, box):
+        pass
+
+    def close(self):
+        pass
+
+
+class CommandDriver(SandboxDriver):
+    """Spawns a new `sandbox` process for every request."""
+
+    def init(self, box):
+        proc = Popen([*self.get_opts(box), '--init'], stdout=PIPE, stderr=PIPE)
+        _, stderr = proc.communicate()
+
+        if proc.returncode > 0:
+            raise SandboxError(stderr.decode())
+
+    def run(self, box, command, conf):
+        return self.start(box, command, conf).wait()
+
+    def start(self, box, command, conf, stdout_fd=None, stdin_fd=None):
+        opts = [*self.get_opts(box), '--run', *conf.get_opts()]
+        pass_fds = ()
+
+        if stdout_fd is not None:
+            opts.append(f'--stdout-fd={stdout_fd}')
+            pass_fds += (stdout_fd,)
+        if stdin_fd is not None:
+            opts.append(f'--stdin-fd={stdin_fd}')
+            pass_fds += (stdin_fd,)
+
+        proc = Popen([*opts, '--', *command], stdin=PIPE, stdout=PIPE, stderr=PIPE, pass_fds=pass_fds)
+        return SandboxProcess(proc)
+
+    def delete(self, box):
+        proc = Popen([*self.get_opts(box), '--del'], stdout=PIPE, stderr=PIPE)
+        _, stderr = proc.communicate()
+
+        if proc.returncode != 0:
+            raise SandboxError(stderr.decode())
+
+    def get_opts(self, box):
+        return ['sandbox', f'--box-root={box.box_root}', f'--box-name={box.box_name}']
+
+
+class Supervisor:
+    """A `sandbox --serve` process, which reads requests from a Unix socket so
+    that file descriptors can be sent along with them."""
+
+    def __init__(self):
+        self.sock, theirs = socket.socketpair()
+        try:
+            self.proc = Popen(['sandbox', '--serve'], stdin=theirs, stdout=PIPE)
+        except OSError:
+            self.sock.close()
+            raise
+        finally:
+            theirs.close()
+
+    def read(self, size):
+        data = self.proc.stdout.read(size)
+        if len(data) != size:
+            raise ValueError('Unexpected end of stream')
+        return data
+
+    def kill(self):
+        self.proc.kill()
+        self.close()
+
+    def close(self):
+        # Closing the socket makes the supervisor exit once it's done.
+        self.sock.close()
+        self.proc.wait()
+        self.proc.stdout.close()
+
+
+class SupervisorProcess:
+    """A program that was started through a supervisor, which answers the
+    request once the program has terminated."""
+
+    def __init__(self, driver, supervisor):
+        self.driver = driver
+        self.supervisor = supervisor
+        self.lock = Lock()
+        self.aborted = False
+        self.done = False
+
+    def abort(self):
+        """Stops the program early, like `SandboxProcess.abort()`. Any byte
+        sent while the program runs asks the supervisor to stop it."""
+        with self.lock:
+            if self.done or self.aborted:
+                return
+            self.aborted = True
+            try:
+                self.supervisor.sock.send(b'\0')
+            except OSError:
+                pass
+
+    def wait(self):
+        try:
+            status, aborted, body = self.driver.receive(self.supervisor)
+        finally:
+            with self.lock:
+                self.done = True
+                # A byte the supervisor didn't see before the program was done
+                # would be taken for the start of the next request.
+                stray = self.aborted and not aborted
+
+        if stray:
+            self.supervisor.kill()
+        else:
+            self.driver.checkin(self.supervisor)
+
+        if status != 0:
+            raise SandboxError(body)
+
+        return self.driver.parse_result(body)
+
+
+class SupervisorDriver(SandboxDriver):
+    """Sends requests to long-lived `sandbox --serve` processes.
+
+    A supervisor handles one request at a time, so one is started for every
+    request that runs concurrently and kept around for the ones that follow.
+    See `serve()` in `sandbox/sandbox.c` for the format of the messages."""
+
+    VERSION = 4
+
+    REQUEST = struct.Struct('=10I')
+    RESPONSE = struct.Struct('=IiI')
+    RESULT = struct.Struct('=8q')
+
+    PASS_STDIN = 0x1
+    PASS_STDOUT = 0x2
+
+    def __init__(self):
+        self.lock = Lock()
+        self.idle = []
+
+    def init(self, box):
+        self.request('I', box)
+
+    def run(self, box, command, conf):
+        return self.start(box, command, conf).wait()
+
+    def start(self, box, command, conf, stdout_fd=None, stdin_fd=None):
+        return SupervisorProcess(self, self.send('R', box, command, conf, stdout_fd, stdin_fd))
+
+    def delete(self, box):
+        self.request('D', box)
+
+    def request(self, mode, box):
+        supervisor = self.send(mode, box)
+        status, _, body = self.receive(supervisor)
+        self.checkin(supervisor)
+
+        if status != 0:
+            raise SandboxError(body)
+
+        return body
+
+    def send(self, mode, box, command=(), conf=None, stdout_fd=None, stdin_fd=None):
+        """Sends a request to an idle supervisor, and returns the supervisor to
+        receive the response from."""
+        binds = conf.binds if conf is not None else ()
+        strings = [str(box.box_root), str(box.box_name), *command, *binds]
+        payload = b''.join(os.fsencode(string) + b'\0' for string in strings)
+
+        limits = (0,) * 5
+        if conf is not None:
+            limits = tuple(limit or 0 for limit in (conf.cpu_time_limit, conf.real_time_limit,
+                                                    conf.memory_limit, conf.max_fsize,
+                                                    conf.max_pids))
+
+        fds = [fd for fd in (stdin_fd, stdout_fd) if fd is not None]
+        flags = (self.PASS_STDIN if stdin_fd is not None else 0) | \
+                (self.PASS_STDOUT if stdout_fd is not None else 0)
+
+        header = self.REQUEST.pack(self.REQUEST.size + len(payload), ord(mode),
+                                   *limits, len(command), len(binds), flags)
+        data = header + payload
+
+        supervisor = self.checkout()
+        try:
+            # The descriptors go along with the first byte of the request.
+            sent = supervisor.sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                                     struct.pack(f'{len(fds)}i', *fds))] if fds else [])
+            supervisor.sock.sendall(data[sent:])
+        except OSError:
+            # The supervisor is in an unknown state, so don't reuse it.
+            supervisor.kill()
+            raise SandboxError('Lost connection to the sandbox supervisor')
+
+        return supervisor
+
+    def receive(self, supervisor):
+        """Returns the status, whether the job was aborted, and the body of the
+        response to the request that was sent to the supervisor."""
+        try:
+            size, status, aborted = self.RESPONSE.unpack(supervisor.read(self.RESPONSE.size))
+            body = supervisor.read(size - self.RESPONSE.size)
+        except (OSError, ValueError, struct.error):
+            supervisor.kill()
+            raise SandboxError('Lost connection to the sandbox supervisor')
+
+        return status, aborted, body
+
+    def parse_result(self, body):
+        if len(body) != self.RESULT.size:
+            raise SandboxError('Malformed result from the sandbox supervisor')
+
+        return SandboxResult(*self.RESULT.unpack(body))
+
+    def checkout(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+
+        return self.spawn()
+
+    def checkin(self, supervisor):
+        with self.lock:
+            self.idle.append(supervisor)
+
+    def spawn(self):
+        supervisor = Supervisor()
+
+        try:
+            version, = struct.unpack('=I', supervisor.read(4))
+        except (OSError, ValueError, struct.error):
+            supervisor.kill()
+            raise SandboxError('The sandbox does not support --serve')
+
+        if version != self.VERSION:
+            supervisor.kill()
+            raise SandboxError(f'Unsupported sandbox supervisor version {version}')
+
+        return supervisor
+
+    def close(self):
+        with self.lock:
+            supervisors, self.idle = self.idle, []
+
+        for supervisor in supervisors:
+            supervisor.close()
+
+
+_command_driver = CommandDriver()
+
+_driver = None
+_driver_lock = Lock()
+
+def get_driver():
+    """Returns the driver selected by `config.SANDBOX_DRIVER`, falling back to
+    spawning a process per request if the supervisor can't be used."""
+    global _driver
+
+    with _driver_lock:
+        if _driver is None:
+            _driver = _create_driver(config.SANDBOX_DRIVER)
+            atexit.register(_driver.close)
+        return _driver
+
+def set_driver(driver):
+    """Replaces the process-wide driver, e.g. with a stub that doesn't need
+    root for benchmarking the rest of the judge. Boxes that already exist keep
+    their driver, so call this before the pool is first used."""
+    global _driver
+
+    with _driver_lock:
+        _driver = driver
+        atexit.register(_driver.close)
+
+def _create_driver(name):
+    if name == 'supervisor':
+        driver = SupervisorDriver()
+        try:
+            driver.checkin(driver.spawn())
+        except (OSError, SandboxError):
+            logging.warning('Sandbox supervisor is unavailable, falling back to the command driver.',
+                            exc_info=True)
+        else:
+            return driver
+    return CommandDriver()
+
+
+class ExecutionBackend(metaclass=ABCMeta):
+    """A box that programs run in: a folder that holds the program's files in
+    `home_path`, its input in `stdin_path` and, once it has run, its output in
+    `stdout_path` and `stderr_path`.
+
+    Each kind of process runs in the backend that `config.EXECUTION_BACKENDS`
+    picks for it (see `get_pool()`)."""
 
     def __init__(self, box_name):
         self.box_name = Path(box_name)
@@ -76,31 +446,35 @@ class Sandbox:
         self.stderr_path = self.root_path / 'err'
 
     def __enter__(self):
-        proc = Popen([*self.get_opts(), '--init'], stdout=PIPE, stderr=PIPE)
-        _, stderr = proc.communicate()
-
-        if proc.returncode > 0:
-            raise SandboxError(stderr.decode())
-
+        self.init()
         return self
 
-    def run(self, command, conf):
-        proc = Popen([*self.get_opts(), '--run', *conf.get_opts(), '--', *command],
-                     stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        stdout, stderr = proc.communicate()
+    @abstractmethod
+    def init(self):
+        pass
 
-        if proc.returncode != 0:
-            raise SandboxError(stderr.decode())
+    def reset(self):
+        # Wipe everything the previous run left behind. The cgroup counters are
+        # reset by the sandbox itself at the start of the next run.
+        for path in (self.stdin_path, self.stdout_path, self.stderr_path):
+            path.unlink(missing_ok=True)
 
-        result = {}
-        for line in stdout.rstrip().decode().split('\n'):
-            key, value = line.split(': ')
-            result[key] = int(value)
+        for entry in os.scandir(self.home_path):
+            if entry.is_dir(follow_symlinks=False):
+                rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
 
-        return SandboxResult(**result)
+    @abstractmethod
+    def run(self, command, conf):
+        pass
 
-    def get_opts(self):
-        return ['sandbox', f'--box-root={self.box_root}', f'--box-name={self.box_name}']
+    @abstractmethod
+    def start(self, command, conf, stdout_fd=None, stdin_fd=None):
+        """Starts the program without waiting for it. If `stdout_fd` is given,
+        the program writes its output there instead of to `stdout_path`, and
+        likewise for `stdin_fd` and `stdin_path`."""
+        pass
 
     def stdout(self):
         with open(self.stdout_path, 'rb') as f:
@@ -111,8 +485,370 @@ class Sandbox:
             return f.read()
 
     def __exit__(self, exc_type, exc_value, traceback):
-        proc = Popen([*self.get_opts(), '--del'], stdout=PIPE, stderr=PIPE)
-        _, stderr = proc.communicate()
+        self.delete()
 
-        if proc.returncode != 0:
-            raise SandboxError(stderr.decode())
+    @abstractmethod
+    def delete(self):
+        pass
+
+
+class Sandbox(ExecutionBackend):
+    """A simple Python interface to the sandbox written in C."""
+
+    def __init__(self, box_name, driver=None):
+        super().__init__(box_name)
+        self.driver = driver or get_driver()
+
+    def init(self):
+        with tracing.span('sandbox-init'):
+            self.driver.init(self)
+
+    def run(self, command, conf):
+        with tracing.span('sandbox-run', command=command[0]):
+            return self.driver.run(self, command, conf)
+
+    def start(self, command, conf, stdout_fd=None, stdin_fd=None):
+        with tracing.span('sandbox-start', command=command[0]):
+            return self.driver.start(self, command, conf, stdout_fd, stdin_fd)
+
+    def delete(self):
+        with tracing.span('sandbox-delete'):
+            self.driver.delete(self)
+
+
+class TrustedBox(ExecutionBackend):
+    """Runs programs as plain subprocesses of the judge, for programs we trust
+    such as checkers. This skips everything the sandbox sets up (namespaces,
+    mounts and the cgroup), which makes a run several times cheaper, but the
+    program runs as the judge's user and sees the whole filesystem (so binds
+    are of no use).
+
+    The limits are only a safety net: they're applied with rlimits just after
+    the program starts, the cpu time of the program's children only counts
+    once they've been waited for, and `max_pids` isn't enforced at all (the
+    process limit of rlimits counts every process of the user). Usage is taken
+    from the rusage of the program."""
+
+    def init(self):
+        self.home_path.mkdir(parents=True, exist_ok=True)
+
+    def run(self, command, conf):
+        with tracing.span('trusted-run', command=command[0]):
+            return self._start(command, conf).wait()
+
+    def start(self, command, conf, stdout_fd=None, stdin_fd=None):
+        with tracing.span('trusted-start', command=command[0]):
+            return self._start(command, conf, stdout_fd, stdin_fd)
+
+    def _start(self, command, conf, stdout_fd=None, stdin_fd=None):
+        with ExitStack() as stack:
+            stdin = stdin_fd
+            if stdin is None:
+                stdin = DEVNULL
+                if self.stdin_path.exists():
+                    stdin = stack.enter_context(open(self.stdin_path, 'rb'))
+            stdout = stdout_fd
+            if stdout is None:
+                stdout = stack.enter_context(open(self.stdout_path, 'wb'))
+            stderr = stack.enter_context(open(self.stderr_path, 'wb'))
+
+            try:
+                # Like in the sandbox, a relative command is relative to the home
+                # rather than looked up in the PATH. A session of its own lets
+                # the whole process group be killed.
+                proc = Popen(command, executable=self.home_path / command[0], stdin=stdin, stdout=stdout,
+                             stderr=stderr, cwd=self.home_path, env={'PATH': '/bin:/usr/bin'},
+                             start_new_session=True)
+            except OSError as e:
+                raise SandboxError(f'Failed to execute {command[0]}: {e.strerror}')
+
+        process = TrustedProcess(proc, conf)
+        try:
+            process.set_limits()
+        except OSError:
+            process.abort()
+            process.wait()
+            raise SandboxError(f'Failed to limit {command[0]}')
+        return process
+
+    def delete(self):
+        rmtree(self.root_path, ignore_errors=True)
+
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+class TrustedProcess:
+    """A program that was started in a `TrustedBox`, with the same interface as
+    `SandboxProcess`."""
+
+    # The shortest time (in milliseconds) between checks of the limits, since cpu
+    # time is only accounted in clock ticks.
+    CHECK_MIN_DELAY = 10
+
+    def __init__(self, proc, conf):
+        self.proc = proc
+        self.conf = conf
+        self.start_ns = time.monotonic_ns()
+        self.lock = Lock()
+        self.killed = False
+
+    def set_limits(self):
+        limits = []
+        if self.conf.cpu_time_limit is not None:
+            seconds = math.ceil(self.conf.cpu_time_limit / 1000)
+            # The program gets SIGXCPU at the soft limit and SIGKILL a second
+            # later if it ignores it.
+            limits.append((resource.RLIMIT_CPU, (seconds, seconds + 1)))
+        if self.conf.memory_limit is not None:
+            limits.append((resource.RLIMIT_AS, (self.conf.memory_limit << 10,) * 2))
+        if self.conf.max_fsize is not None:
+            limits.append((resource.RLIMIT_FSIZE, (self.conf.max_fsize << 10,) * 2))
+
+        for limit, value in limits:
+            resource.prlimit(self.proc.pid, limit, value)
+
+    def abort(self):
+        """Stops the program early. It is still reported as usual, with
+        `SandboxResult.killed` set if it hadn't already terminated."""
+        with self.lock:
+            if self.proc.returncode is None:
+                self.killed = True
+                self._kill()
+
+    def wait(self):
+        # The pidfd becomes readable once the program terminates. Until then,
+        # the limits are checked whenever the program could have reached them,
+        # like the sandbox does.
+        pidfd = os.pidfd_open(self.proc.pid)
+        try:
+            poll = select.poll()
+            poll.register(pidfd, select.POLLIN)
+            timed_out = False
+
+            while not poll.poll(self._check_delay()):
+                if self._exceeded():
+                    timed_out = True
+                    break
+        finally:
+            os.close(pidfd)
+
+        with self.lock:
+            # Also kills whatever the program left running, which is still
+            # possible while the terminated program hasn't been waited for.
+            self._kill()
+            _, status, usage = os.wait4(self.proc.pid, 0)
+            real_time_ns = time.monotonic_ns() - self.start_ns
+            # Let `Popen` know the program has been waited for.
+            self.proc.returncode = os.waitstatus_to_exitcode(status)
+
+        cpu_time_ns = round((usage.ru_utime + usage.ru_stime) * 10**9)
+        if self.conf.cpu_time_limit is not None and cpu_time_ns > self.conf.cpu_time_limit * 10**6:
+            timed_out = True
+
+        # Allocations beyond the limit fail rather than kill the program, so
+        # this is as close to an OOM kill as it gets.
+        oom_kill = self.conf.memory_limit is not None and usage.ru_maxrss >= self.conf.memory_limit
+
+        return SandboxResult(
+            cpu_time_ns=cpu_time_ns,
+            real_time_ns=real_time_ns,
+            memory_kb=usage.ru_maxrss,
+            timeout=timed_out,
+            oom_kill=oom_kill,
+            exitcode=os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1,
+            signal=os.WTERMSIG(status) if os.WIFSIGNALED(status) else -1,
+            killed=self.killed and not timed_out
+        )
+
+    def _check_delay(self):
+        # In milliseconds, or `None` to wait for the program without a limit.
+        delays = []
+        if self.conf.real_time_limit is not None:
+            delays.append(self.conf.real_time_limit - (time.monotonic_ns() - self.start_ns) // 10**6)
+        if self.conf.cpu_time_limit is not None:
+            delays.append(self.conf.cpu_time_limit - self._cpu_time_ns() // 10**6)
+        return max(min(delays), self.CHECK_MIN_DELAY) if delays else None
+
+    def _exceeded(self):
+        real_time_limit, cpu_time_limit = self.conf.real_time_limit, self.conf.cpu_time_limit
+        return ((real_time_limit is not None and time.monotonic_ns() - self.start_ns >= real_time_limit * 10**6)
+                or (cpu_time_limit is not None and self._cpu_time_ns() >= cpu_time_limit * 10**6))
+
+    def _cpu_time_ns(self):
+        try:
+            with open(f'/proc/{self.proc.pid}/stat', 'rb') as f:
+                # The command may contain anything, so skip to its end.
+                fields = f.read().rsplit(b')', 1)[1].split()
+        except OSError:
+            return 0
+        # utime, stime, cutime and cstime, in clock ticks.
+        return sum(map(int, fields[11:15])) * 10**9 // _CLOCK_TICKS
+
+    def _kill(self):
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class SandboxPool:
+    """Keeps initialized boxes around so that they don't need to be created and
+    deleted for every run.
+
+    Boxes are handed out with `checkout()` and given back with `checkin()`,
+    which wipes them for the next user. The pool grows as needed (up to
+    `max_size` boxes) and shrinks back to `min_size` once boxes have been idle
+    for `idle_timeout` seconds. The boxes are of the `backend` class."""
+
+    def __init__(self, min_size=0, max_size=None, idle_timeout=60, backend=Sandbox):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.backend = backend
+
+        self.cond = Condition()
+        self.idle = deque()  # (box, time of checkin), the most recent last
+        self.size = 0
+        self.closed = False
+
+    def fill(self, count=None):
+        """Initializes boxes until at least `count` (by default, `min_size`) of
+        them are idle."""
+        count = self.min_size if count is None else count
+        while True:
+            with self.cond:
+                if len(self.idle) >= count or self._full():
+                    return
+                self.size += 1
+
+            self._checkin(self._create())
+
+    def checkout(self):
+        with tracing.span('box-checkout'), self.cond:
+            while not self.idle and self._full():
+                self.cond.wait()
+
+            metrics.ACTIVE_BOXES.inc()
+            if self.idle:
+                # Prefer the most recently used box, since its files are most
+                # likely still cached.
+                box, _ = self.idle.pop()
+                return box
+
+            self.size += 1
+
+        try:
+            return self._create()
+        except BaseException:
+            metrics.ACTIVE_BOXES.dec()
+            raise
+
+    def checkin(self, box):
+        metrics.ACTIVE_BOXES.dec()
+        try:
+            with tracing.span('box-reset'), metrics.SANDBOX_TIME.labels('reset').time():
+                box.reset()
+        except OSError:
+            self._discard(box)
+        else:
+            self._checkin(box)
+
+    @contextmanager
+    def box(self):
+        box = self.checkout()
+        try:
+            yield box
+        finally:
+            self.checkin(box)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            boxes = [box for box, _ in self.idle]
+            self.idle.clear()
+
+        for box in boxes:
+            self._discard(box)
+
+    def _full(self):
+        return self.max_size is not None and self.size >= self.max_size
+
+    def _create(self):
+        # The sandbox is given a randomly-generated uuid name; the chance that
+        # a duplicate occurs is so incredibly low that we should be fine leaving
+        # it alone... probably.
+        box = self.backend(f'box-{uuid.uuid4().hex}')
+        try:
+            with metrics.SANDBOX_TIME.labels('init').time():
+                box.init()
+        except BaseException:
+            with self.cond:
+                self.size -= 1
+                self.cond.notify()
+            raise
+        return box
+
+    def _checkin(self, box):
+        now = time.monotonic()
+        expired = []
+
+        with self.cond:
+            if self.closed:
+                expired.append(box)
+            else:
+                self.idle.append((box, now))
+                self.cond.notify()
+
+            while len(self.idle) > self.min_size and now - self.idle[0][1] >= self.idle_timeout:
+                expired.append(self.idle.popleft()[0])
+
+        for box in expired:
+            self._discard(box)
+
+    def _discard(self, box):
+        try:
+            with metrics.SANDBOX_TIME.labels('delete').time():
+                box.delete()
+        finally:
+            with self.cond:
+                self.size -= 1
+                self.cond.notify()
+
+
+_pools = {}
+_pool_lock = Lock()
+
+def get_pool(role='submission'):
+    """Returns the process-wide pool of boxes for processes of the given role,
+    from the backend that `config.EXECUTION_BACKENDS` picks for it. The pool is
+    created on first use.
+
+    Each role has a sandbox pool of its own, since a submission holds boxes of
+    several roles at once (e.g. a case's box along with its interactor's), and
+    a bounded pool shared between them could run out with every holder waiting
+    for another box. Only the pool of submissions is filled beforehand, and
+    that of compilations with a box for each judge worker. Trusted boxes are
+    never bounded, so roles that use them share a pool."""
+    name = config.EXECUTION_BACKENDS[role]
+    key = name if name == 'trusted' else (name, role)
+
+    with _pool_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            if name == 'sandbox':
+                # Boxes are deleted through the driver, so it must be closed
+                # after the pool at exit (handlers run in reverse order of
+                # registration).
+                get_driver()
+
+                min_size = {'submission': config.SANDBOX_POOL_MIN_SIZE, 'compile': config.JUDGE_WORKERS}.get(role, 0)
+                pool = SandboxPool(min_size, config.SANDBOX_POOL_MAX_SIZE, config.SANDBOX_POOL_IDLE_TIMEOUT)
+            elif name == 'trusted':
+                # Trusted boxes are cheap to create, so none are kept in reserve.
+                pool = SandboxPool(0, None, config.SANDBOX_POOL_IDLE_TIMEOUT, backend=TrustedBox)
+            else:
+                raise ValueError(f'Unknown execution backend {name!r} for {role}')
+
+            _pools[key] = pool
+            atexit.register(pool.close)
+        return pool
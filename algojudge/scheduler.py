@@ -0,0 +1,111 @@
+from algojudge import metrics
+from collections import deque, OrderedDict
+from threading import Lock
+
+import asyncio
+import time
+
+
+# Priority classes, from highest to lowest.
+PRIORITIES = ('live', 'contest', 'rejudge', 'background')
+
+
+class Scheduler:
+    """Decides which job is judged next.
+
+    Jobs of a higher priority class always go first. Within a class, jobs are
+    grouped by their `key` (e.g. the user who submitted them), and the groups
+    take turns so that one user's flood of submissions doesn't hold up
+    everyone else. Each job needs a `priority` (an index into `PRIORITIES`)
+    and a `key`.
+
+    Jobs are taken off the scheduler from the event loop, but whether a job
+    should be preempted may be asked from any thread."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.lock = Lock()
+        self.queues = [OrderedDict() for _ in PRIORITIES]
+        self.size = 0
+        self.ready = asyncio.Semaphore(0)
+
+        # The number of jobs scheduled, and the total and longest time they
+        # waited, per priority class.
+        self.waits = [[0, 0.0, 0.0] for _ in PRIORITIES]
+
+    def put_nowait(self, job):
+        """Adds a new job, raising `asyncio.QueueFull` if there's no room."""
+        with self.lock:
+            if self.size >= self.capacity:
+                raise asyncio.QueueFull
+            self._add(job, first=False)
+        self.ready.release()
+
+    def requeue(self, job):
+        """Puts back a job that was preempted. It will be the next job of its
+        class to run, and always fits regardless of the capacity."""
+        with self.lock:
+            self._add(job, first=True)
+        self.ready.release()
+
+    async def get(self):
+        await self.ready.acquire()
+
+        with self.lock:
+            for priority, queue in enumerate(self.queues):
+                if queue:
+                    break
+
+            key, jobs = next(iter(queue.items()))
+            job = jobs.popleft()
+            if jobs:
+                queue.move_to_end(key)
+            else:
+                del queue[key]
+            self.size -= 1
+            metrics.QUEUE_DEPTH.set(self.size)
+
+            wait = time.monotonic() - job.enqueued
+            stats = self.waits[priority]
+            stats[0] += 1
+            stats[1] += wait
+            stats[2] = max(stats[2], wait)
+
+        return job
+
+    def qsize(self):
+        with self.lock:
+            return self.size
+
+    def should_preempt(self, job):
+        """Whether a job of a higher priority class than `job` is waiting."""
+        with self.lock:
+            return any(self.queues[:job.priority])
+
+    def stats(self):
+        with self.lock:
+            return {
+                name: {
+                    'waiting': sum(len(jobs) for jobs in queue.values()),
+                    'scheduled': count,
+                    'mean-wait': total / count if count else 0.0,
+                    'max-wait': longest
+                }
+                for name, queue, (count, total, longest) in zip(PRIORITIES, self.queues, self.waits)
+            }
+
+    def _add(self, job, first):
+        job.enqueued = time.monotonic()
+
+        queue = self.queues[job.priority]
+        jobs = queue.get(job.key)
+        if jobs is None:
+            jobs = queue[job.key] = deque()
+
+        if first:
+            jobs.appendleft(job)
+            queue.move_to_end(job.key, last=False)
+        else:
+            jobs.append(job)
+        self.size += 1
+        metrics.QUEUE_DEPTH.set(self.size)
@@ -1,37 +1,152 @@
-from algojudge import config
+from algojudge import config, metrics
+from algojudge.cache import get_testdata_cache
 from algojudge.judge import Judge, Submission
-from socketserver import StreamRequestHandler, ThreadingTCPServer
+from algojudge.problem import problems
+from algojudge.protocol import Codec, pack_frame, ProtocolError, read_frame, VERSION
+from algojudge.runners import RUNNERS
+from algojudge.scheduler import PRIORITIES, Scheduler
+from concurrent.futures import ThreadPoolExecutor
 
+import argparse
+import asyncio
 import hmac
 import json
 import logging
-import struct
 
 
-class JudgeHandler(StreamRequestHandler):
-    def handle(self):
-        logging.debug(f'Connected to {self.client_address}')
+class Job:
+    """A submission waiting in the queue or being judged. Events for the client
+    are put on `events`, followed by `None` once judging is done.
 
-        data = self.read_data()
-        if data is None:
-            logging.debug('Failed to read data :(')
-            return
+    A job that is preempted keeps its `judging` generator, which is paused
+    with no cases in flight, and resumes from the next case when it's
+    scheduled again."""
+
+    def __init__(self, submission, priority, key):
+        self.submission = submission
+        self.priority = priority
+        self.key = key
+        self.events = asyncio.Queue()
+        self.cancelled = False
+        self.judging = None
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class JudgeServer:
+    """Accepts submissions into a queue of at most `queue_size` submissions,
+    which are judged by `workers` worker threads. Submissions that don't fit
+    in the queue are turned away with a `busy` response, rather than all being
+    judged at once and fighting over the same cores.
+
+    The order in which submissions are judged is up to the scheduler. If
+    `preemption` is enabled, a submission is paused after any of its cases
+    whenever a submission of a higher priority is waiting.
+
+    If the address of a `coordinator` is given, the judge registers with it
+    as a node of its cluster, and keeps it up to date with its capacity."""
+
+    def __init__(self, address, workers, queue_size, preemption=True, coordinator=None):
+        self.address = address
+        self.workers = workers
+        self.queue_size = queue_size
+        self.preemption = preemption
+        self.coordinator = coordinator
+
+        self.server = None
+        self.metrics_server = None
+        self.scheduler = None
+        self.pool = None
+        self.tasks = []
+        self.busy = 0
+
+    async def start(self):
+        self.scheduler = Scheduler(self.queue_size)
+        self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix='judge')
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+        self.server = await asyncio.start_server(self.handle, *self.address, reuse_address=True)
+
+        if self.coordinator is not None:
+            self.tasks.append(asyncio.create_task(self.register()))
+
+        if config.METRICS_ADDRESS is not None:
+            self.metrics_server = await metrics.start_http_server(config.METRICS_ADDRESS)
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        self.pool.shutdown(wait=True)
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def handle(self, reader, writer):
+        logging.debug(f'Connected to {writer.get_extra_info("peername")}')
 
-        self.do_request(data)
+        try:
+            data = await read_data(reader)
+            if data is None:
+                logging.debug('Failed to read data :(')
+                return
 
-    def do_request(self, data):
+            if data['header'] == 'hello':
+                await Session(self, reader, writer).run(data)
+            else:
+                await self.do_request(data, writer)
+        except ConnectionError:
+            logging.debug('Connection lost')
+        finally:
+            writer.close()
+
+    async def do_request(self, data, writer):
         match data['header']:
             case 'submit':
-                self.do_submit(data)
+                await self.do_submit(data, writer)
+            case 'stats':
+                await self.do_stats(data, writer)
+
+    async def do_submit(self, data, writer):
+        if not authenticate(data):
+            return
+
+        job = self.make_job(data)
+        if job is None:
+            return
 
-    def do_submit(self, data):
-        self.judge = Judge()
+        self.submit(job)
+        try:
+            while (event := await job.events.get()) is not None:
+                await send_data(writer, event)
+        finally:
+            # If the client is gone, there's no point in judging any further.
+            job.cancel()
 
-        # Authenticate the client's key. Also this check alone clearly isn't
-        # gonna cut it in terms of security but it's a start.
-        if not hmac.compare_digest(data['access-token'], config.JUDGE_ACCESS_TOKEN):
+    async def do_stats(self, data, writer):
+        if not authenticate(data):
             return
 
+        await send_data(writer, self.stats())
+
+    def stats(self):
+        return {'header': 'stats', 'queue': self.scheduler.stats(), 'metrics': metrics.render()}
+
+    def make_job(self, data):
+        """Creates the job for a `submit` request, or returns `None` if the
+        request is invalid."""
         submission = Submission(
             id=data['id'],
             problem_code=data['problem-code'],
@@ -41,29 +156,252 @@ class JudgeHandler(StreamRequestHandler):
             memory_limit=data['memory-limit']
         )
 
-        self.send_data({'header': 'judging-begin'})
+        priority = data.get('priority', 'live')
+        if priority not in PRIORITIES:
+            logging.warning(f'Unknown priority {priority!r} for submission {submission.id}')
+            return None
 
-        for header, verdict in self.judge.judge(submission):
-            self.send_data({'header': header, **verdict})
+        # Submissions from the same user (or for rejudges, of the same problem)
+        # share their turns with the other users of their priority class.
+        key = ('user', data['user']) if 'user' in data else ('problem', submission.problem_code)
 
-        self.send_data({'header': 'judging-end'})
+        return Job(submission, PRIORITIES.index(priority), key)
 
-    def read_data(self):
-        packed_msglen = self.rfile.read(4)
-        if not packed_msglen:
-            return None
+    def submit(self, job):
+        """Hands the job to the scheduler, and tells the client whether it's
+        queued or turned away through the job's events."""
+        try:
+            self.scheduler.put_nowait(job)
+        except asyncio.QueueFull:
+            job.events.put_nowait({'header': 'busy'})
+            job.events.put_nowait(None)
+            return
 
-        msglen = struct.unpack('!I', packed_msglen)[0]
+        job.events.put_nowait({'header': 'queued', 'position': self.scheduler.qsize()})
 
-        data = self.rfile.read(msglen)
-        if not data:
-            return None
+    async def work(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            job = await self.scheduler.get()
+            self.busy += 1
+            try:
+                preempted = await loop.run_in_executor(self.pool, self.judge, job, loop)
+            finally:
+                self.busy -= 1
+            if preempted:
+                self.scheduler.requeue(job)
+
+    def judge(self, job, loop):
+        """Judges the job until it's done or preempted. Returns whether it was
+        preempted."""
+        def emit(event):
+            loop.call_soon_threadsafe(job.events.put_nowait, event)
+
+        if job.judging is None and not job.cancelled:
+            should_pause = (lambda: self.scheduler.should_preempt(job)) if self.preemption else None
+            job.judging = Judge().judge(job.submission, should_pause)
+            emit({'header': 'judging-begin'})
+
+        preempted = False
+        try:
+            if job.cancelled:
+                return False
+
+            for header, verdict in job.judging:
+                if job.cancelled:
+                    return False
+
+                if header == 'paused':
+                    preempted = True
+                    return True
+                emit({'header': header, **verdict})
 
-        return json.loads(data)
+            emit({'header': 'judging-end'})
+            return False
+        finally:
+            if not preempted:
+                if job.judging is not None:
+                    job.judging.close()
+                emit(None)
 
-    def send_data(self, obj):
-        data = json.dumps(obj).encode('utf-8')
-        self.wfile.write(struct.pack('!I', len(data)) + data)
+    def capacity(self):
+        """Returns what the coordinator is told about this judge's load, and the
+        problems whose data it already has at hand."""
+        codes = set(problems.codes())
+        testdata_cache = get_testdata_cache()
+        if testdata_cache is not None:
+            codes.update(testdata_cache.codes())
+
+        return {
+            'free-workers': self.workers - self.busy,
+            'queued': self.scheduler.qsize(),
+            'problems': sorted(codes)
+        }
+
+    async def register(self):
+        """Registers with the coordinator and sends it a heartbeat with the
+        judge's capacity every `config.HEARTBEAT_INTERVAL` seconds, registering
+        again whenever the connection is lost."""
+        # The coordinator connects back to the address the judge listens on,
+        # at the host it sees the judge from unless the judge is bound to one.
+        host, port = self.server.sockets[0].getsockname()[:2]
+        if host in ('0.0.0.0', '::'):
+            host = None
+
+        while True:
+            try:
+                _, writer = await asyncio.open_connection(*self.coordinator)
+                try:
+                    await send_data(writer, {
+                        'header': 'register',
+                        'access-token': config.JUDGE_ACCESS_TOKEN,
+                        'host': host,
+                        'port': port,
+                        'workers': self.workers,
+                        'languages': sorted(RUNNERS)
+                    })
+                    while True:
+                        await send_data(writer, {'header': 'heartbeat', **self.capacity()})
+                        await asyncio.sleep(config.HEARTBEAT_INTERVAL)
+                finally:
+                    writer.close()
+            except OSError as e:
+                logging.warning(f'Lost the coordinator at {self.coordinator}: {e}')
+
+            await asyncio.sleep(config.HEARTBEAT_INTERVAL)
+
+
+class Session:
+    """A connection of version 2 of the protocol, which carries any number of
+    submissions at once. Every message about a submission is tagged with its
+    `id`, and the events of all submissions are coalesced into frames."""
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+
+        self.codec = None
+        self.outbox = asyncio.Queue()
+        self.jobs = {}
+        self.relays = set()
+
+    async def run(self, hello):
+        if not authenticate(hello):
+            await send_data(self.writer, {'header': 'hello', 'error': 'Authentication failed'})
+            return
+
+        try:
+            self.codec = Codec(hello.get('encoding', 'json'), hello.get('compression'))
+        except ProtocolError as e:
+            await send_data(self.writer, {'header': 'hello', 'error': str(e)})
+            return
+
+        await send_data(self.writer, {
+            'header': 'hello',
+            'version': VERSION,
+            'encoding': self.codec.encoding,
+            'compression': self.codec.compression
+        })
+
+        flusher = asyncio.create_task(self.flush())
+        try:
+            while (frame := await read_frame(self.reader)) is not None:
+                for message in self.codec.decode(frame):
+                    self.do_message(message)
+
+            # The client may close its end once it has sent everything, so
+            # finish what it has submitted before closing ours.
+            await asyncio.gather(*self.relays)
+        except ProtocolError as e:
+            logging.warning(f'Closing connection: {e}')
+        finally:
+            for job in self.jobs.values():
+                job.cancel()
+
+            self.outbox.put_nowait(None)
+            await flusher
+
+    def do_message(self, message):
+        match message.get('header'):
+            case 'submit':
+                self.do_submit(message)
+            case 'cancel':
+                job = self.jobs.get(message.get('id'))
+                if job is not None:
+                    job.cancel()
+            case 'stats':
+                self.send(self.server.stats())
+
+    def do_submit(self, message):
+        id = message.get('id')
+        if id in self.jobs:
+            logging.warning(f'Submission {id} is already being judged')
+            return
+
+        job = self.server.make_job(message)
+        if job is None:
+            return
+
+        self.server.submit(job)
+
+        self.jobs[id] = job
+        relay = asyncio.create_task(self.relay(id, job))
+        self.relays.add(relay)
+        relay.add_done_callback(self.relays.discard)
+
+    async def relay(self, id, job):
+        try:
+            while (event := await job.events.get()) is not None:
+                self.send({**event, 'id': id})
+        finally:
+            del self.jobs[id]
+
+    def send(self, message):
+        self.outbox.put_nowait(message)
+
+    async def flush(self):
+        # Sends everything in the outbox until `None` is put in it. Messages
+        # that are sent close together go out in a single frame.
+        closing = False
+        while not closing:
+            messages = [await self.outbox.get()]
+            if config.PROTOCOL_FRAME_DELAY:
+                await asyncio.sleep(config.PROTOCOL_FRAME_DELAY)
+            while not self.outbox.empty():
+                messages.append(self.outbox.get_nowait())
+
+            closing = None in messages
+            messages = [message for message in messages if message is not None]
+            if messages:
+                self.writer.write(self.codec.encode(messages))
+                await self.writer.drain()
+
+
+def authenticate(data):
+    # Authenticate the client's key. Also this check alone clearly isn't gonna
+    # cut it in terms of security but it's a start.
+    return hmac.compare_digest(data.get('access-token', ''), config.JUDGE_ACCESS_TOKEN)
+
+async def read_data(reader):
+    data = await read_frame(reader)
+    if data is None:
+        return None
+
+    return json.loads(data)
+
+async def send_data(writer, obj):
+    data = json.dumps(obj).encode('utf-8')
+    writer.write(pack_frame(data))
+    await writer.drain()
+
+def parse_address(address):
+    """Parses a `host:port` command line argument into a tuple (host, port)."""
+    host, sep, port = address.rpartition(':')
+    if not sep or not port.isdigit():
+        raise argparse.ArgumentTypeError(f'invalid address: {address!r}')
+    return host.strip('[]'), int(port)
 
 
 if __name__ == '__main__':
@@ -75,18 +413,28 @@ if __name__ == '__main__':
 
     import os
 
+    parser = argparse.ArgumentParser(description='Judges submissions, on its own or as a node of a cluster.')
+    parser.add_argument('--address', type=parse_address, default=config.SERVER_ADDRESS, metavar='HOST:PORT',
+                        help='the address to listen on (default: SERVER_ADDRESS)')
+    parser.add_argument('--coordinator', type=parse_address, default=config.COORDINATOR_ADDRESS,
+                        metavar='HOST:PORT', help='the coordinator to register with (default: COORDINATOR_ADDRESS)')
+    args = parser.parse_args()
+
     if os.geteuid() != 0:
         print('You must have root permissions to run this judge!')
         raise SystemExit(1)
 
     from algojudge.comparators import load_comparators
     from algojudge.runners import load_runners
+    from algojudge.sandbox import get_pool
 
     load_comparators()
     load_runners()
 
-    # Just a hack to get rid of the "Address is already in use" message.
-    ThreadingTCPServer.allow_reuse_address = True
+    get_pool().fill()
+    get_pool('compile').fill()
+    problems.preload(config.PRELOAD_PROBLEMS)
 
-    with ThreadingTCPServer(config.SERVER_ADDRESS, JudgeHandler) as server:
-        server.serve_forever()
+    server = JudgeServer(args.address, config.JUDGE_WORKERS, config.SUBMISSION_QUEUE_SIZE, config.PREEMPTION,
+                         args.coordinator)
+    asyncio.run(server.serve_forever())
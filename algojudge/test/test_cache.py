@@ -0,0 +1,170 @@
+from algojudge import config
+from algojudge.cache import ArtifactCache, TestDataCache
+from algojudge.executor import CasePrefetcher
+from algojudge.problem import TestCase as Case
+from algojudge.sandbox import SandboxResult
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from threading import Thread
+from unittest import main, TestCase
+from zipfile import ZipFile
+
+import os
+
+
+class ArtifactCacheTest(TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+
+    def make_box(self, name):
+        root = self.tmp / name
+        (root / 'home').mkdir(parents=True)
+        return SimpleNamespace(home_path=root / 'home', stdout_path=root / 'out', stderr_path=root / 'err')
+
+    def compile(self, box, exitcode, output):
+        (box.home_path / 'main.c').write_text('int main() {}')
+        (box.home_path / 'main').write_bytes(b'\x7fELF')
+        box.stdout_path.write_bytes(b'')
+        box.stderr_path.write_bytes(output)
+        return SandboxResult(1000, 2000, 512, 0, 0, exitcode, -1)
+
+    def test_roundtrip(self):
+        cache = ArtifactCache(self.tmp / 'cache', 1 << 20)
+        key = cache.key('c', ['/usr/bin/gcc', 'main.c'], 'int main() {}')
+
+        self.assertIsNone(cache.load(key, self.make_box('a')))
+
+        box = self.make_box('b')
+        cache.store(key, box, self.compile(box, 1, b'error: oops'), 5.0, exclude={'main.c'})
+
+        box = self.make_box('c')
+        result = cache.load(key, box)
+        self.assertEqual(result.exitcode, 1)
+        self.assertIsNone(result.signal)
+        self.assertEqual(box.stderr_path.read_bytes(), b'error: oops')
+        self.assertEqual((box.home_path / 'main').read_bytes(), b'\x7fELF')
+        self.assertFalse((box.home_path / 'main.c').exists())
+
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'saved-time': 5.0})
+
+    def test_key(self):
+        cache = ArtifactCache(self.tmp / 'cache', 1 << 20)
+
+        key = cache.key('c', ['/usr/bin/gcc', 'main.c'], 'int main() {}')
+        self.assertEqual(key, cache.key('c', ['/usr/bin/gcc', 'main.c'], 'int main() {}'))
+        self.assertNotEqual(key, cache.key('cpp', ['/usr/bin/gcc', 'main.c'], 'int main() {}'))
+        self.assertNotEqual(key, cache.key('c', ['/usr/bin/gcc', '-O2', 'main.c'], 'int main() {}'))
+        self.assertNotEqual(key, cache.key('c', ['/usr/bin/gcc', 'main.c'], 'int main() { }'))
+
+    def test_eviction(self):
+        # Each entry is 11 bytes (the compiled file plus the compiler output), so
+        # only two of them fit.
+        cache = ArtifactCache(self.tmp / 'cache', 25)
+
+        keys = [cache.key('c', ['/usr/bin/gcc'], str(i)) for i in range(3)]
+        for i, key in enumerate(keys):
+            box = self.make_box(f'store-{i}')
+            cache.store(key, box, self.compile(box, 0, b'warning'), 1.0, exclude={'main.c'})
+
+        self.assertIsNone(cache.load(keys[0], self.make_box('load-0')))
+        self.assertIsNotNone(cache.load(keys[1], self.make_box('load-1')))
+        self.assertIsNotNone(cache.load(keys[2], self.make_box('load-2')))
+
+
+class TestDataCacheTest(TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+
+    def make_problem(self, version, data, cases=1):
+        archive_path = self.tmp / f'{version}.zip'
+        with ZipFile(archive_path, 'w') as archive:
+            for num in range(1, cases + 1):
+                archive.writestr(f'{num}.in', data)
+                archive.writestr(f'{num}.out', data)
+
+        archive = ZipFile(archive_path)
+        self.addCleanup(archive.close)
+        return SimpleNamespace(code='test', version=version, open_archive=lambda: archive)
+
+    def test_link(self):
+        cache = TestDataCache(self.tmp / 'cache')
+        problem = self.make_problem('v1', b'1 2\n')
+
+        for i in range(2):
+            cache.link(problem, '1.in', self.tmp / f'in{i}')
+            self.assertEqual((self.tmp / f'in{i}').read_bytes(), b'1 2\n')
+
+        # Both boxes share the same extracted file.
+        self.assertEqual(os.stat(self.tmp / 'in0').st_ino, os.stat(self.tmp / 'in1').st_ino)
+        self.assertEqual(os.stat(self.tmp / 'in0').st_mode & 0o777, 0o444)
+
+    def test_purge(self):
+        cache = TestDataCache(self.tmp / 'cache')
+        old = self.make_problem('v1', b'old')
+        new = self.make_problem('v2', b'new')
+
+        old_path = cache.path(old, '1.in')
+        new_path = cache.path(new, '1.in')
+        self.assertEqual(new_path.read_bytes(), b'new')
+
+        cache.purge('test', keep='v2')
+        self.assertFalse(old_path.exists())
+        self.assertTrue(new_path.exists())
+
+    def test_concurrent(self):
+        extracted = []
+
+        class CountingCache(TestDataCache):
+            def _extract(self, problem, info, path):
+                extracted.append(info.filename)
+                super()._extract(problem, info, path)
+
+        cache = CountingCache(self.tmp / 'cache')
+        problem = self.make_problem('v1', os.urandom(1 << 24))
+
+        # A file that's needed by many threads at once is extracted only once.
+        threads = [Thread(target=cache.path, args=(problem, '1.in')) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(extracted, ['1.in'])
+
+    def test_prefetch(self):
+        self.addCleanup(setattr, config, 'TESTDATA_CACHE_ROOT', config.TESTDATA_CACHE_ROOT)
+        config.TESTDATA_CACHE_ROOT = str(self.tmp / 'cache')
+
+        problem = self.make_problem('v1', b'x' * 1000, cases=8)
+        cases = [Case(num, f'{num}.in', f'{num}.out', 1000, 65536) for num in range(1, 9)]
+
+        def _(max_cases, max_bytes, consumed):
+            prefetcher = CasePrefetcher(problem, 1, max_cases, max_bytes)
+            cases_iter = prefetcher.start(cases, 0)
+            for _ in range(consumed):
+                next(cases_iter)
+            prefetcher.pool.shutdown(wait=True)
+
+            path = self.tmp / 'cache' / 'test' / 'v1'
+            fetched = sorted(os.listdir(path)) if path.exists() else []
+            for name in fetched:
+                os.unlink(path / name)
+            return fetched
+
+        # The window moves along with the cases, and at least the next case
+        # is always fetched.
+        self.assertEqual(_(2, 1 << 20, 0), ['1.in', '1.out', '2.in', '2.out'])
+        self.assertEqual(_(2, 1 << 20, 3), ['1.in', '1.out', '2.in', '2.out', '3.in', '3.out', '4.in', '4.out',
+                                            '5.in', '5.out'])
+        self.assertEqual(_(8, 4000, 0), ['1.in', '1.out', '2.in', '2.out'])
+        self.assertEqual(_(8, 0, 1), ['1.in', '1.out', '2.in', '2.out'])
+
+
+
+if __name__ == '__main__':
+    main()
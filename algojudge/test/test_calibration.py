@@ -0,0 +1,89 @@
+from algojudge import calibration, config
+from algojudge.judge import Judge, Submission
+from tempfile import TemporaryDirectory
+from unittest import main, TestCase
+
+import json
+import os
+
+
+# Spins for about 400 ms of cpu time.
+SPIN = b'''
+import time
+start = time.process_time()
+while time.process_time() - start < 0.4: pass
+print(sum(map(int, input().split())))
+'''
+
+
+class CalibrationTest(TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        for name in ('CALIBRATION_PATH', 'PROBLEM_DATA_ROOT', 'TESTDATA_CACHE_ROOT', 'STARTUP_TIME_OFFSET',
+                     'TIME_LIMIT_MULTIPLIERS'):
+            self.addCleanup(setattr, config, name, getattr(config, name))
+        config.CALIBRATION_PATH = os.path.join(tmp.name, 'calibration.json')
+        config.PROBLEM_DATA_ROOT = os.path.join(os.path.dirname(__file__), 'testdata')
+        config.TESTDATA_CACHE_ROOT = os.path.join(tmp.name, 'testdata')
+
+    def test_calibrate(self):
+        from algojudge.runners import RUNNERS
+
+        self.assertIsNone(calibration.get_startup_time('python3'))
+
+        result = calibration.calibrate(RUNNERS['python3'], runs=5)
+        self.assertEqual(result['runs'], 5)
+        for times in (result['cpu-time'], result['real-time']):
+            self.assertGreater(times['min'], 0)
+            self.assertTrue(times['min'] <= times['p50'] <= times['p99'] <= times['max'])
+
+        calibration.save({'python3': result})
+        calibration.save({'c': calibration.calibrate(RUNNERS['c'], runs=5)})
+        with open(config.CALIBRATION_PATH) as f:
+            self.assertEqual(sorted(json.load(f)['languages']), ['c', 'python3'])
+        self.assertEqual(calibration.get_startup_time('python3'), result['cpu-time']['p50'])
+
+        # Python takes longer to start than a C program.
+        self.assertGreater(calibration.get_startup_time('python3'), calibration.get_startup_time('c'))
+
+    def test_limits(self):
+        calibration.save({'python3': {'runs': 1, 'cpu-time': {'p50': 5 * 10**8}}})
+
+        def _():
+            submission = Submission(
+                id=0,
+                problem_code='example',
+                language='python3',
+                source=SPIN,
+                time_limit=200,
+                memory_limit=65536
+            )
+            return list(Judge().judge(submission))[1][1]
+
+        verdict = _()
+        self.assertEqual(verdict['status'], 'TLE')
+        self.assertEqual(verdict['startup-time'], 5 * 10**8)
+
+        # The startup is added to the limit and taken off the time.
+        config.STARTUP_TIME_OFFSET = True
+        verdict = _()
+        self.assertEqual(verdict['status'], 'AC')
+        self.assertLess(verdict['cpu-time'], 4 * 10**8)
+
+        config.STARTUP_TIME_OFFSET = False
+        config.TIME_LIMIT_MULTIPLIERS = {'python3': 4}
+        verdict = _()
+        self.assertEqual(verdict['status'], 'AC')
+        self.assertGreaterEqual(verdict['cpu-time'], 4 * 10**8)
+
+
+if __name__ == '__main__':
+    from algojudge.comparators import load_comparators
+    from algojudge.runners import load_runners
+
+    load_comparators()
+    load_runners()
+
+    main()
@@ -0,0 +1,311 @@
+from algojudge import config, sandbox
+from algojudge.checker import get_checker
+from algojudge.judge import Judge, Submission
+from algojudge.problem import problems
+from algojudge.sandbox import SandboxConfig
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import main, TestCase
+from zipfile import ZipFile
+
+import os
+import time
+
+
+# Any number between the two in the input is accepted, and one that is just
+# outside of them scores half the points.
+PYTHON_CHECKER = '''
+import sys
+
+def check(input_path, output_path, answer_path):
+    a, b = map(int, open(input_path).read().split())
+    try:
+        x = int(open(output_path).read())
+    except ValueError:
+        return 1, 'not a number'
+    if a <= x <= b:
+        return 0, 'ok'
+    if x in (a - 1, b + 1):
+        return 2, '0.5 off by one'
+    return 1, f'{x} is out of range'
+
+if len(sys.argv) == 4:
+    code, message = check(*sys.argv[1:])
+    print(message)
+    sys.exit(code)
+
+for line in sys.stdin:
+    code, message = check(*line.split())
+    print(code, message, flush=True)
+'''
+
+# Guesses a number, answering each guess with whether the number is smaller,
+# larger or equal.
+INTERACTOR = '''
+import sys
+
+secret = int(open(sys.argv[1]).read())
+for guesses in range(1, 40):
+    line = sys.stdin.readline()
+    if not line:
+        print('no guess', file=sys.stderr)
+        sys.exit(1)
+    guess = int(line)
+    if guess == secret:
+        print('=', flush=True)
+        print(f'found in {guesses} guesses', file=sys.stderr)
+        sys.exit(0)
+    print('<' if secret < guess else '>', flush=True)
+
+print('too many guesses', file=sys.stderr)
+sys.exit(1)
+'''
+
+# A persistent checker that replies half a line at a time, and never finishes
+# its reply to the second case.
+SLOW_CHECKER = '''
+import sys, time
+
+for num, line in enumerate(sys.stdin):
+    print('0 o', end='', flush=True)
+    time.sleep(0.2 if num == 0 else 60)
+    print('k', flush=True)
+'''
+
+BINARY_SEARCH = b'''
+lo, hi = 1, 10**9
+while True:
+    mid = (lo + hi) // 2
+    print(mid, flush=True)
+    answer = input()
+    if answer == '=':
+        break
+    if answer == '<':
+        hi = mid - 1
+    else:
+        lo = mid + 1
+'''
+
+CPP_CHECKER = '''
+#include <fstream>
+#include <iostream>
+
+int main(int argc, char **argv) {
+    std::ifstream in(argv[1]), out(argv[2]);
+    long long a, b, x;
+    in >> a >> b;
+    if (!(out >> x)) { std::cout << "not a number\\n"; return 1; }
+    if (a <= x && x <= b) { std::cout << "ok\\n"; return 0; }
+    if (x == a - 1 || x == b + 1) { std::cout << "0.5 off by one\\n"; return 2; }
+    std::cout << x << " is out of range\\n";
+    return 1;
+}
+'''
+
+
+class CheckerTest(TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        for name in ('PROBLEM_DATA_ROOT', 'CHECKER_ROOT', 'EXECUTION_BACKENDS'):
+            self.addCleanup(setattr, config, name, getattr(config, name))
+        config.PROBLEM_DATA_ROOT = os.path.join(tmp.name, 'problems')
+        config.CHECKER_ROOT = os.path.join(tmp.name, 'checkers')
+
+    def write_problem(self, code, checker_file, checker_source, persistent=False):
+        problem_path = Path(config.PROBLEM_DATA_ROOT) / code
+        problem_path.mkdir(parents=True)
+
+        with ZipFile(problem_path / 'data.zip', 'w') as archive:
+            for num, data in enumerate(('1 5', '10 20', '30 40', '100 200'), 1):
+                archive.writestr(f'{num}.in', data + '\n')
+                archive.writestr(f'{num}.out', data.split()[0] + '\n')
+            archive.writestr(checker_file, checker_source)
+
+        with open(problem_path / 'config.yml', 'w') as f:
+            f.write(f'archive: data.zip\n'
+                    f'checker: {{ name: program, file: {checker_file}, persistent: {str(persistent).lower()} }}\n'
+                    f'cases:\n'
+                    f'  - {{ in: 1.in, out: 1.out }}\n'
+                    f'  - batch:\n'
+                    f'      - {{ in: 2.in, out: 2.out }}\n'
+                    f'      - {{ in: 3.in, out: 3.out }}\n'
+                    f'    points: 60\n'
+                    f'  - batch:\n'
+                    f'      - {{ in: 4.in, out: 4.out }}\n'
+                    f'    points: 40\n')
+
+    def judge(self, code, source):
+        submission = Submission(
+            id=0,
+            problem_code=code,
+            language='python3',
+            source=source,
+            time_limit=1000,
+            memory_limit=65536
+        )
+        return list(Judge().judge(submission))
+
+    def test_checkers(self):
+        self.write_problem('python', 'checker.py', PYTHON_CHECKER)
+        self.write_problem('persistent', 'checker.py', PYTHON_CHECKER, persistent=True)
+        self.write_problem('cpp', 'checker.cpp', CPP_CHECKER)
+
+        # Checkers are linked into their boxes along with the case's files, so
+        # they can be sandboxed as well.
+        for backend, code in (('trusted', 'python'), ('trusted', 'persistent'), ('trusted', 'cpp'),
+                              ('sandbox', 'python'), ('sandbox', 'persistent'), ('sandbox', 'cpp')):
+            config.EXECUTION_BACKENDS = {**config.EXECUTION_BACKENDS, 'checker': backend}
+            with self.subTest(code, backend=backend):
+                # A different answer than the expected one on every case but
+                # the third, which is off by one.
+                result = self.judge(code, b'a, b = map(int, input().split()); print(a - 1 if a == 30 else b)')
+                verdicts = {data['case-num']: data for header, data in result if header == 'case-verdict'}
+
+                self.assertEqual([verdicts[num]['status'] for num in range(1, 5)], ['AC', 'AC', 'PA', 'AC'])
+                self.assertEqual(verdicts[1]['message'], 'ok')
+                self.assertEqual(verdicts[3]['points'], 0.5)
+                self.assertEqual(verdicts[3]['message'], 'off by one')
+                self.assertEqual(result[-1], ('case-end', {'points': 70, 'total-points': 100}))
+
+                result = self.judge(code, b'print("x")')
+                verdicts = [data for header, data in result if header == 'case-verdict']
+                self.assertEqual(verdicts[0]['status'], 'WA')
+                self.assertEqual(verdicts[0]['message'], 'not a number')
+
+        # Each checker was compiled once, for the only version of its problem.
+        self.assertEqual(len(os.listdir(Path(config.CHECKER_ROOT) / 'cpp')), 1)
+
+    def test_versions(self):
+        self.write_problem('persistent', 'checker.py', PYTHON_CHECKER, persistent=True)
+        source = b'print(input().split()[0])'
+
+        # A submission is still judging the first version of the problem when
+        # the problem changes.
+        with problems.use('persistent', 1000, 65536) as old_problem:
+            self.judge('persistent', source)
+            old = get_checker(old_problem)
+
+            with open(Path(config.PROBLEM_DATA_ROOT) / 'persistent' / 'config.yml', 'a') as f:
+                f.write('# changed\n')
+            result = self.judge('persistent', source)
+            self.assertEqual([data['status'] for header, data in result if header == 'case-verdict'], ['AC'] * 4)
+
+            # Each version has a checker of its own, and the old one is kept
+            # (along with its processes and compiled program) for as long as
+            # its version is in use.
+            new = get_checker(problems.get('persistent', 1000, 65536))
+            self.assertIsNot(new, old)
+            self.assertIs(get_checker(old_problem), old)
+            self.assertFalse(old.closed)
+            self.assertTrue(old.idle)
+            self.assertTrue((old.path / old.filename).exists())
+
+        self.assertTrue(old.closed)
+        self.assertFalse(old.idle)
+        self.assertFalse(old.path.exists())
+        self.assertTrue((new.path / new.filename).exists())
+
+    def test_bounded_pools(self):
+        self.write_problem('python', 'checker.py', PYTHON_CHECKER)
+
+        for name in ('SANDBOX_POOL_MAX_SIZE', 'JUDGE_WORKERS'):
+            self.addCleanup(setattr, config, name, getattr(config, name))
+        config.SANDBOX_POOL_MAX_SIZE = 1
+        config.JUDGE_WORKERS = 1
+
+        # The pools are created on first use, so the test gets bounded ones of
+        # its own.
+        self.addCleanup(setattr, sandbox, '_pools', sandbox._pools)
+        sandbox._pools = {}
+        self.addCleanup(lambda: [pool.close() for pool in sandbox._pools.values()])
+
+        # The checker is compiled in a box of the same pool as the submission,
+        # which must not wait for it while holding its own.
+        results = []
+        thread = Thread(target=lambda: results.append(self.judge('python', b'print(input().split()[0])')),
+                        daemon=True)
+        thread.start()
+        thread.join(60)
+        self.assertFalse(thread.is_alive(), 'Judging is stuck waiting for a box')
+
+        verdicts = [data for header, data in results[0] if header == 'case-verdict']
+        self.assertEqual([verdict['status'] for verdict in verdicts], ['AC'] * 4)
+
+    def test_broken_checker(self):
+        self.write_problem('broken', 'checker.py', 'import sys; sys.exit(5)')
+        self.write_problem('invalid', 'checker.cpp', 'int main() {')
+        # Ruby programs aren't compiled to a file that can be kept.
+        self.write_problem('ruby', 'checker.rb', 'exit 0')
+
+        for code in ('broken', 'invalid', 'ruby'):
+            with self.subTest(code):
+                result = self.judge(code, b'print(1)')
+                self.assertIn('internal-error', [header for header, _ in result])
+
+    def test_slow_checker(self):
+        self.write_problem('slow', 'checker.py', SLOW_CHECKER, persistent=True)
+
+        for name in ('CHECKER_CONFIG', 'CASE_WORKERS'):
+            self.addCleanup(setattr, config, name, getattr(config, name))
+        config.CHECKER_CONFIG = SandboxConfig(cpu_time_limit=1000, real_time_limit=1000, memory_limit=1048576)
+        config.CASE_WORKERS = 1
+
+        # A reply is read in as many pieces as it comes in, but all of it must
+        # come within the time limit.
+        start = time.monotonic()
+        result = self.judge('slow', b'print(1)')
+        self.assertLess(time.monotonic() - start, 10)
+
+        self.assertEqual([data['status'] for header, data in result if header == 'case-verdict'], ['AC'])
+        self.assertEqual(result[-1][0], 'internal-error')
+        self.assertIn('took too long', result[-1][1]['error'])
+
+    def test_interactor(self):
+        problem_path = Path(config.PROBLEM_DATA_ROOT) / 'guess'
+        problem_path.mkdir(parents=True)
+
+        with ZipFile(problem_path / 'data.zip', 'w') as archive:
+            for num, secret in enumerate((1, 123456789, 10**9), 1):
+                archive.writestr(f'{num}.in', f'{secret}\n')
+                archive.writestr(f'{num}.out', '')
+            archive.writestr('interactor.py', INTERACTOR)
+
+        with open(problem_path / 'config.yml', 'w') as f:
+            f.write('archive: data.zip\n'
+                    'interactor: interactor.py\n'
+                    'cases:\n' + ''.join(f'  - {{ in: {num}.in, out: {num}.out }}\n' for num in range(1, 4)))
+
+        def _(source):
+            result = self.judge('guess', source)
+            return [data for header, data in result if header == 'case-verdict']
+
+        verdicts = _(BINARY_SEARCH)
+        self.assertEqual([verdict['status'] for verdict in verdicts], ['AC'] * 3)
+        self.assertEqual(verdicts[0]['message'], 'found in 29 guesses')
+
+        # The program is stopped as soon as the interactor gives up on it.
+        verdicts = _(b'print(1, flush=True)\nwhile input() != "=": print(1, flush=True)')
+        self.assertEqual([verdict['status'] for verdict in verdicts], ['AC', 'WA', 'WA'])
+        self.assertEqual(verdicts[1]['message'], 'too many guesses')
+
+        # A program that fails is judged by its failure if the interactor
+        # accepted it, but the interactor's rejection comes first otherwise.
+        verdicts = _(b'print(1, flush=True); input(); 1 / 0')
+        self.assertEqual([verdict['status'] for verdict in verdicts], ['NZE', 'WA', 'WA'])
+
+        verdicts = _(b'import time; time.sleep(5)')
+        self.assertEqual(verdicts[0]['status'], 'TLE')
+
+
+
+if __name__ == '__main__':
+    from algojudge.comparators import load_comparators
+    from algojudge.runners import load_runners
+
+    load_comparators()
+    load_runners()
+
+    main()
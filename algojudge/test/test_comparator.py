@@ -1,4 +1,4 @@
-from algojudge.comparators import COMPARATORS
+from algojudge.comparators import COMPARATORS, STREAMING_COMPARATORS
 from io import BytesIO
 from unittest import main, TestCase
 
@@ -9,6 +9,12 @@ def compare_bytes(type):
     return compare
 
 
+def mismatch_bytes(type):
+    def mismatch(a, b):
+        return STREAMING_COMPARATORS[type](BytesIO(a), BytesIO(b))
+    return mismatch
+
+
 class ComparatorTest(TestCase):
     def test_identical(self):
         compare = compare_bytes('identical')
@@ -53,6 +59,66 @@ class ComparatorTest(TestCase):
         self.assertFalse(compare(b'a'*10**5+b'a', b'a'*10**5+b'b'))
         self.assertFalse(compare(b' '*10**5+b'a', b'\n'*10**5+b'a'))
 
+    def test_mismatch(self):
+        mismatch = mismatch_bytes('identical')
+
+        self.assertEqual(mismatch(b'', b''), -1)
+        self.assertEqual(mismatch(b'a\nb', b'a\nb'), -1)
+        self.assertEqual(mismatch(b'a\nc', b'a\nb'), 2)
+        self.assertEqual(mismatch(b'a', b'ab'), 1)
+        self.assertEqual(mismatch(b'ab', b'a'), 1)
+        self.assertEqual(mismatch(b'a'*10**5+b'b', b'a'*10**5+b'c'), 10**5)
+
+        mismatch = mismatch_bytes('standard')
+
+        self.assertEqual(mismatch(b'a b\n', b'a b  \n\n'), -1)
+        self.assertEqual(mismatch(b'a c', b'a b'), 2)
+        self.assertEqual(mismatch(b'a  b', b'a b'), 2)
+        self.assertEqual(mismatch(b'a b', b'a  b'), 2)
+        self.assertEqual(mismatch(b'a', b'a b'), 1)
+        self.assertEqual(mismatch(b'a b', b'a'), 2)
+        self.assertEqual(mismatch(b'a'*10**5+b'\nb', b'a'*10**5+b'\nc'), 10**5+1)
+
+    def test_tokens(self):
+        compare = compare_bytes('tokens')
+
+        self.assertTrue(compare(b'', b''))
+        self.assertTrue(compare(b'', b' \n\r\n\t'))
+        self.assertTrue(compare(b'a b\nc', b'a\r\nb  c\n'))
+        self.assertTrue(compare(b' '*10**5+b'a', b'\n'*10**5+b'a'))
+        self.assertTrue(compare(b'a'*10**5+b' b', b'a'*10**5+b'\nb'))
+
+        self.assertFalse(compare(b'a', b''))
+        self.assertFalse(compare(b'ab', b'a b'))
+        self.assertFalse(compare(b'a b', b'a bc'))
+        self.assertFalse(compare(b'a'*10**5, b'a'*(10**5+1)))
+
+        mismatch = mismatch_bytes('tokens')
+
+        self.assertEqual(mismatch(b'a  b', b'a\nc'), 3)
+        self.assertEqual(mismatch(b'a ', b'a b'), 2)
+        self.assertEqual(mismatch(b'a b', b'a'), 2)
+
+    def test_float(self):
+        def compare(a, b, **kwargs):
+            return COMPARATORS['float'](BytesIO(a), BytesIO(b), **kwargs)
+
+        self.assertTrue(compare(b'1 2.5', b'1\n2.5'))
+        self.assertTrue(compare(b'0.3333333', b'0.3333333333'))
+        self.assertTrue(compare(b'1e6', b'1000000.5', abs=1))
+        self.assertTrue(compare(b'1000000', b'1000001', abs=0, rel=1e-6))
+        self.assertTrue(compare(b'-0', b'0'))
+        self.assertTrue(compare(b'nan', b'nan'))
+        self.assertTrue(compare(b'yes 1.0', b'yes 1'))
+
+        self.assertFalse(compare(b'0.33', b'0.3333333333'))
+        self.assertFalse(compare(b'1000000', b'1000002', abs=0, rel=1e-6))
+        self.assertFalse(compare(b'nan', b'1'))
+        self.assertFalse(compare(b'0x1p0', b'1'))
+        self.assertFalse(compare(b'1.0.0', b'1'))
+        self.assertFalse(compare(b'1', b'1 2'))
+        self.assertFalse(compare(b'yes', b'no'))
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,252 @@
+from algojudge import config
+from algojudge.coordinator import Coordinator, Dispatch, Node
+from algojudge.protocol import Codec, read_frame
+from algojudge.server import JudgeServer, read_data, send_data
+from unittest import IsolatedAsyncioTestCase, main, TestCase
+
+import asyncio
+import os
+
+
+class FakeNode:
+    """A node that sends the same events for every submission, stopping short
+    after `fail_after` of them if it's given. A node that `beats` keeps sending
+    heartbeats rather than just the first, and one that `hangs` doesn't close
+    the connection after its events, and stops sending them."""
+
+    EVENTS = [
+        {'header': 'queued', 'position': 1},
+        {'header': 'judging-begin'},
+        {'header': 'case-begin'},
+        *({'header': 'case-verdict', 'case-num': num, 'status': 'AC'} for num in range(1, 4)),
+        {'header': 'case-end', 'points': 3, 'total-points': 3},
+        {'header': 'judging-end'}
+    ]
+
+    def __init__(self, fail_after=None, busy=False, beats=False, hangs=False):
+        self.fail_after = fail_after
+        self.busy = busy
+        self.beats = beats
+        self.hangs = hangs
+        self.hung = False
+        self.closed = asyncio.Event()
+        self.submissions = []
+
+    async def start(self, coordinator, problems=()):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+
+        _, self.writer = await asyncio.open_connection(*coordinator.server.sockets[0].getsockname())
+        await send_data(self.writer, {
+            'header': 'register',
+            'access-token': config.JUDGE_ACCESS_TOKEN,
+            'host': None,
+            'port': self.server.sockets[0].getsockname()[1],
+            'workers': 1,
+            'languages': ['python3']
+        })
+        self.heartbeats = asyncio.create_task(self.beat(problems))
+
+    async def beat(self, problems):
+        while not self.hung:
+            await send_data(self.writer, {'header': 'heartbeat', 'free-workers': 1, 'queued': 0, 'problems': problems})
+            if not self.beats:
+                break
+            await asyncio.sleep(config.HEARTBEAT_INTERVAL)
+
+    async def close(self):
+        self.closed.set()
+        self.heartbeats.cancel()
+        self.writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.submissions.append(await read_data(reader))
+
+        events = [{'header': 'busy'}] if self.busy else self.EVENTS[:self.fail_after]
+        for event in events:
+            await send_data(writer, event)
+
+        if self.hangs:
+            self.hung = True
+            await self.closed.wait()
+        writer.close()
+
+
+class PickTest(TestCase):
+    def test_pick(self):
+        coordinator = Coordinator(('127.0.0.1', 0))
+        idle = Node(('idle', 1), 2, ['python3'])
+        cached = Node(('cached', 1), 2, ['python3'])
+        full = Node(('full', 1), 1, ['python3', 'c'])
+        for node in (idle, cached, full):
+            coordinator.nodes[node.address] = node
+
+        cached.problems = full.problems = {'sum'}
+        cached.free_workers = 1
+        full.free_workers = 0
+        job = Dispatch({'problem-code': 'sum', 'language': 'python3'})
+
+        # A node that has the problem at hand goes first, as long as it has a
+        # free worker.
+        self.assertIs(coordinator.pick(job), cached)
+        cached.inflight = 2
+        self.assertIs(coordinator.pick(job), idle)
+
+        # Otherwise it's the least loaded node.
+        idle.free_workers, idle.queued = 0, 3
+        full.queued = 1
+        self.assertIs(coordinator.pick(job), cached)
+
+        cached.failed = True
+        self.assertIs(coordinator.pick(job, exclude={full}), idle)
+
+        self.assertIs(coordinator.pick(Dispatch({'problem-code': 'sum', 'language': 'c'})), full)
+        self.assertIsNone(coordinator.pick(Dispatch({'problem-code': 'sum', 'language': 'java'})))
+
+
+class CoordinatorTest(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        for name in ('PROBLEM_DATA_ROOT', 'HEARTBEAT_INTERVAL'):
+            self.addCleanup(setattr, config, name, getattr(config, name))
+        config.PROBLEM_DATA_ROOT = os.path.join(os.path.dirname(__file__), 'testdata')
+        config.HEARTBEAT_INTERVAL = 0.05
+
+        self.coordinator = Coordinator(('127.0.0.1', 0))
+        await self.coordinator.start()
+        self.addAsyncCleanup(self.coordinator.close)
+
+    async def start_node(self, node, **kwargs):
+        await node.start(self.coordinator, **kwargs)
+        self.addAsyncCleanup(node.close)
+
+    async def wait_for_nodes(self, count):
+        while len(self.coordinator.nodes) != count:
+            await asyncio.sleep(0.01)
+
+    async def submit(self, **kwargs):
+        reader, writer = await asyncio.open_connection(*self.coordinator.server.sockets[0].getsockname())
+        self.addCleanup(writer.close)
+
+        await send_data(writer, {
+            'header': 'submit',
+            'access-token': config.JUDGE_ACCESS_TOKEN,
+            'id': 0,
+            'problem-code': 'sum',
+            'language': 'python3',
+            'source': 'print(sum(map(int, input().split())))',
+            'time-limit': 1000,
+            'memory-limit': 65536,
+            **kwargs
+        })
+
+        events = []
+        while (data := await read_data(reader)) is not None:
+            events.append(data)
+        return events
+
+    async def test_retry(self):
+        failing, working = FakeNode(fail_after=4), FakeNode()
+        await self.start_node(failing, problems=['sum'])
+        await self.start_node(working)
+        await self.wait_for_nodes(2)
+
+        # The node that has the problem fails after the first case, so the
+        # submission is judged again on the other, and the site gets each
+        # event once.
+        events = await self.submit()
+        self.assertEqual(events, FakeNode.EVENTS)
+        self.assertEqual(len(failing.submissions), 1)
+        self.assertEqual(working.submissions[0]['source'], 'print(sum(map(int, input().split())))')
+        self.assertTrue(self.coordinator.nodes[('127.0.0.1', working.server.sockets[0].getsockname()[1])].problems)
+
+        # Every node that's tried fails or is busy.
+        working.busy = True
+        events = await self.submit()
+        self.assertEqual([event['header'] for event in events], ['busy'])
+
+        working.busy = False
+        working.fail_after = 2
+        events = await self.submit(id=1)
+        self.assertEqual([event['header'] for event in events],
+                         ['queued', 'judging-begin', 'internal-error', 'judging-end'])
+
+        # Nodes that leave aren't given submissions anymore.
+        await failing.close()
+        await working.close()
+        await self.wait_for_nodes(0)
+        self.assertEqual(await self.submit(), [{'header': 'busy'}])
+
+    async def test_hung_node(self):
+        self.addCleanup(setattr, config, 'HEARTBEAT_TIMEOUT', config.HEARTBEAT_TIMEOUT)
+        config.HEARTBEAT_TIMEOUT = 0.5
+
+        hung, working = FakeNode(fail_after=4, beats=True, hangs=True), FakeNode(beats=True)
+        await self.start_node(hung, problems=['sum'])
+        await self.start_node(working)
+        await self.wait_for_nodes(2)
+
+        # The node that has the problem goes silent after the first case, but
+        # leaves the connection open. Once it's dropped for missing its
+        # heartbeats, the submission is judged again on the other.
+        events = await asyncio.wait_for(self.submit(), 10)
+        self.assertEqual(events, FakeNode.EVENTS)
+        self.assertEqual(len(hung.submissions), 1)
+        self.assertEqual(len(working.submissions), 1)
+        self.assertEqual(len(self.coordinator.nodes), 1)
+
+    async def test_cluster(self):
+        nodes = []
+        for _ in range(2):
+            node = JudgeServer(('127.0.0.1', 0), workers=1, queue_size=4,
+                               coordinator=self.coordinator.server.sockets[0].getsockname())
+            await node.start()
+            self.addAsyncCleanup(node.close)
+            nodes.append(node)
+        await self.wait_for_nodes(2)
+
+        reader, writer = await asyncio.open_connection(*self.coordinator.server.sockets[0].getsockname())
+        self.addCleanup(writer.close)
+        await send_data(writer, {'header': 'hello', 'version': 2, 'access-token': config.JUDGE_ACCESS_TOKEN})
+        self.assertEqual((await read_data(reader))['version'], 2)
+
+        # The two submissions go to a node each, over a session with the site.
+        codec = Codec()
+        writer.write(codec.encode([{
+            'header': 'submit',
+            'id': id,
+            'problem-code': 'sum',
+            'language': 'python3',
+            'source': 'print(sum(map(int, input().split())))',
+            'time-limit': 1000,
+            'memory-limit': 65536
+        } for id in (1, 2)]))
+
+        statuses = {1: [], 2: []}
+        ended = set()
+        while len(ended) < 2:
+            for message in codec.decode(await read_frame(reader)):
+                if message['header'] == 'case-verdict':
+                    statuses[message['id']].append(message['status'])
+                elif message['header'] == 'judging-end':
+                    ended.add(message['id'])
+
+        self.assertEqual(statuses, {1: ['AC'] * 8, 2: ['AC'] * 8})
+        self.assertEqual([node.scheduler.stats()['live']['scheduled'] for node in nodes], [1, 1])
+
+        # The nodes report the problem as theirs now.
+        await asyncio.sleep(2 * config.HEARTBEAT_INTERVAL)
+        self.assertTrue(all('sum' in node.problems for node in self.coordinator.nodes.values()))
+
+        await nodes[0].close()
+        await self.wait_for_nodes(1)
+
+
+if __name__ == '__main__':
+    from algojudge.comparators import load_comparators
+    from algojudge.runners import load_runners
+
+    load_comparators()
+    load_runners()
+
+    main()
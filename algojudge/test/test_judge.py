@@ -34,6 +34,9 @@ class JudgeTest(TestCase):
 
         _(b'print(sum(map(int, input().split())))', 'AC')
         _(b'print(-1)', 'WA')
+        # The output is checked as it's produced, so this is caught long before
+        # it would time out.
+        _(b'while 1: print(-1)', 'WA')
         _(b'while 1: 0', 'TLE')
         _(b'import time; time.sleep(2)', 'TLE')
         _(b'[0] * 10**6', 'MLE')
@@ -66,6 +69,74 @@ class JudgeTest(TestCase):
         _(b'print(0)', 'python3')
         _(b'p 0', 'ruby')
 
+    def test_parallel(self):
+        judge = Judge()
+
+        self.addCleanup(setattr, config, 'CASE_WORKERS', config.CASE_WORKERS)
+        self.addCleanup(setattr, config, 'ORDERED_VERDICTS', config.ORDERED_VERDICTS)
+
+        def _(workers, ordered):
+            config.CASE_WORKERS = workers
+            config.ORDERED_VERDICTS = ordered
+
+            submission = Submission(
+                id=0,
+                problem_code='sum',
+                language='python3',
+                source=b'print(sum(map(int, input().split())))',
+                time_limit=1000,
+                memory_limit=65536
+            )
+            result = list(judge.judge(submission))
+            verdicts = [data for header, data in result if header == 'case-verdict']
+
+            self.assertEqual(len(verdicts), 8)
+            self.assertTrue(all(verdict['status'] == 'AC' for verdict in verdicts))
+
+            case_nums = [verdict['case-num'] for verdict in verdicts]
+            if ordered:
+                self.assertEqual(case_nums, list(range(1, 9)))
+            else:
+                self.assertEqual(sorted(case_nums), list(range(1, 9)))
+
+        _(1, True)
+        _(4, True)
+        _(4, False)
+
+    def test_batches(self):
+        judge = Judge()
+
+        self.addCleanup(setattr, config, 'CASE_WORKERS', config.CASE_WORKERS)
+        self.addCleanup(setattr, config, 'CASE_ORDER', config.CASE_ORDER)
+        config.CASE_WORKERS = 1
+
+        def _():
+            # Wrong only when both numbers are positive, i.e. on cases 2 and 5.
+            submission = Submission(
+                id=0,
+                problem_code='batches',
+                language='python3',
+                source=b'a, b = map(int, input().split()); print(a + b if min(a, b) < 0 else 0)',
+                time_limit=1000,
+                memory_limit=65536
+            )
+            return list(judge.judge(submission))
+
+        result = _()
+        verdicts = {data['case-num']: data['status'] for header, data in result if header == 'case-verdict'}
+        skipped = [data['case-num'] for header, data in result if header == 'case-skipped']
+
+        # Case 2 fails batch 1, so the rest of it and batch 2 which depends on it
+        # are skipped.
+        self.assertEqual(verdicts, {1: 'AC', 2: 'WA', 7: 'AC', 8: 'AC'})
+        self.assertEqual(skipped, [3, 4, 5, 6])
+        self.assertEqual(result[-1], ('case-end', {'points': 40, 'total-points': 100}))
+
+        config.CASE_ORDER = 'fail-first'
+        result = _()
+        self.assertEqual(result[1][0], 'case-verdict')
+        self.assertEqual(result[1][1]['case-num'], 2)
+
 
 
 if __name__ == '__main__':
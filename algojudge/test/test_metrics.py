@@ -0,0 +1,87 @@
+from algojudge import config, metrics
+from algojudge.judge import Judge, Submission
+from unittest import IsolatedAsyncioTestCase, main, TestCase
+
+import asyncio
+import os
+
+
+class MetricsTest(TestCase):
+    def test_render(self):
+        registry = []
+        counter = metrics.Counter('test_total', 'A counter.', ('kind',), registry=registry)
+        histogram = metrics.Histogram('test_seconds', 'A histogram.', buckets=(0.1, 1), registry=registry)
+
+        counter.labels('a"b').inc()
+        counter.labels('a"b').inc(2)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        self.assertEqual(metrics.render(registry), '\n'.join([
+            '# HELP test_total A counter.',
+            '# TYPE test_total counter',
+            'test_total{kind="a\\"b"} 3',
+            '# HELP test_seconds A histogram.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            'test_seconds_sum 5.55',
+            'test_seconds_count 3',
+        ]) + '\n')
+
+        with self.assertRaises(ValueError):
+            counter.labels('a', 'b')
+
+    def test_judge(self):
+        self.addCleanup(setattr, config, 'PROBLEM_DATA_ROOT', config.PROBLEM_DATA_ROOT)
+        config.PROBLEM_DATA_ROOT = os.path.join(os.path.dirname(__file__), 'testdata')
+
+        submissions = metrics.SUBMISSIONS.labels('python3', 'WA')
+        cases = metrics.CASE_VERDICTS.labels('python3', 'WA')
+        runs = metrics.SANDBOX_TIME.labels('run')
+        before = submissions.value, cases.value, sum(runs.counts)
+
+        submission = Submission(
+            id=0,
+            problem_code='example',
+            language='python3',
+            source=b'print(0)',
+            time_limit=1000,
+            memory_limit=65536
+        )
+        list(Judge().judge(submission))
+
+        self.assertEqual(submissions.value, before[0] + 1)
+        self.assertEqual(cases.value, before[1] + 1)
+        self.assertEqual(sum(runs.counts), before[2] + 1)
+        self.assertEqual(metrics.ACTIVE_BOXES.labels().value, 0)
+
+
+class MetricsServerTest(IsolatedAsyncioTestCase):
+    async def test_http(self):
+        server = await metrics.start_http_server(('127.0.0.1', 0))
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        response = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+
+        head, body = response.split(b'\r\n\r\n', 1)
+        self.assertTrue(head.startswith(b'HTTP/1.1 200 OK'))
+        self.assertIn(b'# TYPE algojudge_submissions_total counter', body)
+
+
+
+if __name__ == '__main__':
+    from algojudge.comparators import load_comparators
+    from algojudge.runners import load_runners
+
+    load_comparators()
+    load_runners()
+
+    main()
@@ -0,0 +1,123 @@
+from algojudge import config
+from algojudge.problem import _parse_checker, Problem, ProblemRegistry
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import main, TestCase
+from zipfile import ZipFile
+
+import os
+
+
+class ProblemRegistryTest(TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        self.addCleanup(setattr, config, 'PROBLEM_DATA_ROOT', config.PROBLEM_DATA_ROOT)
+        config.PROBLEM_DATA_ROOT = tmp.name
+
+        self.problem_path = Path(tmp.name) / 'test'
+        self.problem_path.mkdir()
+
+    def write_problem(self, num_cases, mtime, code='test'):
+        problem_path = self.problem_path.parent / code
+        problem_path.mkdir(exist_ok=True)
+
+        with ZipFile(problem_path / 'data.zip', 'w') as archive:
+            for i in range(num_cases):
+                archive.writestr(f'{i}.in', '')
+                archive.writestr(f'{i}.out', '')
+
+        with open(problem_path / 'config.yml', 'w') as f:
+            f.write('archive: data.zip\ncases:\n')
+            for i in range(num_cases):
+                f.write(f'  - {{ in: {i}.in, out: {i}.out }}\n')
+
+        # Make sure the change is visible even on filesystems with coarse
+        # timestamps.
+        for name in ('config.yml', 'data.zip'):
+            os.utime(problem_path / name, ns=(mtime, mtime))
+
+    def test_cache(self):
+        registry = ProblemRegistry()
+        self.write_problem(1, 10**9)
+
+        problem = registry.get('test', 1000, 65536)
+        self.assertEqual(len(problem.cases), 1)
+        self.assertEqual(problem.cases[0].time_limit, 1000)
+        self.assertIs(registry.get('test', 1000, 65536), problem)
+        self.assertIs(registry.get('test', 2000, 65536).open_archive(), problem.open_archive())
+
+        self.write_problem(3, 2 * 10**9)
+
+        problem = registry.get('test', 1000, 65536)
+        self.assertEqual(len(problem.cases), 3)
+        self.assertEqual(len(problem.open_archive().namelist()), 6)
+
+    def test_archives(self):
+        self.addCleanup(setattr, config, 'PROBLEM_CACHE_SIZE', config.PROBLEM_CACHE_SIZE)
+        config.PROBLEM_CACHE_SIZE = 1
+
+        registry = ProblemRegistry()
+        self.write_problem(1, 10**9)
+        self.write_problem(1, 10**9, 'other')
+
+        # The archive of a problem that is in use stays open when the problem
+        # changes, until it's not in use anymore.
+        released = []
+        with registry.use('test', 1000, 65536) as problem:
+            archive = problem.open_archive()
+            registry.on_release(problem, lambda: released.append(1))
+            self.write_problem(2, 2 * 10**9)
+            self.assertIsNot(registry.get('test', 1000, 65536).open_archive(), archive)
+            self.assertIsNotNone(archive.fp)
+            self.assertEqual(released, [])
+        self.assertIsNone(archive.fp)
+        self.assertEqual(released, [1])
+
+        # Likewise when it's evicted.
+        problem = registry.get('test', 1000, 65536)
+        archive = problem.open_archive()
+        registry.on_release(problem, lambda: released.append(2))
+        registry.get('other', 1000, 65536)
+        self.assertIsNone(archive.fp)
+        self.assertEqual(released, [1, 2])
+
+        # A version that is already released is released right away.
+        registry.on_release(problem, lambda: released.append(3))
+        self.assertEqual(released, [1, 2, 3])
+        self.assertEqual(len(registry.get('test', 1000, 65536).open_archive().namelist()), 4)
+
+    def test_batches(self):
+        def case(i):
+            return {'in': f'{i}.in', 'out': f'{i}.out'}
+
+        data = {'archive': 'data.zip', 'cases': [
+            case(1),
+            {'batch': [case(2), case(3)], 'points': 10},
+            {'batch': [case(4)], 'points': 20, 'depends': [1]},
+            {'batch': [case(5)], 'points': 30, 'depends': [2]},
+        ]}
+        problem = Problem('test', 1000, 65536, data, stamp=())
+
+        self.assertEqual([case.num for case in problem.cases], [1, 2, 3, 4, 5])
+        self.assertEqual([case.batch for case in problem.cases], [None, 1, 1, 2, 3])
+        self.assertEqual(problem.batches[2].dependencies, {1, 2})
+
+        data['cases'][2]['depends'] = [2]
+        with self.assertRaises(ValueError):
+            Problem('test', 1000, 65536, data, stamp=())
+
+    def test_checker(self):
+        self.assertEqual(_parse_checker('standard'), ('standard', {}))
+        self.assertEqual(_parse_checker('float(abs=1e-4, rel=0)'), ('float', {'abs': 1e-4, 'rel': 0}))
+        self.assertEqual(_parse_checker({'name': 'float', 'abs': 1e-4}), ('float', {'abs': 1e-4}))
+
+        for checker in ('float(1e-4)', 'float(abs=x)', 'a.b', 'float('):
+            with self.assertRaises(ValueError):
+                _parse_checker(checker)
+
+
+
+if __name__ == '__main__':
+    main()
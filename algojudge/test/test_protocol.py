@@ -0,0 +1,140 @@
+from algojudge import config
+from algojudge.protocol import Codec, decode_binary, encode_binary, ProtocolError, read_frame
+from algojudge.server import JudgeServer, read_data, send_data
+from unittest import IsolatedAsyncioTestCase, main, TestCase
+
+import asyncio
+import json
+import os
+import struct
+
+
+VERDICT = {
+    'header': 'case-verdict',
+    'id': 12345,
+    'case-num': 3,
+    'batch': None,
+    'input': '3.in',
+    'output': '3.out',
+    'status': 'AC',
+    'message': None,
+    'cpu-time': 0.015,
+    'real-time': 0.021,
+    'memory': 9216
+}
+
+
+class CodecTest(TestCase):
+    def test_binary(self):
+        for obj in (None, True, False, 0, -1, 63, -64, 2**70, -2**70, 1.5, '', 'AC', 'ünïcode',
+                    [], [1, [2, 'x']], {}, {'a': {'b': None}}, VERDICT):
+            self.assertEqual(decode_binary(encode_binary(obj)), obj)
+
+        with self.assertRaises(ValueError):
+            decode_binary(encode_binary([1, 2]) + b'\0')
+
+    def test_codec(self):
+        messages = [dict(VERDICT, **{'case-num': i}) for i in range(100)]
+
+        sizes = {}
+        for encoding in ('json', 'binary'):
+            for compression in (None, 'zlib'):
+                codec = Codec(encoding, compression)
+                frame = codec.encode(messages)
+                self.assertEqual(struct.unpack('!I', frame[:4])[0], len(frame) - 4)
+                self.assertEqual(codec.decode(frame[4:]), messages)
+                sizes[encoding, compression] = len(frame)
+
+        self.assertLess(sizes['binary', None], sizes['json', None] / 2)
+        self.assertLess(sizes['binary', 'zlib'], sizes['binary', None])
+        self.assertLess(sizes['json', None], len(json.dumps(messages)))
+
+    def test_errors(self):
+        with self.assertRaises(ProtocolError):
+            Codec('xml')
+
+        codec = Codec('binary', 'zlib')
+        for frame in (b'', b'\0', b'\0\x63', b'\1garbage', b'\0' + encode_binary({'header': 'submit'})):
+            with self.assertRaises(ProtocolError):
+                codec.decode(frame)
+
+
+class SessionTest(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.addCleanup(setattr, config, 'PROBLEM_DATA_ROOT', config.PROBLEM_DATA_ROOT)
+        config.PROBLEM_DATA_ROOT = os.path.join(os.path.dirname(__file__), 'testdata')
+
+        self.server = JudgeServer(('127.0.0.1', 0), workers=2, queue_size=4)
+        await self.server.start()
+        self.addAsyncCleanup(self.server.close)
+
+    async def connect(self, **hello):
+        reader, writer = await asyncio.open_connection(*self.server.server.sockets[0].getsockname())
+        self.addCleanup(writer.close)
+
+        await send_data(writer, {'header': 'hello', 'version': 2, 'access-token': config.JUDGE_ACCESS_TOKEN, **hello})
+        return reader, writer, await read_data(reader)
+
+    def submission(self, id, source):
+        return {
+            'header': 'submit',
+            'id': id,
+            'problem-code': 'sum',
+            'language': 'python3',
+            'source': source,
+            'time-limit': 1000,
+            'memory-limit': 65536
+        }
+
+    async def test_session(self):
+        reader, writer, hello = await self.connect(encoding='binary', compression='zlib')
+        self.assertEqual(hello, {'header': 'hello', 'version': 2, 'encoding': 'binary', 'compression': 'zlib'})
+        codec = Codec('binary', 'zlib')
+
+        writer.write(codec.encode([
+            self.submission(1, 'print(sum(map(int, input().split())))'),
+            self.submission(2, 'print(0)')
+        ]))
+
+        events = {1: [], 2: []}
+        frames = 0
+        while not all(events[id] and events[id][-1] == 'judging-end' for id in events):
+            frames += 1
+            for message in codec.decode(await read_frame(reader)):
+                events[message['id']].append(message['header'])
+                if message['header'] == 'case-verdict':
+                    self.assertEqual(message['status'], 'AC' if message['id'] == 1 else 'WA')
+
+        for id in events:
+            self.assertEqual(events[id][:3], ['queued', 'judging-begin', 'case-begin'])
+            self.assertEqual(events[id].count('case-verdict'), 8)
+
+        # Events are batched, rather than sent one per frame.
+        self.assertLess(frames, sum(map(len, events.values())))
+
+        # The connection stays open for more requests.
+        writer.write(codec.encode([{'header': 'stats'}]))
+        stats, = codec.decode(await read_frame(reader))
+        self.assertEqual(stats['queue']['live']['scheduled'], 2)
+
+        # Once the client is done, the server finishes up and closes its end.
+        writer.write_eof()
+        self.assertIsNone(await read_frame(reader))
+
+    async def test_authentication(self):
+        _, _, hello = await self.connect(**{'access-token': 'wrong'})
+        self.assertEqual(hello, {'header': 'hello', 'error': 'Authentication failed'})
+
+        _, _, hello = await self.connect(encoding='xml')
+        self.assertIn('error', hello)
+
+
+
+if __name__ == '__main__':
+    from algojudge.comparators import load_comparators
+    from algojudge.runners import load_runners
+
+    load_comparators()
+    load_runners()
+
+    main()
@@ -0,0 +1,212 @@
+from algojudge import config
+from algojudge.sandbox import (CommandDriver, get_pool, Sandbox, SandboxConfig, SandboxError,
+                               SandboxPool, SupervisorDriver, TrustedBox)
+from tempfile import TemporaryDirectory
+from unittest import main, TestCase
+
+import os
+import signal
+import time
+
+
+class SandboxDriverTest(TestCase):
+    def test_drivers(self):
+        conf = SandboxConfig(cpu_time_limit=1000, memory_limit=65536)
+
+        for driver in (CommandDriver(), SupervisorDriver()):
+            self.addCleanup(driver.close)
+
+            with Sandbox('box-driver-test', driver) as box:
+                with open(box.stdin_path, 'w') as f:
+                    f.write('hello')
+
+                result = box.run(['/bin/cat'], conf)
+                self.assertEqual(result.exitcode, 0)
+                self.assertIsNone(result.signal)
+                self.assertFalse(result.is_tle())
+                self.assertEqual(box.stdout(), b'hello')
+
+                result = box.run(['/bin/sh', '-c', 'exit 3'], conf)
+                self.assertEqual(result.exitcode, 3)
+
+                with self.assertRaises(SandboxError):
+                    box.run(['/nonexistent'], conf)
+
+                # The driver can still be used after an error.
+                result = box.run(['/bin/true'], conf)
+                self.assertEqual(result.exitcode, 0)
+
+                # The program can talk over pipes instead of files.
+                stdin_read, stdin_write = os.pipe()
+                stdout_read, stdout_write = os.pipe()
+                proc = box.start(['/bin/cat'], conf, stdout_fd=stdout_write, stdin_fd=stdin_read)
+                os.close(stdin_read)
+                os.close(stdout_write)
+                os.write(stdin_write, b'hello')
+                os.close(stdin_write)
+                with open(stdout_read, 'rb') as f:
+                    self.assertEqual(f.read(), b'hello')
+                self.assertEqual(proc.wait().exitcode, 0)
+
+                # Directories of the host can be bound into the box, read-only.
+                with TemporaryDirectory() as tmp:
+                    os.chmod(tmp, 0o755)
+                    with open(os.path.join(tmp, 'file'), 'w') as f:
+                        f.write('bound')
+
+                    bind_conf = SandboxConfig(cpu_time_limit=1000, memory_limit=65536, binds=[tmp])
+                    result = box.run(['/bin/cat', os.path.join(tmp, 'file')], bind_conf)
+                    self.assertEqual(result.exitcode, 0)
+                    self.assertEqual(box.stdout(), b'bound')
+
+                    result = box.run(['/usr/bin/touch', os.path.join(tmp, 'new')], bind_conf)
+                    self.assertNotEqual(result.exitcode, 0)
+                    self.assertFalse(os.path.exists(os.path.join(tmp, 'new')))
+
+                    # Nor do they stay bound for the next run.
+                    result = box.run(['/bin/cat', os.path.join(tmp, 'file')], conf)
+                    self.assertNotEqual(result.exitcode, 0)
+
+                    with self.assertRaises(SandboxError):
+                        box.run(['/bin/true'], SandboxConfig(binds=['relative']))
+
+    def test_limits(self):
+        driver = SupervisorDriver()
+        self.addCleanup(driver.close)
+
+        with Sandbox('box-limits-test', driver) as box:
+            result = box.run(['/bin/sh', '-c', 'while :; do :; done'], SandboxConfig(cpu_time_limit=200))
+            self.assertTrue(result.is_tle())
+            self.assertGreaterEqual(result.cpu_time_ns, 200 * 10**6)
+
+            result = box.run(['/bin/sleep', '10'], SandboxConfig(real_time_limit=200))
+            self.assertTrue(result.is_tle())
+            self.assertLess(result.real_time_ns, 2 * 10**9)
+
+            result = box.run(['/usr/bin/python3', '-c', 'x = bytearray(1 << 27)'],
+                             SandboxConfig(cpu_time_limit=1000, memory_limit=32768))
+            self.assertTrue(result.is_mle())
+
+            # The program is stopped right away, rather than on the next tick.
+            start = time.monotonic()
+            proc = box.start(['/bin/sleep', '10'], SandboxConfig(real_time_limit=10000))
+            time.sleep(0.1)
+            proc.abort()
+            result = proc.wait()
+            self.assertTrue(result.killed)
+            self.assertLess(time.monotonic() - start, 2)
+
+            # Programs are started by the supervisor, which is then reused.
+            self.assertEqual(len(driver.idle), 1)
+            supervisor = driver.idle[0]
+            result = box.run(['/bin/true'], SandboxConfig())
+            self.assertIs(driver.idle[0], supervisor)
+
+            # Aborting a program that is already done doesn't confuse the
+            # supervisor with the next request.
+            proc = box.start(['/bin/true'], SandboxConfig())
+            time.sleep(0.2)
+            proc.abort()
+            self.assertFalse(proc.wait().killed)
+            result = box.run(['/bin/sh', '-c', 'exit 3'], SandboxConfig())
+            self.assertEqual(result.exitcode, 3)
+
+
+class SandboxPoolTest(TestCase):
+    def test_reuse(self):
+        pool = SandboxPool(min_size=1, max_size=2)
+        self.addCleanup(pool.close)
+
+        pool.fill()
+        self.assertEqual(pool.size, 1)
+
+        with pool.box() as box:
+            with open(box.home_path / 'file', 'w') as f:
+                f.write('hello')
+            result = box.run(['/bin/cat', 'file'], SandboxConfig(cpu_time_limit=1000, memory_limit=65536))
+            self.assertEqual(result.exitcode, 0)
+            self.assertEqual(box.stdout(), b'hello')
+
+        # The same box is handed out again, wiped clean.
+        with pool.box() as other:
+            self.assertIs(other, box)
+            self.assertFalse((other.home_path / 'file').exists())
+            self.assertFalse(other.stdout_path.exists())
+
+    def test_grow_and_shrink(self):
+        pool = SandboxPool(min_size=0, max_size=2, idle_timeout=0)
+        self.addCleanup(pool.close)
+
+        a = pool.checkout()
+        b = pool.checkout()
+        self.assertIsNot(a, b)
+        self.assertEqual(pool.size, 2)
+
+        pool.checkin(a)
+        pool.checkin(b)
+        self.assertEqual(pool.size, 0)
+        self.assertFalse(a.root_path.exists())
+
+    def test_roles(self):
+        old = config.EXECUTION_BACKENDS
+        self.addCleanup(setattr, config, 'EXECUTION_BACKENDS', old)
+        config.EXECUTION_BACKENDS = {**old, 'checker': 'trusted', 'validator': 'trusted'}
+
+        with get_pool('checker').box() as box:
+            self.assertIsInstance(box, TrustedBox)
+        self.assertIs(get_pool('validator'), get_pool('checker'))
+        self.assertIsNot(get_pool('submission'), get_pool('checker'))
+
+        # Compilations never wait for the boxes that cases hold, nor the other
+        # way around.
+        self.assertIsNot(get_pool('submission'), get_pool('compile'))
+
+
+class TrustedBoxTest(TestCase):
+    def test_run(self):
+        conf = SandboxConfig(cpu_time_limit=1000, real_time_limit=2000, memory_limit=65536)
+
+        with TrustedBox('box-trusted-test') as box:
+            with open(box.stdin_path, 'w') as f:
+                f.write('hello')
+
+            result = box.run(['/bin/cat'], conf)
+            self.assertEqual(result.exitcode, 0)
+            self.assertIsNone(result.signal)
+            self.assertFalse(result.is_tle())
+            self.assertGreater(result.memory_kb, 0)
+            self.assertEqual(box.stdout(), b'hello')
+
+            result = box.run(['/bin/sh', '-c', 'echo oops >&2; exit 3'], conf)
+            self.assertEqual(result.exitcode, 3)
+            self.assertEqual(box.stderr(), b'oops\n')
+
+            with self.assertRaises(SandboxError):
+                box.run(['/nonexistent'], conf)
+
+    def test_limits(self):
+        with TrustedBox('box-trusted-limits-test') as box:
+            result = box.run(['/bin/sh', '-c', 'while :; do :; done'], SandboxConfig(cpu_time_limit=200))
+            self.assertTrue(result.is_tle())
+            self.assertGreaterEqual(result.cpu_time_ns, 200 * 10**6)
+
+            # Whatever the program left running is killed along with it.
+            start = time.monotonic()
+            result = box.run(['/bin/sh', '-c', 'sleep 10 & sleep 10'], SandboxConfig(real_time_limit=200))
+            self.assertTrue(result.is_tle())
+            self.assertLess(time.monotonic() - start, 2)
+
+            result = box.run(['/usr/bin/head', '-c', '2048', '/dev/zero'], SandboxConfig(max_fsize=1))
+            self.assertEqual(result.signal, signal.SIGXFSZ)
+
+            proc = box.start(['/bin/sleep', '10'], SandboxConfig(real_time_limit=10000))
+            time.sleep(0.1)
+            proc.abort()
+            result = proc.wait()
+            self.assertTrue(result.killed)
+            self.assertFalse(result.is_tle())
+
+
+
+if __name__ == '__main__':
+    main()
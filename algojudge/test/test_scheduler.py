@@ -0,0 +1,74 @@
+from algojudge.scheduler import PRIORITIES, Scheduler
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase, main
+
+import asyncio
+
+
+def job(name, priority, key):
+    return SimpleNamespace(name=name, priority=PRIORITIES.index(priority), key=key)
+
+
+class SchedulerTest(IsolatedAsyncioTestCase):
+    async def get_all(self, scheduler):
+        names = []
+        while scheduler.qsize():
+            names.append((await scheduler.get()).name)
+        return names
+
+    async def test_priority(self):
+        scheduler = Scheduler(10)
+        scheduler.put_nowait(job('a', 'background', 1))
+        scheduler.put_nowait(job('b', 'rejudge', 1))
+        scheduler.put_nowait(job('c', 'live', 1))
+        scheduler.put_nowait(job('d', 'contest', 1))
+
+        self.assertEqual(await self.get_all(scheduler), ['c', 'd', 'b', 'a'])
+
+    async def test_fairness(self):
+        scheduler = Scheduler(10)
+        for name in ('a1', 'a2', 'a3'):
+            scheduler.put_nowait(job(name, 'live', 'a'))
+        for name in ('b1', 'b2'):
+            scheduler.put_nowait(job(name, 'live', 'b'))
+
+        self.assertEqual(await self.get_all(scheduler), ['a1', 'b1', 'a2', 'b2', 'a3'])
+
+    async def test_preemption(self):
+        scheduler = Scheduler(1)
+        rejudge = job('a', 'rejudge', 1)
+        scheduler.put_nowait(rejudge)
+        self.assertIs(await scheduler.get(), rejudge)
+        self.assertFalse(scheduler.should_preempt(rejudge))
+
+        scheduler.put_nowait(job('b', 'rejudge', 2))
+        self.assertFalse(scheduler.should_preempt(rejudge))
+        self.assertEqual(await self.get_all(scheduler), ['b'])
+
+        scheduler.put_nowait(job('c', 'live', 1))
+        self.assertTrue(scheduler.should_preempt(rejudge))
+        with self.assertRaises(asyncio.QueueFull):
+            scheduler.put_nowait(job('d', 'live', 1))
+
+        # A preempted job goes back to the front of its class, even if it
+        # doesn't fit.
+        scheduler.requeue(rejudge)
+        self.assertEqual(await self.get_all(scheduler), ['c', 'a'])
+
+    async def test_stats(self):
+        scheduler = Scheduler(10)
+        scheduler.put_nowait(job('a', 'live', 1))
+        scheduler.put_nowait(job('b', 'background', 1))
+        await scheduler.get()
+
+        stats = scheduler.stats()
+        self.assertEqual(stats['live']['scheduled'], 1)
+        self.assertEqual(stats['live']['waiting'], 0)
+        self.assertEqual(stats['background']['scheduled'], 0)
+        self.assertEqual(stats['background']['waiting'], 1)
+        self.assertGreaterEqual(stats['live']['max-wait'], stats['live']['mean-wait'])
+
+
+
+if __name__ == '__main__':
+    main()
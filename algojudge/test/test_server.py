@@ -0,0 +1,156 @@
+from algojudge import config, sandbox
+from algojudge.server import JudgeServer, read_data, send_data
+from tempfile import TemporaryDirectory
+from unittest import IsolatedAsyncioTestCase, main
+
+import asyncio
+import json
+import os
+
+
+class JudgeServerTest(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.addCleanup(setattr, config, 'PROBLEM_DATA_ROOT', config.PROBLEM_DATA_ROOT)
+        config.PROBLEM_DATA_ROOT = os.path.join(os.path.dirname(__file__), 'testdata')
+
+        self.server = JudgeServer(('127.0.0.1', 0), workers=1, queue_size=1)
+        await self.server.start()
+        self.addAsyncCleanup(self.server.close)
+
+    async def submit(self, source, problem_code='example', **kwargs):
+        reader, writer = await asyncio.open_connection(*self.server.server.sockets[0].getsockname())
+        self.addCleanup(writer.close)
+
+        await send_data(writer, {
+            'header': 'submit',
+            'access-token': config.JUDGE_ACCESS_TOKEN,
+            'id': 0,
+            'problem-code': problem_code,
+            'language': 'python3',
+            'source': source,
+            'time-limit': 1000,
+            'memory-limit': 65536,
+            **kwargs
+        })
+        return reader
+
+    async def read_all(self, reader):
+        headers = []
+        while (data := await read_data(reader)) is not None:
+            headers.append(data['header'])
+        return headers
+
+    async def read_until_end(self, reader):
+        await self.read_all(reader)
+        return asyncio.get_running_loop().time()
+
+    async def test_queue(self):
+        first = await self.submit('import time; time.sleep(0.5)')
+        self.assertEqual(await read_data(first), {'header': 'queued', 'position': 1})
+        self.assertEqual((await read_data(first))['header'], 'judging-begin')
+
+        # The only worker is busy with the first submission, so the second one
+        # waits in the queue, leaving no room for the third.
+        second = await self.submit('print(sum(map(int, input().split())))')
+        self.assertEqual(await read_data(second), {'header': 'queued', 'position': 1})
+
+        third = await self.submit('print(0)')
+        self.assertEqual(await self.read_all(third), ['busy'])
+
+        self.assertEqual((await self.read_all(first))[-1], 'judging-end')
+        self.assertEqual(await self.read_all(second),
+                         ['judging-begin', 'case-begin', 'case-verdict', 'case-end', 'judging-end'])
+
+    async def test_preemption(self):
+        self.addCleanup(setattr, config, 'CASE_WORKERS', config.CASE_WORKERS)
+        config.CASE_WORKERS = 1
+
+        rejudge = await self.submit('import time; time.sleep(0.2)', 'sum', priority='rejudge')
+        self.assertEqual((await read_data(rejudge))['header'], 'queued')
+        self.assertEqual((await read_data(rejudge))['header'], 'judging-begin')
+
+        live = await self.submit('print(0)', priority='live')
+        self.assertEqual((await read_data(live))['header'], 'queued')
+
+        # The live submission is judged as soon as the rejudge's current case is
+        # done, rather than waiting for all of its cases.
+        rejudge_end, live_end = await asyncio.gather(self.read_until_end(rejudge), self.read_until_end(live))
+        self.assertLess(live_end, rejudge_end)
+
+        reader, writer = await asyncio.open_connection(*self.server.server.sockets[0].getsockname())
+        self.addCleanup(writer.close)
+        await send_data(writer, {'header': 'stats', 'access-token': config.JUDGE_ACCESS_TOKEN})
+        stats = await read_data(reader)
+        self.assertEqual(stats['queue']['live']['scheduled'], 1)
+        self.assertEqual(stats['queue']['rejudge']['scheduled'], 2)
+
+    async def test_preemption_with_bounded_pools(self):
+        for name in ('CASE_WORKERS', 'SANDBOX_POOL_MAX_SIZE', 'JUDGE_WORKERS'):
+            self.addCleanup(setattr, config, name, getattr(config, name))
+        config.CASE_WORKERS = 1
+        config.SANDBOX_POOL_MAX_SIZE = 1
+        config.JUDGE_WORKERS = 1
+
+        # The pools are created on first use, so the test gets bounded ones of
+        # its own.
+        self.addCleanup(setattr, sandbox, '_pools', sandbox._pools)
+        sandbox._pools = {}
+        self.addCleanup(lambda: [pool.close() for pool in sandbox._pools.values()])
+
+        rejudge = await self.submit('import time; time.sleep(0.2)', 'sum', priority='rejudge')
+        self.assertEqual((await read_data(rejudge))['header'], 'queued')
+        self.assertEqual((await read_data(rejudge))['header'], 'judging-begin')
+
+        live = await self.submit('print(0)', priority='live')
+        self.assertEqual((await read_data(live))['header'], 'queued')
+
+        # The paused rejudge doesn't hold on to the only compile box, which the
+        # live submission needs on the same worker.
+        self.assertEqual((await asyncio.wait_for(self.read_all(live), 60))[-1], 'judging-end')
+        self.assertEqual((await asyncio.wait_for(self.read_all(rejudge), 60))[-1], 'judging-end')
+
+    async def test_preemption_pauses_cases(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for name in ('CASE_WORKERS', 'TRACE_PATH', 'TRACE_SAMPLE_RATE'):
+            self.addCleanup(setattr, config, name, getattr(config, name))
+        config.CASE_WORKERS = 2
+        config.TRACE_PATH = os.path.join(tmp.name, 'traces.jsonl')
+        config.TRACE_SAMPLE_RATE = 1.0
+
+        rejudge = await self.submit('import time; time.sleep(0.2)', 'sum', id=1, priority='rejudge')
+        self.assertEqual((await read_data(rejudge))['header'], 'queued')
+        self.assertEqual((await read_data(rejudge))['header'], 'judging-begin')
+
+        live = await self.submit('print(0)', id=2, priority='live')
+        self.assertEqual((await read_data(live))['header'], 'queued')
+        await asyncio.gather(self.read_all(rejudge), self.read_all(live))
+
+        # Spans by submission, in seconds since the epoch.
+        spans = {}
+        with open(config.TRACE_PATH) as f:
+            for trace in map(json.loads, f):
+                start = trace['otherData']['start-time']
+                spans[trace['otherData']['id']] = [
+                    (event['name'], start + event['ts'] / 1e6, start + (event['ts'] + event['dur']) / 1e6)
+                    for event in trace['traceEvents'] if event['ph'] == 'X'
+                ]
+
+        # None of the cases the rejudge had in flight when it was preempted, nor
+        # those it was fetching, run while the live submission is judged.
+        (_, live_start, live_end), = (span for span in spans[2] if span[0] == 'judge')
+        cases = [span for span in spans[1] if span[0] in ('case', 'prefetch')]
+        self.assertEqual(sum(name == 'case' for name, _, _ in cases), 8)
+        for name, start, end in cases:
+            self.assertTrue(end <= live_start or start >= live_end, (name, start, end, live_start, live_end))
+
+
+
+if __name__ == '__main__':
+    from algojudge.comparators import load_comparators
+    from algojudge.runners import load_runners
+
+    load_comparators()
+    load_runners()
+
+    main()
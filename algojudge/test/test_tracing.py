@@ -0,0 +1,89 @@
+from algojudge import config, tracing
+from algojudge.judge import Judge, Submission
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import main, TestCase
+
+import json
+import os
+
+
+class TracingTest(TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / 'traces.jsonl'
+
+        for name in ('PROBLEM_DATA_ROOT', 'TRACE_PATH', 'TRACE_SAMPLE_RATE', 'TRACE_MAX_SIZE', 'CASE_WORKERS'):
+            self.addCleanup(setattr, config, name, getattr(config, name))
+
+        config.PROBLEM_DATA_ROOT = os.path.join(os.path.dirname(__file__), 'testdata')
+        config.TRACE_PATH = str(self.path)
+        config.TRACE_SAMPLE_RATE = 1.0
+        config.CASE_WORKERS = 2
+
+    def judge(self):
+        submission = Submission(
+            id=42,
+            problem_code='sum',
+            language='python3',
+            source=b'print(sum(map(int, input().split())))',
+            time_limit=1000,
+            memory_limit=65536
+        )
+        return list(Judge().judge(submission))
+
+    def read_traces(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_trace(self):
+        self.judge()
+
+        trace, = self.read_traces()
+        self.assertEqual(trace['otherData']['id'], 42)
+
+        spans = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+        names = [span['name'] for span in spans]
+        for name in ('judge', 'load-problem', 'prepare', 'input', 'run', 'compare'):
+            self.assertIn(name, names)
+
+        # Cases run on the worker threads, and each one's runs are nested in it.
+        cases = [span for span in spans if span['name'] == 'case']
+        self.assertEqual(sorted(case['args']['num'] for case in cases), list(range(1, 9)))
+
+        judge, = (span for span in spans if span['name'] == 'judge')
+        self.assertTrue(all(case['tid'] != judge['tid'] for case in cases))
+
+        for run in (span for span in spans if span['name'] == 'run'):
+            self.assertTrue(any(case['tid'] == run['tid'] and
+                                case['ts'] <= run['ts'] <= run['ts'] + run['dur'] <= case['ts'] + case['dur']
+                                for case in cases))
+
+    def test_sampling(self):
+        config.TRACE_SAMPLE_RATE = 0.0
+        self.judge()
+        self.assertFalse(self.path.exists() and self.path.read_text())
+
+        # Spans outside of a traced submission are ignored.
+        with tracing.span('nothing'):
+            pass
+
+    def test_rotation(self):
+        config.TRACE_MAX_SIZE = 1024
+        self.judge()
+        self.judge()
+
+        self.assertTrue(self.path.with_name(self.path.name + '.1').exists())
+        self.assertEqual(len(self.read_traces()), 1)
+
+
+
+if __name__ == '__main__':
+    from algojudge.comparators import load_comparators
+    from algojudge.runners import load_runners
+
+    load_comparators()
+    load_runners()
+
+    main()
@@ -0,0 +1,117 @@
+from algojudge import config, warmup
+from algojudge.judge import Judge, Submission
+from algojudge.runners.base import Runner
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import main, TestCase
+
+import os
+
+
+class FakeRunner(Runner, register=False):
+    # Starts a lot faster with its accelerator, which is a file that it reads.
+    code = 'fake'
+    warmup_probe = ()
+
+    @classmethod
+    def build_warmup(cls, path):
+        (path / 'accelerator').write_text('warm')
+
+    @classmethod
+    def get_warmup_args(cls, path):
+        if path is None:
+            return ['/usr/bin/python3', '-c', 'sum(range(3 * 10**6))']
+        return ['/bin/cat', str(path / 'accelerator')]
+
+    def get_execute_args(self):
+        return self.get_warmup_args(self.warmup_path)
+
+
+class SlowRunner(FakeRunner, register=False):
+    # Starts slower with its accelerator.
+    code = 'slow'
+
+    @classmethod
+    def get_warmup_args(cls, path):
+        if path is None:
+            return ['/bin/true']
+        return ['/usr/bin/python3', '-c', 'sum(range(3 * 10**6))']
+
+
+class WarmupTest(TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+
+        self.addCleanup(setattr, config, 'WARMUP_ROOT', config.WARMUP_ROOT)
+        config.WARMUP_ROOT = str(self.tmp / 'warmup')
+
+        # A toolchain that can be "upgraded" by touching its binary.
+        self.binary = self.tmp / 'compiler'
+        self.binary.write_text('')
+        for cls in (FakeRunner, SlowRunner):
+            cls.warmup_binary = str(self.binary)
+
+    def test_build(self):
+        self.assertIsNone(warmup.get_path(FakeRunner))
+
+        result = warmup.build(FakeRunner)
+        self.assertIsNotNone(result.path)
+        self.assertLess(result.warm_ns, result.cold_ns)
+        self.assertEqual(warmup.get_path(FakeRunner), result.path)
+        self.assertEqual((result.path / 'accelerator').read_text(), 'warm')
+
+        # They're only built once for the same toolchain.
+        self.assertEqual(warmup.build(FakeRunner), (result.path, None, None))
+
+        # A new version of the toolchain needs new ones, which replace the old.
+        os.utime(self.binary, ns=(0, 0))
+        self.assertIsNone(warmup.get_path(FakeRunner))
+        new_path = warmup.build(FakeRunner).path
+        self.assertNotEqual(new_path, result.path)
+        self.assertEqual(os.listdir(new_path.parent), [new_path.name])
+
+        config.WARMUP_ROOT = None
+        self.assertIsNone(warmup.get_path(FakeRunner))
+
+    def test_no_gain(self):
+        result = warmup.build(SlowRunner)
+        self.assertIsNone(result.path)
+        self.assertIsNone(warmup.get_path(SlowRunner))
+        self.assertEqual(os.listdir(self.tmp / 'warmup' / 'slow'), [])
+
+    def test_python(self):
+        from algojudge.runners import RUNNERS
+
+        # Whether they're worth it depends on the host, so they're built in
+        # place of `warmup.build()`.
+        runner = RUNNERS['python3']
+        path = Path(config.WARMUP_ROOT) / 'python3' / warmup.toolchain_version(runner.warmup_binary)
+        path.mkdir(parents=True)
+        runner.build_warmup(path)
+        self.assertTrue(any((path / 'pycache').rglob('collections/__init__.*.pyc')))
+
+        self.addCleanup(setattr, config, 'PROBLEM_DATA_ROOT', config.PROBLEM_DATA_ROOT)
+        config.PROBLEM_DATA_ROOT = os.path.join(os.path.dirname(__file__), 'testdata')
+        submission = Submission(
+            id=0,
+            problem_code='example',
+            language='python3',
+            # Only adds up the numbers if it can see the precompiled modules.
+            source=b'import os, sys; os.listdir(sys.pycache_prefix); print(sum(map(int, input().split())))',
+            time_limit=1000,
+            memory_limit=65536
+        )
+        result = list(Judge().judge(submission))
+        self.assertEqual(result[1][1]['status'], 'AC')
+
+
+if __name__ == '__main__':
+    from algojudge.comparators import load_comparators
+    from algojudge.runners import load_runners
+
+    load_comparators()
+    load_runners()
+
+    main()
@@ -0,0 +1,138 @@
+from algojudge import config
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from logging.handlers import RotatingFileHandler
+from threading import current_thread, Lock
+
+import json
+import logging
+import os
+import random
+import time
+
+
+# The trace of the submission being judged in the current context, if any.
+_current = ContextVar('trace', default=None)
+
+
+class Trace:
+    """The timeline of judging a single submission, made up of spans.
+
+    Spans are recorded as "complete" events of the Chrome trace event format,
+    so the viewer nests them by time on each thread; cases that run in
+    parallel show up as separate tracks. Code that runs in another thread only
+    ends up in the trace if the thread runs in a copy of the context (see
+    `CaseExecutor`)."""
+
+    def __init__(self, name, **args):
+        self.name = name
+        self.args = args
+        self.lock = Lock()
+        self.events = []
+        self.threads = {}
+        self.start_time = time.time()
+        self.start_ns = time.perf_counter_ns()
+
+    def add(self, name, start_ns, end_ns, args):
+        thread = current_thread()
+        event = {
+            'name': name,
+            'cat': 'algojudge',
+            'ph': 'X',
+            'ts': (start_ns - self.start_ns) / 1000,
+            'dur': (end_ns - start_ns) / 1000,
+            'pid': os.getpid(),
+            'tid': thread.ident,
+            'args': args
+        }
+        with self.lock:
+            self.events.append(event)
+            self.threads[thread.ident] = thread.name
+
+    def wrap(self, generator):
+        """Runs the generator with this trace as the current one. Each step
+        runs in the same context, even if the steps run in different threads
+        (as they do when a submission is preempted)."""
+        context = copy_context()
+        context.run(_current.set, self)
+
+        try:
+            while True:
+                try:
+                    item = context.run(next, generator)
+                except StopIteration:
+                    return
+                yield item
+        finally:
+            context.run(generator.close)
+            self.write()
+
+    def to_json(self):
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+
+        pid = os.getpid()
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': self.name}}]
+        metadata += [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+            for tid, name in threads.items()
+        ]
+
+        return {
+            'traceEvents': metadata + events,
+            'displayTimeUnit': 'ms',
+            'otherData': {**self.args, 'start-time': self.start_time}
+        }
+
+    def write(self):
+        _get_logger().info(json.dumps(self.to_json(), separators=(',', ':')))
+
+
+def start(name, **args):
+    """Returns a new trace if this one is sampled (see `config.TRACE_SAMPLE_RATE`),
+    or `None` otherwise."""
+    if config.TRACE_PATH is None or random.random() >= config.TRACE_SAMPLE_RATE:
+        return None
+    return Trace(name, **args)
+
+@contextmanager
+def span(name, **args):
+    """Records the block as a span of the current trace. Does nothing (and costs
+    next to nothing) when the submission isn't being traced."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+
+    start_ns = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        trace.add(name, start_ns, time.perf_counter_ns(), args)
+
+
+_logger = logging.getLogger('algojudge.trace')
+_logger.setLevel(logging.INFO)
+_logger.propagate = False
+
+_handler = None
+_handler_lock = Lock()
+
+def _get_logger():
+    # Traces go to a logger of their own, which writes one trace per line and
+    # rotates the file once it's too large.
+    global _handler
+
+    with _handler_lock:
+        if _handler is None or _handler.baseFilename != os.path.abspath(config.TRACE_PATH):
+            if _handler is not None:
+                _logger.removeHandler(_handler)
+                _handler.close()
+
+            os.makedirs(os.path.dirname(os.path.abspath(config.TRACE_PATH)), exist_ok=True)
+            _handler = RotatingFileHandler(config.TRACE_PATH, maxBytes=config.TRACE_MAX_SIZE,
+                                           backupCount=config.TRACE_BACKUP_COUNT)
+            _handler.setFormatter(logging.Formatter('%(message)s'))
+            _logger.addHandler(_handler)
+        return _logger
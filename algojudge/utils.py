@@ -13,3 +13,39 @@ def copy(src, dst):
 # Normalize text with UNIX-style line endings (`\n`).
 def normalize_lines(text):
     return text.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+
+# A file-like wrapper that reports EOF once `limit` bytes have been read.
+class LimitedReader:
+    def __init__(self, fobj, limit):
+        self.fobj = fobj
+        self.remaining = limit
+        self.exceeded = False
+        self.eof = False
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining + 1
+
+        data = self.fobj.read(size)
+        if not data:
+            self.eof = True
+        elif len(data) > self.remaining:
+            self.exceeded = True
+            data = data[:self.remaining]
+
+        self.remaining -= len(data)
+        return data
+
+    def readinto(self, b):
+        view = memoryview(b).cast('B')[:self.remaining + 1]
+
+        n = self.fobj.readinto(view) or 0
+        if not n:
+            self.eof = True
+        elif n > self.remaining:
+            self.exceeded = True
+            n = self.remaining
+
+        self.remaining -= n
+        return n
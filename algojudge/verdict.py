@@ -12,6 +12,8 @@ class Status(IntFlag):
     IE = auto()
     Q = auto()
     J = auto()
+    SK = auto()
+    PA = auto()
 
 
 class Verdict:
@@ -22,7 +24,9 @@ class Verdict:
         message=None,
         cpu_time=None,
         real_time=None,
-        memory=None
+        memory=None,
+        points=None,
+        startup_time=None
     ):
         self.case = case
         self.status = status
@@ -30,15 +34,22 @@ class Verdict:
         self.cpu_time = cpu_time
         self.real_time = real_time
         self.memory = memory
+        # The fraction of the case's points scored, if it was partially accepted.
+        self.points = points
+        # The time the language typically takes to start, as calibrated.
+        self.startup_time = startup_time
 
     def to_json(self):
         return {
             'case-num': self.case.num,
+            'batch': self.case.batch,
             'input': self.case.infile,
             'output': self.case.outfile,
             'status': self.status.name,
             'message': self.message,
             'cpu-time': self.cpu_time,
             'real-time': self.real_time,
-            'memory': self.memory
+            'memory': self.memory,
+            'points': self.points,
+            'startup-time': self.startup_time
         }
@@ -0,0 +1,165 @@
+from algojudge import config
+from algojudge.sandbox import SandboxConfig, SandboxError, get_pool
+from pathlib import Path
+from shutil import rmtree
+from subprocess import SubprocessError
+from typing import NamedTuple, Optional
+
+import argparse
+import hashlib
+import os
+import statistics
+import sys
+import uuid
+
+
+# How many times a program is started with and without the accelerators to
+# tell whether they're worth it.
+PROBE_RUNS = 15
+
+# How much faster programs must start with the accelerators for them to be
+# kept, so that noise doesn't decide.
+MIN_GAIN = 0.05
+
+
+class WarmupError(Exception):
+    pass
+
+
+class WarmupResult(NamedTuple):
+    # Where the accelerators were built to, or `None` if they were left out.
+    path: Optional[Path]
+    # The median cpu time of starting a program, without and with them.
+    cold_ns: int
+    warm_ns: int
+
+
+def toolchain_version(binary):
+    """Identifies the installed version of a toolchain by its binary."""
+    path = os.path.realpath(binary)
+    st = os.stat(path)
+    return hashlib.sha256(f'{path}\0{st.st_size}\0{st.st_mtime_ns}'.encode()).hexdigest()[:16]
+
+def get_path(runner):
+    """Returns the directory of the accelerators of the runner's language, or
+    `None` if none were built for the installed toolchain."""
+    if runner.warmup_binary is None or config.WARMUP_ROOT is None:
+        return None
+
+    try:
+        path = Path(config.WARMUP_ROOT) / runner.code / toolchain_version(runner.warmup_binary)
+    except OSError:
+        return None
+    return path if path.is_dir() else None
+
+def startup_time(runner, path):
+    """Returns the median cpu time of starting the runner's probe program in a
+    box, with the accelerators in `path` or without any if it's `None`."""
+    conf = SandboxConfig(
+        cpu_time_limit=10000,
+        real_time_limit=20000,
+        memory_limit=1048576,
+        max_pids=runner.max_pids,
+        binds=() if path is None else (str(path),)
+    )
+    command = [*runner.get_warmup_args(path), *runner.warmup_probe]
+
+    times = []
+    with get_pool('submission').box() as box:
+        for _ in range(PROBE_RUNS):
+            result = box.run(command, conf)
+            if result.exitcode != 0:
+                raise WarmupError(f'{command[0]} exited with {result.exitcode}: {box.stderr()!r}')
+            times.append(result.cpu_time_ns)
+    return statistics.median(times)
+
+def build(runner, force=False):
+    """Builds the startup accelerators of the runner's language (e.g. an archive
+    of the JDK's classes that the JVM maps instead of loading them one by one)
+    for the installed toolchain, unless they were already built.
+
+    The accelerators are kept only if programs start faster with them. They're
+    mounted read-only into the boxes of the language's programs. A new version
+    of the toolchain needs new accelerators, so they should be rebuilt after
+    upgrading it, and the judges restarted, since their checkers and
+    interactors keep the arguments they were compiled with."""
+    root = Path(config.WARMUP_ROOT) / runner.code
+    path = root / toolchain_version(runner.warmup_binary)
+    if path.is_dir() and not force:
+        return WarmupResult(path, None, None)
+
+    # Like the other caches, the accelerators are renamed into place so that
+    # they appear all at once.
+    tmp_path = root / f'.{path.name}.{uuid.uuid4().hex}'
+    tmp_path.mkdir(parents=True)
+    try:
+        runner.build_warmup(tmp_path)
+        # The programs that use them run as another user.
+        os.chmod(tmp_path, 0o755)
+
+        cold_ns, warm_ns = startup_time(runner, None), startup_time(runner, tmp_path)
+        if warm_ns < cold_ns * (1 - MIN_GAIN):
+            rmtree(path, ignore_errors=True)
+            os.rename(tmp_path, path)
+        else:
+            path = None
+    finally:
+        rmtree(tmp_path, ignore_errors=True)
+
+    # The accelerators of other versions of the toolchain are of no use
+    # anymore, nor are ones that turned out not to help.
+    for entry in os.scandir(root):
+        if not entry.name.startswith('.') and (path is None or entry.name != path.name):
+            rmtree(entry.path, ignore_errors=True)
+
+    return WarmupResult(path, cold_ns, warm_ns)
+
+
+def main():
+    from algojudge.runners import load_runners, RUNNERS
+
+    load_runners()
+    languages = [code for code, runner in RUNNERS.items() if runner.warmup_binary is not None]
+
+    parser = argparse.ArgumentParser(description='Builds the startup accelerators of languages for the '
+                                                 'toolchains installed on this host.')
+    parser.add_argument('languages', nargs='*', metavar='language',
+                        help=f'the languages to build them for (default: all of {", ".join(languages)})')
+    parser.add_argument('--force', action='store_true', help='rebuild them even if they are up to date')
+    args = parser.parse_args()
+
+    if config.WARMUP_ROOT is None:
+        parser.error('WARMUP_ROOT is not set')
+    unknown = set(args.languages) - set(languages)
+    if unknown:
+        parser.error(f'no accelerators for {", ".join(sorted(unknown))}')
+
+    failed = False
+    for code in args.languages or languages:
+        try:
+            result = build(RUNNERS[code], args.force)
+        except (OSError, SandboxError, SubprocessError, WarmupError) as e:
+            print(f'{code}: failed: {str(e).strip()}')
+            failed = True
+            continue
+
+        if result.cold_ns is None:
+            print(f'{code}: up to date in {result.path}')
+            continue
+
+        times = f'starts in {result.warm_ns / 1e6:.1f} ms instead of {result.cold_ns / 1e6:.1f} ms'
+        if result.path is not None:
+            print(f'{code}: built in {result.path}, {times}')
+        else:
+            print(f'{code}: left out, {times}')
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    if os.geteuid() != 0:
+        print('You must have root permissions to build the accelerators!')
+        raise SystemExit(1)
+
+    main()
@@ -0,0 +1,94 @@
+cdef class BufferedReader:
+    cdef fobj
+    cdef bytes buf
+    cdef int ip, iend
+    cdef long long base
+
+    def __init__(self, fobj):
+        self.fobj = fobj
+        self.ip = self.iend = 0
+        self.base = 0
+
+    cdef int getchar(self):
+        if self.ip == self.iend:
+            self.buf = self.fobj.read(65536)
+            if not self.buf:
+                return -1
+            self.base += self.iend
+            self.iend = len(self.buf)
+            self.ip = 0
+        cdef int ch = self.buf[self.ip]
+        self.ip += 1
+        return ch
+
+    # Returns the offset of the next byte in the stream.
+    cdef long long tell(self):
+        return self.base + self.ip
+
+cdef int isspace(c):
+    return c == 9 or c == 32
+
+def compare_identical(fa, fb):
+    return mismatch_identical(fa, fb) < 0
+
+# Returns the offset in `fa` of the first byte that differs from `fb`, or -1 if
+# the streams are identical. Stops reading as soon as a difference is found.
+def mismatch_identical(fa, fb):
+    cdef BufferedReader ra = BufferedReader(fa)
+    cdef BufferedReader rb = BufferedReader(fb)
+    cdef int a, b
+
+    while True:
+        a = ra.getchar()
+        b = rb.getchar()
+        if a != b:
+            return ra.tell() - (a != -1)
+        if a == -1:
+            return -1
+
+# Checks whether two streams are "eye-identical". In other words, whether they
+# are indistinguishable in an editor which does not show trailing whitespace.
+# Non-UNIX newlines such as `\r\n` or `\r` are not supported.
+def compare_standard(fa, fb):
+    return mismatch_standard(fa, fb) < 0
+
+# Like `mismatch_identical`, but for `compare_standard`.
+def mismatch_standard(fa, fb):
+    cdef BufferedReader ra = BufferedReader(fa)
+    cdef BufferedReader rb = BufferedReader(fb)
+    cdef int a, b, sa, sb
+
+    while True:
+        a = ra.getchar()
+        b = rb.getchar()
+
+        # Continue reading each stream until we hit a non-space character,
+        # keeping track of the number of consecutive spaces read.
+        sa = sb = 0
+        while isspace(a):
+            a = ra.getchar()
+            sa += 1
+        while isspace(b):
+            b = rb.getchar()
+            sb += 1
+
+        # If one stream reaches EOF, so should the other stream, minus
+        # any trailing whitspace.
+        if a == -1:
+            while isspace(b) or b == 10:
+                b = rb.getchar()
+            return -1 if b == -1 else ra.tell()
+        if b == -1:
+            while isspace(a) or a == 10:
+                a = ra.getchar()
+            return -1 if a == -1 else ra.tell() - 1
+
+        # After skipping the spaces, the next pair of bytes must be
+        # identical. Also, the number of spaces skipped must be the same for
+        # both streams. The only exception to this rule is if both bytes are
+        # newlines, which is OK because trailing whitespace doesn't matter.
+        if a != b or (sa != sb and a != 10):
+            # If the runs of spaces differ, the difference starts within them.
+            return ra.tell() - 1 - sa + min(sa, sb)
+
+    return -1
@@ -0,0 +1,62 @@
+# Measures the throughput of the comparators against the previous
+# implementation in `_compare_legacy.pyx`, which is compiled on the fly.
+#
+# Usage: python benchmarks/compare.py [size in MiB]
+
+from algojudge.comparators import _compare
+from algojudge.utils import LimitedReader
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pyximport
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).parent))
+pyximport.install(language_level=3)
+
+import _compare_legacy
+
+
+def generate(path, size):
+    rng = random.Random(0)
+    line = ' '.join(str(rng.randrange(10**9)) for _ in range(10)).encode() + b'\n'
+    with open(path, 'wb') as f:
+        f.write(line * (size // len(line)))
+
+def measure(compare, path_a, path_b, streamed):
+    with open(path_a, 'rb') as fa, open(path_b, 'rb') as fb:
+        # Submission output is read from a pipe when streamed, which rules out
+        # mapping it.
+        if streamed:
+            fa = LimitedReader(fa, 1 << 62)
+
+        start = time.perf_counter()
+        assert compare(fa, fb)
+        return time.perf_counter() - start
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+
+    with TemporaryDirectory() as tmp:
+        path_a = Path(tmp) / 'a'
+        path_b = Path(tmp) / 'b'
+        generate(path_a, size << 20)
+        generate(path_b, size << 20)
+
+        for name in ('identical', 'standard'):
+            for streamed in (False, True):
+                results = []
+                for module in (_compare_legacy, _compare):
+                    compare = getattr(module, f'compare_{name}')
+                    elapsed = min(measure(compare, path_a, path_b, streamed) for _ in range(3))
+                    results.append(size / elapsed)
+
+                source = 'stream' if streamed else 'file'
+                print(f'{name:>9} {source:>6}: {results[0]:8.1f} MiB/s -> {results[1]:8.1f} MiB/s '
+                      f'({results[1] / results[0]:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
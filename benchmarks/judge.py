@@ -0,0 +1,344 @@
+# Measures the throughput of the whole judge on synthetic problems: many tiny
+# cases, a few huge cases, huge outputs, and a submission that is slow to
+# compile. Reports submissions/s, the latency percentiles of each stage (taken
+# from the judge's traces) and peak memory usage, and compares them against a
+# stored baseline.
+#
+# Usage: python benchmarks/judge.py [--backend stub|sandbox] [--workload NAME]...
+#                                   [--baseline PATH] [--save-baseline PATH]
+#                                   [--threshold FRACTION] [--submissions N]
+#
+# The `stub` backend fakes every run (see `StubDriver`), which measures the
+# overhead of the judge itself and doesn't need root. The `sandbox` backend runs
+# the submissions for real.
+#
+# The stored baseline, `judge-baseline.json`, holds results of both backends.
+# Save new ones with e.g. `--save-baseline benchmarks/judge-baseline.json`
+# after a deliberate change in performance, or on a different host.
+
+from algojudge import config
+from algojudge.judge import Judge, Submission
+from algojudge.sandbox import SandboxDriver, SandboxResult, set_driver
+from pathlib import Path
+from shutil import rmtree
+from tempfile import TemporaryDirectory
+from threading import Thread
+from typing import Callable, NamedTuple
+from zipfile import ZipFile
+
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+
+# The stages reported for each workload, as named by their trace spans.
+STAGES = ('prepare', 'prefetch', 'case', 'box-checkout', 'input', 'run', 'compare', 'box-reset')
+
+# How much worse than the baseline a workload's throughput may get before it's
+# reported as a regression, by default.
+REGRESSION_THRESHOLD = 0.10
+
+
+class Workload(NamedTuple):
+    name: str
+    language: str
+    source: bytes
+    # The input of each case, and the expected output for an input.
+    inputs: Callable[[random.Random], list]
+    solve: Callable[[bytes], bytes]
+    submissions: int
+
+
+def _sum_lines(data):
+    return b''.join(b'%d\n' % sum(map(int, line.split())) for line in data.splitlines())
+
+def _count_up(data):
+    return b''.join(b'%d\n' % i for i in range(int(data)))
+
+def _numbers(rng, count):
+    return ' '.join(str(rng.randrange(10**9)) for _ in range(count)).encode() + b'\n'
+
+# A C++ program that takes a while to compile, for its templates rather than
+# its size.
+HEAVY_SOURCE = b'''
+#include <bits/stdc++.h>
+using namespace std;
+
+template<int N> struct Fib { static constexpr long long value = Fib<N - 1>::value + Fib<N - 2>::value; };
+template<> struct Fib<1> { static constexpr long long value = 1; };
+template<> struct Fib<0> { static constexpr long long value = 0; };
+
+template<int... Is> long long table(integer_sequence<int, Is...>) { return (Fib<Is>::value + ...); }
+
+int main() {
+    map<string, vector<tuple<int, long long, string>>> m;
+    m["x"].emplace_back(1, table(make_integer_sequence<int, 90>()), "y");
+    long long a, b;
+    while (cin >> a >> b) cout << a + b << '\\n';
+}
+'''
+
+WORKLOADS = (
+    Workload(
+        name='tiny-cases',
+        language='python3',
+        source=b'import sys\nfor line in sys.stdin: print(sum(map(int, line.split())))',
+        inputs=lambda rng: [_numbers(rng, 2) for _ in range(400)],
+        solve=_sum_lines,
+        submissions=3
+    ),
+    Workload(
+        name='huge-cases',
+        language='python3',
+        source=b'import sys\nfor line in sys.stdin: print(sum(map(int, line.split())))',
+        inputs=lambda rng: [_numbers(rng, 10**6) for _ in range(4)],
+        solve=_sum_lines,
+        submissions=3
+    ),
+    Workload(
+        name='huge-output',
+        language='python3',
+        source=b'import sys\nsys.stdout.write("".join(f"{i}\\n" for i in range(int(input()))))',
+        inputs=lambda rng: [b'%d\n' % (10**6 + i) for i in range(4)],
+        solve=_count_up,
+        submissions=3
+    ),
+    Workload(
+        name='compile-heavy',
+        language='cpp',
+        source=HEAVY_SOURCE,
+        inputs=lambda rng: [_numbers(rng, 2) for _ in range(4)],
+        solve=_sum_lines,
+        submissions=3
+    ),
+)
+
+
+class StubDriver(SandboxDriver):
+    """Pretends to run programs without a sandbox, so that the rest of the judge
+    can be measured on its own. Every run takes no time and produces the
+    output that `answers` maps its input to. A run without any input is taken
+    to be a compilation, which always succeeds and leaves behind the files
+    that the runners expect (`main` and `main.pyc`)."""
+
+    RESULT = SandboxResult(cpu_time_ns=10**6, real_time_ns=10**6, memory_kb=1024, timeout=0,
+                           oom_kill=0, exitcode=0, signal=-1)
+
+    def __init__(self):
+        self.answers = {}
+
+    def init(self, box):
+        box.home_path.mkdir(parents=True, exist_ok=True)
+
+    def run(self, box, command, conf):
+        if not box.stdin_path.exists():
+            for name in ('main', 'main.pyc'):
+                (box.home_path / name).write_bytes(b'')
+            box.stdout_path.write_bytes(b'')
+            box.stderr_path.write_bytes(b'')
+        else:
+            box.stdout_path.write_bytes(self.answers[box.stdin_path.read_bytes()])
+        return self.RESULT
+
+    def start(self, box, command, conf, stdout_fd=None, stdin_fd=None):
+        return _StubProcess(self.answers[box.stdin_path.read_bytes()], os.dup(stdout_fd))
+
+    def delete(self, box):
+        rmtree(box.root_path, ignore_errors=True)
+
+
+class _StubProcess:
+    # Writes the output from a thread, like a program would, so that the reader
+    # can keep up with outputs larger than the pipe.
+    def __init__(self, output, fd):
+        self.aborted = False
+        self.thread = Thread(target=self._write, args=(output, fd))
+        self.thread.start()
+
+    def _write(self, output, fd):
+        try:
+            view = memoryview(output)
+            while view and not self.aborted:
+                view = view[os.write(fd, view[:1 << 16]):]
+        except BrokenPipeError:
+            pass
+        finally:
+            os.close(fd)
+
+    def abort(self):
+        self.aborted = True
+
+    def wait(self):
+        self.thread.join()
+        return SandboxResult(**{**StubDriver.RESULT.to_json(), 'killed': self.aborted})
+
+
+def make_problem(root, workload):
+    """Writes the problem of the workload to `root`, in the format of
+    `PROBLEM_DATA_ROOT`. Returns the expected output for each input."""
+    problem_path = root / workload.name
+    problem_path.mkdir(parents=True)
+
+    rng = random.Random(0)
+    answers = {data: workload.solve(data) for data in workload.inputs(rng)}
+    with ZipFile(problem_path / 'data.zip', 'w') as archive:
+        for num, (data, answer) in enumerate(answers.items(), 1):
+            archive.writestr(f'{num}.in', data)
+            archive.writestr(f'{num}.out', answer)
+
+    cases = ''.join(f'  - {{ in: {num}.in, out: {num}.out }}\n' for num in range(1, len(answers) + 1))
+    (problem_path / 'config.yml').write_text(f'archive: data.zip\ncases:\n{cases}')
+    return answers
+
+def peak_memory_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def reset_peak_memory():
+    # Only Linux can reset the peak, otherwise it's the peak of the whole run.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def run_workload(workload, stub, answers, trace_path):
+    if stub is not None:
+        stub.answers = answers
+
+    judge = Judge()
+    config.TRACE_PATH = str(trace_path)
+    reset_peak_memory()
+
+    start = time.perf_counter()
+    for i in range(workload.submissions):
+        submission = Submission(
+            id=i,
+            problem_code=workload.name,
+            language=workload.language,
+            source=workload.source,
+            time_limit=10000,
+            memory_limit=1048576
+        )
+        for header, data in judge.judge(submission):
+            if header in ('compile-error', 'internal-error') or data.get('status', 'AC') != 'AC':
+                raise RuntimeError(f'{workload.name}: unexpected {header}: {data}')
+    elapsed = time.perf_counter() - start
+
+    durations = {stage: [] for stage in STAGES}
+    with open(trace_path) as f:
+        for line in f:
+            for event in json.loads(line)['traceEvents']:
+                if event['ph'] == 'X' and event['name'] in durations:
+                    durations[event['name']].append(event['dur'] / 1000)
+
+    return {
+        'submissions-per-second': round(workload.submissions / elapsed, 3),
+        'peak-memory-kb': peak_memory_kb(),
+        'stages': {
+            stage: {f'p{round(fraction * 100)}': round(percentile(values, fraction), 3) for fraction in (0.5, 0.9, 0.99)}
+            for stage, values in durations.items() if values
+        }
+    }
+
+def report(name, results, baseline, threshold):
+    old = baseline.get(name)
+    throughput = results['submissions-per-second']
+
+    line = f'{name}: {throughput:.2f} submissions/s, peak memory {results["peak-memory-kb"] / 1024:.1f} MiB'
+    regressed = False
+    if old is not None:
+        change = throughput / old['submissions-per-second'] - 1
+        regressed = change < -threshold
+        line += f' ({change:+.1%} vs baseline{", REGRESSION" if regressed else ""})'
+    print(line)
+
+    print(f'  {"stage":<14} {"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9}  {"p50 vs baseline":>15}')
+    for stage, latencies in results['stages'].items():
+        change = ''
+        if old is not None and stage in old['stages']:
+            change = f'{latencies["p50"] / old["stages"][stage]["p50"] - 1:+.1%}'
+        print(f'  {stage:<14} {latencies["p50"]:9.3f} {latencies["p90"]:9.3f} {latencies["p99"]:9.3f}  {change:>15}')
+
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the judge on synthetic problems.')
+    parser.add_argument('--backend', choices=('stub', 'sandbox'), default='stub')
+    parser.add_argument('--workload', action='append', choices=[workload.name for workload in WORKLOADS])
+    parser.add_argument('--baseline', type=Path, help='results to compare against')
+    parser.add_argument('--save-baseline', type=Path, help='where to save the results as a baseline')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='the drop in throughput reported as a regression (default: %(default)s)')
+    parser.add_argument('--submissions', type=int, help='submissions per workload, for steadier results')
+    args = parser.parse_args()
+
+    workloads = [workload for workload in WORKLOADS if not args.workload or workload.name in args.workload]
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)[args.backend]
+
+    stub = StubDriver() if args.backend == 'stub' else None
+    if stub is not None:
+        set_driver(stub)
+
+    with TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+
+        # Keep everything the benchmark touches apart from a judge that may be
+        # running on the same host, and don't let cached compilations skew it.
+        config.PROBLEM_DATA_ROOT = str(tmp / 'problems')
+        config.ARTIFACT_CACHE_ROOT = None
+        config.TESTDATA_CACHE_ROOT = str(tmp / 'testdata')
+        config.TRACE_SAMPLE_RATE = 1.0
+        config.TRACE_MAX_SIZE = 0
+        if stub is not None:
+            config.BOX_ROOT = str(tmp / 'boxes')
+
+        results = {}
+        regressed = False
+        for workload in workloads:
+            answers = make_problem(tmp / 'problems', workload)
+            if args.submissions is not None:
+                workload = workload._replace(submissions=args.submissions)
+
+            results[workload.name] = run_workload(workload, stub, answers, tmp / f'{workload.name}.jsonl')
+            regressed |= report(workload.name, results[workload.name], baseline, args.threshold)
+
+    if args.save_baseline is not None:
+        saved = {}
+        if args.save_baseline.exists():
+            with open(args.save_baseline) as f:
+                saved = json.load(f)
+        saved.setdefault(args.backend, {}).update(results)
+        with open(args.save_baseline, 'w') as f:
+            json.dump(saved, f, indent=2)
+            f.write('\n')
+
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    from algojudge.comparators import load_comparators
+    from algojudge.runners import load_runners
+
+    load_comparators()
+    load_runners()
+
+    main()
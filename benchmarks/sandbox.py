@@ -0,0 +1,80 @@
+# Measures the overhead of supervising a program in the sandbox: the time it
+# takes to run a program that does nothing, how long after a time limit the
+# program is stopped, and the cpu time spent watching a program while it runs.
+#
+# Usage: python benchmarks/sandbox.py [sandbox binary]...
+#
+# Each binary is compared against the others, e.g. the installed one and a
+# build of an older version. Defaults to the `sandbox` on the PATH. The last
+# row is the backend for trusted programs (`TrustedBox`), for reference.
+
+from algojudge import config
+from algojudge.sandbox import CommandDriver, Sandbox, SandboxConfig, TrustedBox
+from pathlib import Path
+
+import os
+import resource
+import statistics
+import sys
+import time
+
+
+RUNS = 200
+
+
+def children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def measure(box):
+    conf = SandboxConfig(cpu_time_limit=1000, memory_limit=65536)
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        box.run(['/bin/true'], conf)
+        times.append(time.perf_counter() - start)
+
+    # How long past the limit the program keeps running.
+    result = box.run(['/bin/sleep', '10'], SandboxConfig(real_time_limit=100))
+    real_overshoot = result.real_time_ns / 10**6 - 100
+
+    result = box.run(['/bin/sh', '-c', 'while :; do :; done'], SandboxConfig(cpu_time_limit=100))
+    cpu_overshoot = result.cpu_time_ns / 10**6 - 100
+
+    # The cpu time spent on each second of a program that sleeps, which is
+    # what watching it costs.
+    idle_cpu = []
+    for seconds in (0, 1):
+        start = children_cpu_time()
+        box.run(['/bin/sleep', str(seconds)], SandboxConfig(real_time_limit=2000))
+        idle_cpu.append(children_cpu_time() - start)
+    idle_cpu = (idle_cpu[1] - idle_cpu[0]) * 1000
+
+    return statistics.median(times) * 1000, real_overshoot, cpu_overshoot, idle_cpu
+
+def main():
+    binaries = [Path(path).resolve() for path in sys.argv[1:]] or [None]
+    path = os.environ['PATH']
+
+    print(f'{"binary":>32} {"run (ms)":>9} {"real TLE +ms":>13} {"cpu TLE +ms":>12} '
+          f'{"idle cpu ms/s":>14}')
+
+    for binary in binaries:
+        if binary is not None:
+            os.environ['PATH'] = f'{binary.parent}{os.pathsep}{path}'
+
+        with Sandbox('box-benchmark', CommandDriver()) as box:
+            run, real, cpu, idle = measure(box)
+
+        name = str(binary or 'sandbox')[-32:]
+        print(f'{name:>32} {run:9.2f} {real:13.1f} {cpu:12.1f} {idle:14.1f}')
+
+    os.environ['PATH'] = path
+
+    with TrustedBox('box-benchmark') as box:
+        run, real, cpu, idle = measure(box)
+    print(f'{"trusted":>32} {run:9.2f} {real:13.1f} {cpu:12.1f} {idle:14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,19 +2,79 @@
 #include "fio.h"
 #include "sandbox.h"
 
+#include <errno.h>
 #include <fcntl.h>
+#include <linux/magic.h>
 #include <stdarg.h>
 #include <stddef.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <sys/eventfd.h>
+#include <sys/inotify.h>
+#include <sys/vfs.h>
 #include <unistd.h>
 
+#define CG_ROOT "/sys/fs/cgroup"
+
 static const char *CG_CONTROLLERS[] = { "cpuacct", "memory", "pids" };
 
+/* Statistics that are read while the program runs. Their files are kept open,
+   since they may be read many times per run. */
+#define CG_STAT_CPU_USAGE    0
+#define CG_STAT_MEMORY_USAGE 1
+#define CG_STAT_OOM_CONTROL  2
+
+static const struct { size_t controller; const char *v1, *v2; } CG_STATS[] = {
+    { CG_CPUACCT, "cpuacct.usage",                   "cpu.stat" },
+    { CG_MEMORY,  "memory.memsw.max_usage_in_bytes", "memory.peak" },
+    { CG_MEMORY,  "memory.oom_control",              "memory.events" },
+};
+
+static int cg_stat_fds[] = { -1, -1, -1 };
+
+/* The cpu time used by a cgroup v2 box before the current run, since its
+   counter can't be reset. */
+static long long cg_cpu_base;
+
+/* Returns 1 if the host uses cgroup v2 (the unified hierarchy), or 0 if it uses
+   cgroup v1, where each controller has a hierarchy of its own. Hybrid setups,
+   which only mount cgroup v2 for systemd, count as cgroup v1. */
+int cg_unified() {
+    static int unified = -1;
+    if (unified == -1) {
+        struct statfs buf;
+        if (statfs(CG_ROOT, &buf) == -1)
+            fail(2, "Failed to stat '" CG_ROOT "': %m\n");
+        unified = buf.f_type == CGROUP2_SUPER_MAGIC;
+    }
+    return unified;
+}
+
+/* Under cgroup v2, a box has a single cgroup for all controllers. */
 static void cg_getpath(char *buf, size_t size, size_t controller, const char *path) {
-    snprintf(buf, size, "/sys/fs/cgroup/%s/sandbox/%s/%s",
-             CG_CONTROLLERS[controller], box_name, path ? path : "");
+    if (cg_unified())
+        snprintf(buf, size, CG_ROOT "/sandbox/%s/%s", box_name, path ? path : "");
+    else
+        snprintf(buf, size, CG_ROOT "/%s/sandbox/%s/%s",
+                 CG_CONTROLLERS[controller], box_name, path ? path : "");
+}
+
+static const char *cg_stat_filename(int stat) {
+    return cg_unified() ? CG_STATS[stat].v2 : CG_STATS[stat].v1;
+}
+
+/* Returns the value of `key` in a file of "key value" lines, or 0 if it's
+   missing. */
+static long long cg_parse_key(const char *buf, const char *key) {
+    size_t len = strlen(key);
+    for (const char *line = buf; line; ) {
+        if (!strncmp(line, key, len) && line[len] == ' ')
+            return atoll(line + len + 1);
+        if ((line = strchr(line, '\n')))
+            line++;
+    }
+    return 0;
 }
 
 void cg_read(char *buf, size_t count, size_t controller, const char *filename) {
@@ -50,37 +110,140 @@ void cg_write(size_t controller, const char *filename, const char *format, ...)
         fail(2, "Failed to write to '%s': %m\n", path);
 }
 
+/* Like cg_write(), but for files that the kernel might not have (or refuse),
+   which are left as is. Returns -1 on failure. */
+static int cg_try_write(size_t controller, const char *filename, const char *format, ...) {
+    va_list ap; va_start(ap, format);
+
+    char path[256];
+    cg_getpath(path, sizeof(path), controller, filename);
+
+    return vezwrite(path, format, ap);
+}
+
+/* Opens the files of the statistics read by cg_cpu_time() and friends. They
+   are opened on first use otherwise, but the box's cgroups must exist by then. */
+void cg_open_stats() {
+    char path[256];
+    for (int stat = 0; stat < sizeof(CG_STATS) / sizeof(CG_STATS[0]); stat++) {
+        if (cg_stat_fds[stat] != -1)
+            continue;
+
+        cg_getpath(path, sizeof(path), CG_STATS[stat].controller, cg_stat_filename(stat));
+        if ((cg_stat_fds[stat] = open(path, O_RDONLY | O_CLOEXEC)) == -1)
+            fail(2, "Failed to open '%s' for reading: %m\n", path);
+    }
+}
+
+static void cg_close_stats() {
+    for (int stat = 0; stat < sizeof(CG_STATS) / sizeof(CG_STATS[0]); stat++) {
+        if (cg_stat_fds[stat] != -1)
+            close(cg_stat_fds[stat]);
+        cg_stat_fds[stat] = -1;
+    }
+}
+
+static void cg_read_stat(char *buf, size_t count, int stat) {
+    cg_open_stats();
+
+    // Reading from the start regenerates the contents of the file.
+    int nbytes;
+    if ((nbytes = pread(cg_stat_fds[stat], buf, count, 0)) == -1)
+        fail(2, "Failed to read '%s': %m\n", cg_stat_filename(stat));
+    if (nbytes == count)
+        fail(2, "File '%s' too long to read.\n", cg_stat_filename(stat));
+
+    buf[nbytes] = '\0';
+}
+
 /* Returns the total cpu time of the process, in nanoseconds. */
 long long cg_cpu_time() {
     char buf[256];
-    cg_read(buf, sizeof(buf), CG_CPUACCT, "cpuacct.usage");
+    cg_read_stat(buf, sizeof(buf), CG_STAT_CPU_USAGE);
+
+    if (cg_unified())
+        return cg_parse_key(buf, "usage_usec") * 1000 - cg_cpu_base;
     return atoll(buf);
 }
 
 /* Returns the maximum memory usage of the process, in kilobytes. */
 int cg_memory_usage() {
     char buf[256];
-    cg_read(buf, sizeof(buf), CG_MEMORY, "memory.memsw.max_usage_in_bytes");
+    cg_read_stat(buf, sizeof(buf), CG_STAT_MEMORY_USAGE);
+
+    // Swap is disabled for boxes under cgroup v2 (see cg_setup()), so the
+    // memory usage alone is comparable to memory+swap under cgroup v1.
     unsigned long long memsw = atoll(buf);
 
     return memsw >> 10;
 }
 
-/* Returns 1 if the system ran out of memory, and 0 otherwise. */
+/* Returns the number of processes killed for running out of memory in the
+   box's memory cgroup, since it was created. */
 int cg_oom_kill() {
     char buf[256];
-    cg_read(buf, sizeof(buf), CG_MEMORY, "memory.oom_control");
+    cg_read_stat(buf, sizeof(buf), CG_STAT_OOM_CONTROL);
+    return cg_parse_key(buf, "oom_kill");
+}
+
+/* Returns a file descriptor that becomes readable whenever the memory cgroup
+   may have run out of memory (check cg_oom_kill() to be sure), or -1 if the
+   kernel can't notify us of that. */
+int cg_oom_eventfd() {
+    char path[256];
+
+    // Changes to memory.events are reported as modifications of the file.
+    if (cg_unified()) {
+        int ifd = inotify_init1(IN_CLOEXEC | IN_NONBLOCK);
+        if (ifd == -1)
+            return -1;
+
+        cg_getpath(path, sizeof(path), CG_MEMORY, "memory.events");
+        if (inotify_add_watch(ifd, path, IN_MODIFY) == -1) {
+            close(ifd);
+            return -1;
+        }
+        return ifd;
+    }
+
+    int efd = eventfd(0, EFD_CLOEXEC | EFD_NONBLOCK);
+    if (efd == -1)
+        return -1;
 
-    int oom_kill = 0;
-    for (char *ptr = buf; *ptr; ptr = strchr(ptr, '\n') + 1)
-        if (sscanf(ptr, "oom_kill %d", &oom_kill) == 1)
-            break;
-    return oom_kill;
+    cg_open_stats();
+
+    cg_getpath(path, sizeof(path), CG_MEMORY, "cgroup.event_control");
+    if (ezwrite(path, "%d %d\n", efd, cg_stat_fds[CG_STAT_OOM_CONTROL]) == -1) {
+        close(efd);
+        return -1;
+    }
+
+    return efd;
 }
 
 void cg_setup() {
     pid_t pid = getpid();
 
+    if (cg_unified()) {
+        cg_write(CG_PIDS, "cgroup.procs", "%d\n", pid);
+
+        // Every controller applies to a cgroup v2 box, so lift the limits that
+        // aren't wanted.
+        if (max_pids)
+            cg_write(CG_PIDS, "pids.max", "%d\n", max_pids);
+        else
+            cg_write(CG_PIDS, "pids.max", "max\n");
+
+        if (memory_limit_kb) {
+            cg_write(CG_MEMORY, "memory.max", "%lld\n", (long long) memory_limit_kb << 10);
+            cg_try_write(CG_MEMORY, "memory.swap.max", "0\n");
+        } else {
+            cg_write(CG_MEMORY, "memory.max", "max\n");
+            cg_try_write(CG_MEMORY, "memory.swap.max", "max\n");
+        }
+        return;
+    }
+
     if (max_pids) {
         cg_write(CG_PIDS, "tasks", "%d\n", pid);
         cg_write(CG_PIDS, "pids.max", "%d\n", max_pids);
@@ -96,8 +259,83 @@ void cg_setup() {
     cg_write(CG_CPUACCT, "cpuacct.usage", "0\n");
 }
 
+/* Resets the peak memory usage of a cgroup v2 box. Only reads through the same
+   file see the reset, so it stays open for cg_memory_usage(). Returns -1 if the
+   kernel is too old (before 6.12) to reset it. */
+static int cg_reset_peak() {
+    char path[256];
+    cg_getpath(path, sizeof(path), CG_MEMORY, "memory.peak");
+
+    int fd = open(path, O_RDWR | O_CLOEXEC);
+    if (fd == -1)
+        return -1;
+    if (write(fd, "reset\n", 6) == -1) {
+        close(fd);
+        return -1;
+    }
+
+    if (cg_stat_fds[CG_STAT_MEMORY_USAGE] != -1)
+        close(cg_stat_fds[CG_STAT_MEMORY_USAGE]);
+    cg_stat_fds[CG_STAT_MEMORY_USAGE] = fd;
+    return 0;
+}
+
+/* Resets the counters of a box that is being reused. Must be called while no
+   tasks are inside the cgroups. */
+void cg_reset() {
+    if (cg_unified()) {
+        // Uncharge any page cache left behind by the previous run. This is only
+        // a best effort, which the kernel may not fully satisfy.
+        char buf[64];
+        cg_read(buf, sizeof(buf), CG_MEMORY, "memory.current");
+        if (atoll(buf))
+            cg_try_write(CG_MEMORY, "memory.reclaim", "%s\n", buf);
+
+        // Most counters can't be reset, so either start from where they are
+        // now, or failing that, start over with a new cgroup.
+        if (cg_reset_peak() == -1) {
+            cg_delete();
+            cg_init();
+        }
+
+        cg_cpu_base = 0;
+        cg_cpu_base = cg_cpu_time();
+        return;
+    }
+
+    // Uncharge any page cache left behind by the previous run, so that it isn't
+    // counted towards the memory usage (or limit) of the next one.
+    cg_write(CG_MEMORY, "memory.force_empty", "0\n");
+
+    // Lift the previous memory limits, otherwise the next run can't raise them
+    // (the memory limit may never exceed the memory+swap limit).
+    cg_write(CG_MEMORY, "memory.memsw.limit_in_bytes", "-1\n");
+    cg_write(CG_MEMORY, "memory.limit_in_bytes", "-1\n");
+
+    cg_write(CG_MEMORY, "memory.max_usage_in_bytes", "0\n");
+    cg_write(CG_MEMORY, "memory.memsw.max_usage_in_bytes", "0\n");
+    cg_write(CG_CPUACCT, "cpuacct.usage", "0\n");
+}
+
 void cg_init() {
     char path[256];
+
+    if (cg_unified()) {
+        // Controllers are only available to a cgroup if all of its ancestors
+        // enable them for their children.
+        if (mkdir_rec(CG_ROOT "/sandbox", 0755) == -1)
+            fail(2, "Failed to create cgroup directory at '" CG_ROOT "/sandbox': %m\n");
+        if (ezwrite(CG_ROOT "/cgroup.subtree_control", "+memory +pids\n") == -1)
+            fail(2, "Failed to enable cgroup controllers in '" CG_ROOT "': %m\n");
+        if (ezwrite(CG_ROOT "/sandbox/cgroup.subtree_control", "+memory +pids\n") == -1)
+            fail(2, "Failed to enable cgroup controllers in '" CG_ROOT "/sandbox': %m\n");
+
+        cg_getpath(path, sizeof(path), CG_MEMORY, NULL);
+        if (mkdir(path, 0755) == -1 && errno != EEXIST)
+            fail(2, "Failed to create cgroup directory at '%s': %m\n", path);
+        return;
+    }
+
     for (int controller = 0; controller < sizeof(CG_CONTROLLERS) / sizeof(char*); controller++) {
         cg_getpath(path, sizeof(path), controller, NULL);
         if (mkdir_rec(path, 0755) == -1)
@@ -107,6 +345,16 @@ void cg_init() {
 
 void cg_delete() {
     char path[256];
+
+    if (cg_unified()) {
+        cg_close_stats();
+
+        cg_getpath(path, sizeof(path), CG_MEMORY, NULL);
+        if (rmdir(path) == -1)
+            fail(2, "Failed to delete cgroup directory at '%s': %m\n", path);
+        return;
+    }
+
     for (int controller = 0; controller < sizeof(CG_CONTROLLERS) / sizeof(char*); controller++) {
         cg_getpath(path, sizeof(path), controller, NULL);
         if (rmdir(path) == -1)
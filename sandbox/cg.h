@@ -10,11 +10,16 @@
 void cg_read(char *buf, size_t count, size_t controller, const char *filename);
 void cg_write(size_t controller, const char *filename, const char *format, ...);
 
+int cg_unified();
+
+void cg_open_stats();
 long long cg_cpu_time();
 int cg_memory_usage();
 int cg_oom_kill();
+int cg_oom_eventfd();
 
 void cg_setup();
+void cg_reset();
 void cg_init();
 void cg_delete();
 
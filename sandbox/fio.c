@@ -61,8 +61,10 @@ int vezwrite(const char *path, const char *format, va_list ap) {
     char buf[1024];
 
     int len = vsnprintf(buf, sizeof(buf), format, ap);
-    if (write(fd, buf, len) == -1)
+    if (write(fd, buf, len) == -1) {
+        close(fd);
         return -1;
+    }
 
     if (close(fd) == -1)
         return -1;
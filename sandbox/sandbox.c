@@ -8,39 +8,61 @@
 #include <getopt.h>
 #include <grp.h>
 #include <limits.h>
+#include <poll.h>
 #include <sched.h>
+#include <signal.h>
 #include <stdarg.h>
 #include <stddef.h>
+#include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <sys/epoll.h>
 #include <sys/mount.h>
 #include <sys/resource.h>
+#include <sys/signalfd.h>
+#include <sys/socket.h>
 #include <sys/syscall.h>
 #include <sys/sysmacros.h>
 #include <sys/time.h>
+#include <sys/timerfd.h>
 #include <sys/wait.h>
 #include <time.h>
 #include <unistd.h>
 
-#define TRACE_PERIOD_US 10000
 #define NOBODY 65534
 
+// The shortest interval between two checks of the cpu time limit.
+#define CPU_CHECK_MIN_NS 1000000LL
+
 #define BOX_WRITABLE  0x001
 #define BOX_DEV       0x002
 
-static const char *optstring = "b:d:Df:Im:p:T:t:R";
+#define SERVE_VERSION 4
+
+// The file descriptors that may be passed along with a request.
+#define PASS_STDIN  0x001
+#define PASS_STDOUT 0x002
+
+// The most directories that may be bound into a box.
+#define MAX_BINDS 16
+
+static const char *optstring = "B:b:d:Df:i:Im:o:p:T:t:RS";
 static const struct option longopts[] = {
+    { "bind",            1, NULL, 'B' },
     { "box-name",        1, NULL, 'b' },
     { "box-root",        1, NULL, 'd' },
     { "del",             0, NULL, 'D' },
     { "max-fsize",       1, NULL, 'f' },
+    { "stdin-fd",        1, NULL, 'i' },
     { "init",            0, NULL, 'I' },
     { "memory-limit",    1, NULL, 'm' },
+    { "stdout-fd",       1, NULL, 'o' },
     { "max-pids",        1, NULL, 'p' },
     { "real-time-limit", 1, NULL, 'T' },
     { "cpu-time-limit",  1, NULL, 't' },
     { "run",             0, NULL, 'R' },
+    { "serve",           0, NULL, 'S' },
     { NULL,              0, NULL,  0 }
 };
 
@@ -53,12 +75,60 @@ static gid_t host_gid;
 static pid_t box_pid, prog_pid;
 
 static int status_pipe[2], fail_pipe[2], fail_write_fd;
-static int check_timeout;
+static int oom_kill_base;
+
+// Signals that are handled by trace() rather than delivered. The box restores
+// the original mask.
+static sigset_t trace_signals, saved_mask;
+
+// If set, the program writes its output to this (inherited) file descriptor
+// instead of the 'out' file, e.g. so that it can be checked as it's produced.
+static int stdout_fd = -1;
+// Likewise, the program reads its input from this file descriptor instead of
+// the 'in' file, e.g. so that it can talk to an interactor.
+static int stdin_fd = -1;
+
+// Host directories that are made visible (read-only) at the same path inside
+// the box, e.g. the startup accelerators of a language.
+static char *binds[MAX_BINDS];
+static int nbinds;
 
 static long long cpu_time_limit_ns, real_time_limit_ns;
 static int max_fsize_kb;
 int memory_limit_kb, max_pids;
 
+// Set when results should be written in binary for the supervisor (see serve()).
+static int binary_output;
+
+/* A request sent to the supervisor. It is followed by `size - sizeof(struct
+   request)` bytes of NUL-terminated strings: the box root, the box name, the
+   `argc` arguments of the command and the `nbinds` directories to bind. Limits
+   of 0 are not enforced. The `fds` flags (PASS_*) tell which of the program's
+   stdin and stdout are sent along with the request, in that order. */
+struct request {
+    uint32_t size;
+    uint32_t mode;
+    uint32_t cpu_time_limit_ms, real_time_limit_ms;
+    uint32_t memory_limit_kb, max_fsize_kb, max_pids;
+    uint32_t argc, nbinds;
+    uint32_t fds;
+};
+
+/* A response from the supervisor, followed by `size - sizeof(struct response)`
+   bytes: a `struct result` if the request was a successful run, or an error
+   message if `status` (the exit code of the job) is nonzero. `aborted` is set if
+   the caller asked to stop the job while it ran. */
+struct response {
+    uint32_t size;
+    int32_t status;
+    uint32_t aborted;
+};
+
+struct result {
+    int64_t cpu_time_ns, real_time_ns, memory_kb;
+    int64_t timeout, oom_kill, exitcode, signal, killed;
+};
+
 /* Triggers upon an error. By convention, exit codes 1 and 2 represent a minor
    and major error, respectively. */
 void fail(int exitcode, const char *format, ...) {
@@ -90,6 +160,16 @@ static unsigned uint_parse(const char *str) {
     return val;
 }
 
+/* Adds a directory to bind into the box, which must be given by an absolute
+   path that doesn't go up with '..'. */
+static void add_bind(char *path) {
+    if (nbinds == MAX_BINDS)
+        fail(1, "Too many binds (at most %d)\n", MAX_BINDS);
+    if (path[0] != '/' || !path[1] || strstr(path, ".."))
+        fail(1, "Invalid bind '%s'\n", path);
+    binds[nbinds++] = path;
+}
+
 static void populate_box(const char *source, const char *target,
                         const char *fstype, unsigned flags) {
     // Create the directory if it doesn't exist.
@@ -140,9 +220,20 @@ static void io_setup() {
             fail(2, "Failed to close() std" name ": %m\n"); \
     }
 
-    if (access("in", F_OK) == 0)
-        DUP_FD(STDIN_FILENO, "in", O_RDONLY, 0644);
-    DUP_FD(STDOUT_FILENO, "out", O_WRONLY | O_CREAT | O_TRUNC, 0622);
+    if (stdin_fd != -1) {
+        if (dup2(stdin_fd, STDIN_FILENO) == -1)
+            fail(2, "Failed to dup() stdin: %m\n");
+        if (close(stdin_fd) == -1)
+            fail(2, "Failed to close() stdin: %m\n");
+    } else if (access("in", F_OK) == 0)
+        DUP_FD(STDIN_FILENO, "in", O_RDONLY, 0444);
+    if (stdout_fd != -1) {
+        if (dup2(stdout_fd, STDOUT_FILENO) == -1)
+            fail(2, "Failed to dup() stdout: %m\n");
+        if (close(stdout_fd) == -1)
+            fail(2, "Failed to close() stdout: %m\n");
+    } else
+        DUP_FD(STDOUT_FILENO, "out", O_WRONLY | O_CREAT | O_TRUNC, 0622);
     DUP_FD(STDERR_FILENO, "err", O_WRONLY | O_CREAT | O_TRUNC, 0622);
 }
 
@@ -165,6 +256,9 @@ static void fs_setup() {
     populate_box("/usr/lib", "usr/lib", NULL, 0);
     populate_box(NULL, "proc", "proc", 0);
     populate_box(NULL, "tmp", "tmpfs", BOX_WRITABLE);
+    // Last, so that they aren't hidden by the mounts above.
+    for (int i = 0; i < nbinds; i++)
+        populate_box(binds[i], binds[i] + 1, NULL, 0);
 
     if (mkdir("etc", 0755) == -1 && errno != EEXIST)
         fail(2, "Failed to create '/etc' directory: %m\n");
@@ -243,6 +337,13 @@ static void run_box() {
     if (prog_pid == 0)
         run_program();
 
+    // Only the program may hold on to its stdin and stdout, so that the other
+    // ends see EOF as soon as it terminates.
+    if (stdout_fd != -1)
+        close(stdout_fd);
+    if (stdin_fd != -1)
+        close(stdin_fd);
+
     int status;
     if (waitpid(prog_pid, &status, 0) == -1)
         fail(2, "waitpid(): %m\n");
@@ -260,59 +361,177 @@ static long long get_real_time() {
     return 1000000000LL * (end.tv_sec - start.tv_sec) + (end.tv_nsec - start.tv_nsec);
 }
 
-static void trace_handler(int sig) {
-    check_timeout = 1;
+// Sources of events that trace() waits for.
+#define EV_EXIT      0
+#define EV_SIGNAL    1
+#define EV_REAL_TIME 2
+#define EV_CPU_TIME  3
+#define EV_OOM       4
+
+static void add_event(int epfd, int fd, uint32_t source) {
+    struct epoll_event ev = { .events = EPOLLIN, .data.u32 = source };
+    if (epoll_ctl(epfd, EPOLL_CTL_ADD, fd, &ev) == -1)
+        fail(2, "epoll_ctl(): %m\n");
 }
 
-/* Traces the child process until termination and records its results. */
-static void trace() {
-    struct sigaction sa = { 0 };
-    sa.sa_handler = trace_handler;
-    sigaction(SIGALRM, &sa, NULL);
+static int timer_open(int epfd, uint32_t source) {
+    int fd = timerfd_create(CLOCK_MONOTONIC, TFD_CLOEXEC | TFD_NONBLOCK);
+    if (fd == -1)
+        fail(2, "timerfd_create(): %m\n");
+    add_event(epfd, fd, source);
+    return fd;
+}
+
+/* Arms a timer to expire once, `ns` nanoseconds from now. */
+static void timer_arm(int fd, long long ns) {
+    struct itimerspec its = { 0 };
+    its.it_value.tv_sec = ns / 1000000000LL;
+    its.it_value.tv_nsec = ns % 1000000000LL;
+    if (!its.it_value.tv_sec && !its.it_value.tv_nsec)
+        its.it_value.tv_nsec = 1;
+
+    if (timerfd_settime(fd, 0, &its, NULL) == -1)
+        fail(2, "timerfd_settime(): %m\n");
+}
+
+/* Returns how long to wait before checking the cpu time again. The program
+   can't use more cpu time than all of the cpus can run in that time, so it
+   can't exceed the limit before then. */
+static long long cpu_check_delay(long long cpu_time_ns) {
+    static long ncpus;
+    if (!ncpus && (ncpus = sysconf(_SC_NPROCESSORS_ONLN)) < 1)
+        ncpus = 1;
+
+    long long delay = (cpu_time_limit_ns - cpu_time_ns) / ncpus;
+    return delay > CPU_CHECK_MIN_NS ? delay : CPU_CHECK_MIN_NS;
+}
 
-    struct itimerval it;
-    it.it_interval.tv_sec = it.it_value.tv_sec = 0;
-    it.it_interval.tv_usec = it.it_value.tv_usec = TRACE_PERIOD_US;
-    setitimer(ITIMER_REAL, &it, NULL);
+/* Returns 1 if the box has terminated, without reaping it. */
+static int box_exited() {
+    siginfo_t info = { 0 };
+    if (waitid(P_PID, box_pid, &info, WEXITED | WNOHANG | WNOWAIT) == -1)
+        fail(2, "waitid(): %m\n");
+    return info.si_pid == box_pid;
+}
+
+/* Traces the child process until termination and records its results. Rather
+   than polling, this sleeps until the box terminates, a limit may have been
+   exceeded, or we're told to stop. */
+static void trace() {
+    int epfd = epoll_create1(EPOLL_CLOEXEC);
+    if (epfd == -1)
+        fail(2, "epoll_create1(): %m\n");
+
+    // SIGCHLD tells us about the box terminating on kernels without pidfds.
+    int sigfd = signalfd(-1, &trace_signals, SFD_CLOEXEC | SFD_NONBLOCK);
+    if (sigfd == -1)
+        fail(2, "signalfd(): %m\n");
+    add_event(epfd, sigfd, EV_SIGNAL);
+
+    int pidfd = syscall(SYS_pidfd_open, box_pid, 0);
+    if (pidfd != -1)
+        add_event(epfd, pidfd, EV_EXIT);
+
+    int oomfd = cg_oom_eventfd();
+    if (oomfd != -1)
+        add_event(epfd, oomfd, EV_OOM);
+
+    int real_timer = -1, cpu_timer = -1;
+    if (real_time_limit_ns)
+        real_timer = timer_open(epfd, EV_REAL_TIME);
+    if (cpu_time_limit_ns)
+        cpu_timer = timer_open(epfd, EV_CPU_TIME);
 
-    struct rusage ru; int status;
-    int timeout = 0;
+    int status;
+    int exited = 0, timeout = 0, killed = 0, aborted = 0, oom_event = 0;
 
     // Starting the clock now could happen before the child runs. However, the
     // difference is negligible, and real time isn't too important to us anyway.
     clock_gettime(CLOCK_MONOTONIC, &start);
 
-    while (1) {
-        if (check_timeout) {
-            if ( (cpu_time_limit_ns && cg_cpu_time() > cpu_time_limit_ns) ||
-                 (real_time_limit_ns && get_real_time() > real_time_limit_ns) ) {
+    if (real_timer != -1)
+        timer_arm(real_timer, real_time_limit_ns);
+    if (cpu_timer != -1)
+        timer_arm(cpu_timer, cpu_check_delay(0));
+
+    // The box may have terminated before we started listening for it.
+    exited = box_exited();
+
+    while (!exited && !timeout && !aborted) {
+        struct epoll_event events[8];
+        int n = epoll_wait(epfd, events, 8, -1);
+        if (n == -1) {
+            if (errno == EINTR)
+                continue;
+            fail(2, "epoll_wait(): %m\n");
+        }
+
+        for (int i = 0; i < n; i++) {
+            uint64_t count;
+            char drain[256];
+            struct signalfd_siginfo si;
+
+            switch (events[i].data.u32) {
+            case EV_EXIT:
+                exited = 1;
+                break;
+            case EV_SIGNAL:
+                while (read(sigfd, &si, sizeof(si)) == sizeof(si)) {
+                    // The caller has asked us to stop the program (see run()).
+                    if (si.ssi_signo == SIGTERM)
+                        aborted = 1;
+                    else if (si.ssi_signo == SIGCHLD && box_exited())
+                        exited = 1;
+                }
+                break;
+            case EV_REAL_TIME:
+                read(real_timer, &count, sizeof(count));
                 timeout = 1;
                 break;
+            case EV_CPU_TIME:
+                read(cpu_timer, &count, sizeof(count));
+                long long cpu_time_ns = cg_cpu_time();
+                if (cpu_time_ns > cpu_time_limit_ns)
+                    timeout = 1;
+                else
+                    timer_arm(cpu_timer, cpu_check_delay(cpu_time_ns));
+                break;
+            case EV_OOM:
+                // Under cgroup v2 this reports any memory event, such as
+                // reaching the limit and reclaiming, not just OOM kills.
+                while (read(oomfd, drain, sizeof(drain)) > 0);
+                if (cg_oom_kill() > oom_kill_base)
+                    oom_event = 1;
+                break;
             }
-            check_timeout = 0;
         }
+    }
 
-        pid_t pid = wait4(box_pid, &status, 0, &ru);
-        if (pid != -1)
-            break;
+    long long real_time_ns = get_real_time();
+
+    // The program may have terminated on its own just before it was stopped.
+    // Either way, the caller isn't interested in how it terminated anymore.
+    killed = aborted && !timeout;
+
+    // The program could have terminated or timed out. Either way, we must kill
+    // it (and everything else in its namespace) before collecting the results.
+    kill(box_pid, SIGKILL);
+    while (waitpid(box_pid, &status, 0) == -1)
         if (errno != EINTR)
-            fail(2, "wait4(): %m\n");
-    }
+            fail(2, "waitpid(): %m\n");
 
     // Report any errors that occured inside the sandbox.
     char buf[1024]; int len;
-    if ((len = read(fail_pipe[0], &buf, sizeof(buf))) > 0) {
+    if ((len = read(fail_pipe[0], &buf, sizeof(buf) - 1)) > 0) {
         buf[len] = '\0';
-        fail(2, buf);
+        fail(2, "%s", buf);
     }
 
-    // The program could have terminated or timed out. Either way, we must kill it.
-    kill(box_pid, SIGKILL);
-
     int exitcode = -1, signal = -1;
 
-    if (!timeout) {
-        read(status_pipe[0], &status, sizeof(status));
+    if (!timeout && !killed) {
+        if (read(status_pipe[0], &status, sizeof(status)) != sizeof(status))
+            fail(2, "Sandbox exited without reporting a status\n");
         if (WIFEXITED(status))
             exitcode = WEXITSTATUS(status);
         else if (WIFSIGNALED(status))
@@ -323,13 +542,30 @@ static void trace() {
             fail(2, "Sandbox received bad status %d\n");
     }
 
-    printf("cpu_time_ns: %lld\n", cg_cpu_time());
-    printf("real_time_ns: %lld\n", get_real_time());
-    printf("memory_kb: %d\n", cg_memory_usage());
-    printf("timeout: %d\n", timeout);
-    printf("oom_kill: %d\n", cg_oom_kill());
-    printf("exitcode: %d\n", exitcode);
-    printf("signal: %d\n", signal);
+    struct result res = {
+        .cpu_time_ns = cg_cpu_time(),
+        .real_time_ns = real_time_ns,
+        .memory_kb = cg_memory_usage(),
+        .timeout = timeout,
+        .oom_kill = oom_event || cg_oom_kill() > oom_kill_base,
+        .exitcode = exitcode,
+        .signal = signal,
+        .killed = killed
+    };
+
+    if (binary_output) {
+        fwrite(&res, sizeof(res), 1, stdout);
+        return;
+    }
+
+    printf("cpu_time_ns: %lld\n", (long long) res.cpu_time_ns);
+    printf("real_time_ns: %lld\n", (long long) res.real_time_ns);
+    printf("memory_kb: %lld\n", (long long) res.memory_kb);
+    printf("timeout: %lld\n", (long long) res.timeout);
+    printf("oom_kill: %lld\n", (long long) res.oom_kill);
+    printf("exitcode: %lld\n", (long long) res.exitcode);
+    printf("signal: %lld\n", (long long) res.signal);
+    printf("killed: %lld\n", (long long) res.killed);
 }
 
 /* Initializes the sandbox at the given path. */
@@ -351,7 +587,8 @@ static void init() {
 
     cg_init(box_name);
 
-    printf("Sandbox was successfully initialized!\n");
+    if (!binary_output)
+        printf("Sandbox was successfully initialized!\n");
 }
 
 /* Deletes the sandbox, along with everything inside it. */
@@ -361,7 +598,8 @@ static void delete() {
 
     cg_delete();
 
-    printf("Sandbox was successfully deleted!\n");
+    if (!binary_output)
+        printf("Sandbox was successfully deleted!\n");
 }
 
 /* Runs the program inside the sandbox. */
@@ -374,12 +612,27 @@ static void run() {
     if (chown_rec(box_path, host_uid, host_gid) == -1)
         fail(2, "Failed to chown() box: %m\n");
 
+    // SIGTERM stops the program early, e.g. once its output is known to be
+    // wrong. It is still reported as usual, but with `killed` set.
+    sigemptyset(&trace_signals);
+    sigaddset(&trace_signals, SIGTERM);
+    sigaddset(&trace_signals, SIGCHLD);
+    if (sigprocmask(SIG_BLOCK, &trace_signals, &saved_mask) == -1)
+        fail(2, "sigprocmask(): %m\n");
+
+    // The box may have been used before, so start with fresh counters. The
+    // OOM kill counter can't be reset, so remember where it started instead.
+    cg_reset();
+    cg_open_stats();
+    oom_kill_base = cg_oom_kill();
+
     // Create a pipe to record the exitcode/signal of the running process.
-    if (pipe(status_pipe) == -1)
+    if (pipe2(status_pipe, O_CLOEXEC) == -1)
         fail(2, "Failed to create status pipe: %m\n");
 
-    // Create another pipe to listen for failures.
-    if (pipe(fail_pipe) == -1)
+    // Create another pipe to listen for failures. The program only holds on to
+    // it until it's executed, so that the pipe doesn't block us afterwards.
+    if (pipe2(fail_pipe, O_CLOEXEC) == -1)
         fail(2, "Failed to create fail pipe: %m\n");
 
     box_pid = syscall(
@@ -393,15 +646,289 @@ static void run() {
     if (box_pid == 0) {
         fail_write_fd = fail_pipe[1];
         close(status_pipe[0]); close(fail_pipe[0]);
+        sigprocmask(SIG_SETMASK, &saved_mask, NULL);
 
         run_box();
         return;
     }
 
-    close(fail_pipe[1]); close(fail_pipe[1]);
+    close(status_pipe[1]); close(fail_pipe[1]);
+
+    // Whatever the box wrote is in the pipes by the time it's reaped.
+    fcntl(status_pipe[0], F_SETFL, O_NONBLOCK);
+    fcntl(fail_pipe[0], F_SETFL, O_NONBLOCK);
+
+    if (stdout_fd != -1)
+        close(stdout_fd);
+    if (stdin_fd != -1)
+        close(stdin_fd);
     trace();
 }
 
+/* Runs the given mode with the options that are currently set. */
+static void dispatch(int mode) {
+    snprintf(box_path, sizeof(box_path), "%s/%s", box_root, box_name);
+
+    switch (mode) {
+    case 'D':
+        delete();
+        break;
+    case 'I':
+        init();
+        break;
+    case 'R':
+        run();
+        break;
+    }
+}
+
+static int read_full(int fd, void *buf, size_t count) {
+    size_t total = 0;
+    while (total < count) {
+        ssize_t n = read(fd, (char *) buf + total, count - total);
+        if (n == -1 && errno == EINTR)
+            continue;
+        if (n <= 0)
+            return total ? -1 : 0;
+        total += n;
+    }
+    return 1;
+}
+
+static int write_full(int fd, const void *buf, size_t count) {
+    size_t total = 0;
+    while (total < count) {
+        ssize_t n = write(fd, (const char *) buf + total, count - total);
+        if (n == -1 && errno == EINTR)
+            continue;
+        if (n == -1)
+            return -1;
+        total += n;
+    }
+    return 0;
+}
+
+/* Like read_full(), but also receives the file descriptors that were sent
+   along with the data if `fd` is a socket, storing up to `max_fds` of them. */
+static int recv_full(int fd, void *buf, size_t count, int *fds, int max_fds, int *nfds) {
+    size_t total = 0;
+    *nfds = 0;
+
+    while (total < count) {
+        union {
+            struct cmsghdr hdr;
+            char buf[CMSG_SPACE(2 * sizeof(int))];
+        } control;
+        struct iovec iov = { (char *) buf + total, count - total };
+        struct msghdr msg = {
+            .msg_iov = &iov, .msg_iovlen = 1,
+            .msg_control = &control, .msg_controllen = sizeof(control)
+        };
+
+        ssize_t n = recvmsg(fd, &msg, 0);
+        if (n == -1 && errno == ENOTSOCK)
+            n = read(fd, iov.iov_base, iov.iov_len), msg.msg_controllen = 0;
+        if (n == -1 && errno == EINTR)
+            continue;
+
+        for (struct cmsghdr *cmsg = CMSG_FIRSTHDR(&msg); n > 0 && cmsg; cmsg = CMSG_NXTHDR(&msg, cmsg)) {
+            if (cmsg->cmsg_level != SOL_SOCKET || cmsg->cmsg_type != SCM_RIGHTS)
+                continue;
+
+            int *received = (int *) CMSG_DATA(cmsg);
+            size_t nreceived = (cmsg->cmsg_len - CMSG_LEN(0)) / sizeof(int);
+            for (size_t i = 0; i < nreceived; i++) {
+                if (*nfds < max_fds)
+                    fds[(*nfds)++] = received[i];
+                else
+                    close(received[i]);
+            }
+        }
+
+        if (n <= 0)
+            return total ? -1 : 0;
+        total += n;
+    }
+    return 1;
+}
+
+/* A buffer that grows as output is read into it. */
+struct buffer {
+    char *data;
+    size_t len, cap;
+};
+
+/* Reads what's available from `fd` into `buf`. Returns 0 once `fd` is at EOF. */
+static int buffer_read(int fd, struct buffer *buf) {
+    if (buf->len == buf->cap) {
+        buf->cap = buf->cap ? 2 * buf->cap : 256;
+        buf->data = realloc(buf->data, buf->cap);
+        if (!buf->data)
+            fail(2, "Out of memory\n");
+    }
+
+    ssize_t n = read(fd, buf->data + buf->len, buf->cap - buf->len);
+    if (n == -1 && errno == EINTR)
+        return 1;
+    if (n <= 0)
+        return 0;
+    buf->len += n;
+    return 1;
+}
+
+/* Runs a single request of the supervisor in a forked child, so that none of
+   the global state leaks into the next request. The program reads from and
+   writes to `in_fd` and `out_fd` instead of its files unless they are -1. */
+static void serve_job(const struct request *req, char *payload, size_t len, int in_fd, int out_fd) {
+    char *strings[3 + req->argc + req->nbinds], *ptr = payload, *end = payload + len;
+    for (uint32_t i = 0; i < 2 + req->argc + req->nbinds; i++) {
+        if (ptr >= end)
+            fail(2, "Malformed request\n");
+        strings[i] = ptr;
+        ptr += strnlen(ptr, end - ptr) + 1;
+    }
+
+    int out_pipe[2], err_pipe[2];
+    if (pipe(out_pipe) == -1 || pipe(err_pipe) == -1)
+        fail(2, "Failed to create job pipes: %m\n");
+
+    pid_t pid = fork();
+    if (pid == -1)
+        fail(2, "fork(): %m\n");
+
+    if (pid == 0) {
+        int null_fd = open("/dev/null", O_RDONLY);
+        if (null_fd == -1 || dup2(null_fd, STDIN_FILENO) == -1 ||
+            dup2(out_pipe[1], STDOUT_FILENO) == -1 || dup2(err_pipe[1], STDERR_FILENO) == -1)
+            _exit(2);
+        close(null_fd);
+        close(out_pipe[0]); close(out_pipe[1]);
+        close(err_pipe[0]); close(err_pipe[1]);
+
+        stdin_fd = in_fd;
+        stdout_fd = out_fd;
+        box_root = strings[0];
+        box_name = strings[1];
+        command = strings + 2;
+        // The binds follow the command, which is then terminated in their place.
+        for (uint32_t i = 0; i < req->nbinds; i++)
+            add_bind(command[req->argc + i]);
+        command[req->argc] = NULL;
+        cpu_time_limit_ns = 1000000LL * req->cpu_time_limit_ms;
+        real_time_limit_ns = 1000000LL * req->real_time_limit_ms;
+        memory_limit_kb = req->memory_limit_kb;
+        max_fsize_kb = req->max_fsize_kb;
+        max_pids = req->max_pids;
+
+        dispatch(req->mode);
+        exit(0);
+    }
+
+    close(out_pipe[1]); close(err_pipe[1]);
+    if (in_fd != -1)
+        close(in_fd);
+    if (out_fd != -1)
+        close(out_fd);
+
+    // Collect the output of the job. Anything the caller sends in the meantime
+    // asks to stop the program early, just like SIGTERM does to `sandbox --run`.
+    struct buffer bufs[2] = { { 0 } };
+    struct pollfd pfds[3] = {
+        { .fd = out_pipe[0], .events = POLLIN },
+        { .fd = err_pipe[0], .events = POLLIN },
+        { .fd = STDIN_FILENO, .events = POLLIN }
+    };
+    uint32_t aborted = 0;
+
+    for (int open_pipes = 2; open_pipes; ) {
+        if (poll(pfds, 3, -1) == -1) {
+            if (errno == EINTR)
+                continue;
+            fail(2, "poll(): %m\n");
+        }
+
+        for (int i = 0; i < 2; i++) {
+            if (pfds[i].revents && !buffer_read(pfds[i].fd, &bufs[i])) {
+                close(pfds[i].fd);
+                pfds[i].fd = -1;
+                open_pipes--;
+            }
+        }
+
+        if (pfds[2].revents) {
+            char c;
+            ssize_t n = read(STDIN_FILENO, &c, 1);
+            if (n == -1 && errno == EINTR)
+                continue;
+            // If the caller is gone, there's no one left to wait for the job.
+            if (n == 1)
+                aborted = 1;
+            else
+                pfds[2].fd = -1;
+            kill(pid, SIGTERM);
+        }
+    }
+
+    int status;
+    while (waitpid(pid, &status, 0) == -1)
+        if (errno != EINTR)
+            fail(2, "waitpid(): %m\n");
+
+    struct response res;
+    res.status = WIFEXITED(status) ? WEXITSTATUS(status) : 2;
+    res.aborted = aborted;
+
+    struct buffer *body = &bufs[res.status ? 1 : 0];
+    res.size = sizeof(res) + body->len;
+
+    if (write_full(STDOUT_FILENO, &res, sizeof(res)) == -1 ||
+        write_full(STDOUT_FILENO, body->data, body->len) == -1)
+        fail(2, "Failed to write response: %m\n");
+
+    free(bufs[0].data); free(bufs[1].data);
+}
+
+/* Serves requests from stdin until it is closed, replying on stdout. This saves
+   the caller from spawning (and us from parsing the options of) a new sandbox
+   process for every job. If stdin is a Unix socket, the caller may also send
+   the program's stdin and stdout with a request (see `struct request`). */
+static void serve() {
+    // Announce ourselves so the caller knows that this mode is supported.
+    uint32_t version = SERVE_VERSION;
+    if (write_full(STDOUT_FILENO, &version, sizeof(version)) == -1)
+        fail(2, "Failed to write version: %m\n");
+
+    struct request req;
+    int ret, fds[2], nfds;
+
+    while ((ret = recv_full(STDIN_FILENO, &req, sizeof(req), fds, 2, &nfds)) == 1) {
+        if (req.size < sizeof(req))
+            fail(2, "Malformed request\n");
+
+        int in_fd = -1, out_fd = -1, next = 0;
+        if ((req.fds & PASS_STDIN) && next < nfds)
+            in_fd = fds[next++];
+        if ((req.fds & PASS_STDOUT) && next < nfds)
+            out_fd = fds[next++];
+        if (next != nfds || __builtin_popcount(req.fds & (PASS_STDIN | PASS_STDOUT)) != nfds)
+            fail(2, "Malformed request\n");
+
+        size_t len = req.size - sizeof(req);
+        char *payload = malloc(len + 1);
+        if (!payload)
+            fail(2, "Out of memory\n");
+        if (len && read_full(STDIN_FILENO, payload, len) != 1)
+            fail(2, "Truncated request\n");
+        payload[len] = '\0';
+
+        serve_job(&req, payload, len, in_fd, out_fd);
+        free(payload);
+    }
+
+    if (ret == -1)
+        fail(2, "Truncated request\n");
+}
+
 int main(int argc, char *argv[]) {
     if (getuid() != 0 || getgid() != 0)
         fail(1, "You must run this program as root.\n");
@@ -413,10 +940,14 @@ int main(int argc, char *argv[]) {
         case 'D':
         case 'I':
         case 'R':
+        case 'S':
             if (mode)
-                fail(1, "Please specify a single mode (-D/-I/-R).\n");
+                fail(1, "Please specify a single mode (-D/-I/-R/-S).\n");
             mode = opt;
             break;
+        case 'B':
+            add_bind(optarg);
+            break;
         case 'b':
             box_name = optarg;
             break;
@@ -426,9 +957,15 @@ int main(int argc, char *argv[]) {
         case 'f':
             max_fsize_kb = uint_parse(optarg);
             break;
+        case 'i':
+            stdin_fd = uint_parse(optarg);
+            break;
         case 'm':
             memory_limit_kb = uint_parse(optarg);
             break;
+        case 'o':
+            stdout_fd = uint_parse(optarg);
+            break;
         case 'p':
             max_pids = uint_parse(optarg);
             break;
@@ -441,20 +978,14 @@ int main(int argc, char *argv[]) {
         }
     }
 
-    snprintf(box_path, sizeof(box_path), "%s/%s", box_root, box_name);
-
-    switch (mode) {
-    case 'D':
-        delete();
-        break;
-    case 'I':
-        init();
-        break;
-    case 'R':
-        command = argv + optind;
-        run();
-        break;
+    if (mode == 'S') {
+        binary_output = 1;
+        serve();
+        return 0;
     }
 
+    command = argv + optind;
+    dispatch(mode);
+
     return 0;
 }